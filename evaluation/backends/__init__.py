@@ -0,0 +1,32 @@
+from .base import InferenceBackend
+from .cached import RESPONSE_CACHE_MODES, CachedBackend
+from .local import TransformersBackend
+from .openai_compatible import OpenAIBackend
+
+__all__ = [
+    "CachedBackend",
+    "InferenceBackend",
+    "OpenAIBackend",
+    "RESPONSE_CACHE_MODES",
+    "TransformersBackend",
+    "get_backend",
+]
+
+BACKENDS = {
+    "openai": OpenAIBackend,
+    "transformers": TransformersBackend,
+}
+
+
+def get_backend(name: str, **kwargs) -> InferenceBackend:
+    """Create an inference backend by name.
+
+    Args:
+        name (str): One of `BACKENDS`.
+        **kwargs: The options of the backend class.
+    Returns:
+        InferenceBackend: The backend.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend: {name}. Choose from {sorted(BACKENDS)}")
+    return BACKENDS[name](**kwargs)
@@ -0,0 +1,107 @@
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from openai import NOT_GIVEN
+from openai.types import CompletionUsage
+
+
+class InferenceBackend:
+    """Interface of the inference backends used by the answer generation methods.
+
+    A backend answers chat messages and returns `(output, usage, error)` like
+    `evaluation.utils.openai_chat_completion`, where `usage` exposes
+    `prompt_tokens` and `completion_tokens`. Generation ends before the first
+    of the `stop` sequences, which are excluded from the output.
+    `sample_completions` returns several sampled outputs of the same messages;
+    backends that cannot sample them in one request send one request each.
+
+    Attributes:
+        name (str): The backend name recorded with the predictions.
+    """
+
+    name: str = "base"
+
+    def chat_completion(
+        self,
+        model_name: str,
+        messages: List[Dict],
+        seed: Optional[int] = NOT_GIVEN,
+        json_response: bool = False,
+        stop: Optional[List[str]] = None,
+    ) -> Tuple[Optional[str], Optional[object], Optional[Exception]]:
+        raise NotImplementedError
+
+    async def chat_completion_async(
+        self,
+        model_name: str,
+        messages: List[Dict],
+        seed: Optional[int] = NOT_GIVEN,
+        json_response: bool = False,
+        stop: Optional[List[str]] = None,
+    ) -> Tuple[Optional[str], Optional[object], Optional[Exception]]:
+        return await asyncio.to_thread(
+            self.chat_completion,
+            model_name,
+            messages,
+            seed=seed,
+            json_response=json_response,
+            stop=stop,
+        )
+
+    def sample_completions(
+        self,
+        model_name: str,
+        messages: List[Dict],
+        n: int,
+        temperature: Optional[float] = None,
+        seed: Optional[int] = NOT_GIVEN,
+        stop: Optional[List[str]] = None,
+    ) -> Tuple[Optional[List[str]], Optional[object], Optional[Exception]]:
+        """Return `n` outputs of `messages` and their summed usage.
+
+        Defaults to one `chat_completion` per sample at the backend's own
+        sampling settings, so `temperature` is ignored.
+        """
+        outputs, usages = [], []
+        for _ in range(n):
+            output, usage, error = self.chat_completion(
+                model_name, messages, seed=seed, stop=stop
+            )
+            if error is not None:
+                return None, _sum_usage(usages), error
+            outputs.append(output)
+            usages.append(usage)
+        return outputs, _sum_usage(usages), None
+
+    async def sample_completions_async(
+        self,
+        model_name: str,
+        messages: List[Dict],
+        n: int,
+        temperature: Optional[float] = None,
+        seed: Optional[int] = NOT_GIVEN,
+        stop: Optional[List[str]] = None,
+    ) -> Tuple[Optional[List[str]], Optional[object], Optional[Exception]]:
+        results = await asyncio.gather(
+            *(
+                self.chat_completion_async(model_name, messages, seed=seed, stop=stop)
+                for _ in range(n)
+            )
+        )
+        usages = [usage for _, usage, _ in results if usage is not None]
+        for _, _, error in results:
+            if error is not None:
+                return None, _sum_usage(usages), error
+        return [output for output, _, _ in results], _sum_usage(usages), None
+
+
+def _sum_usage(usages: List[object]) -> Optional[CompletionUsage]:
+    if not usages:
+        return None
+    prompt_tokens = sum(usage.prompt_tokens for usage in usages)
+    completion_tokens = sum(usage.completion_tokens for usage in usages)
+    return CompletionUsage(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens,
+    )
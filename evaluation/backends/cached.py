@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from datasets import config
+from openai import NOT_GIVEN
+from openai.types import CompletionUsage
+
+from ..sqlite_cache import SQLiteCache
+from ..tracking import record_cache_hit
+from .base import InferenceBackend
+
+# "read-only" replays the cached responses without storing new ones,
+# "write-through" also stores every new response.
+RESPONSE_CACHE_MODES = ["off", "read-only", "write-through"]
+
+
+def default_response_cache_path() -> str:
+    return os.path.join(config.HF_DATASETS_CACHE, "crest_responses", "responses.sqlite")
+
+
+class CachedBackend(InferenceBackend):
+    """Answers repeated requests of another backend from a persistent cache.
+
+    Responses are keyed on the backend, its endpoint, the model, a hash of
+    the messages and every sampling option (seed, temperature, n, stop
+    sequences, JSON mode), so only identical requests are replayed. Failed
+    calls are never cached. A replayed call reports the usage of the
+    original response and is counted in `UsageTracker.cache_hits`.
+
+    Args:
+        backend (InferenceBackend): The backend answering the cache misses.
+        cache (SQLiteCache): The response store.
+        mode (str, optional): "read-only" or "write-through". Defaults to "write-through".
+    """
+
+    def __init__(
+        self, backend: InferenceBackend, cache: SQLiteCache, mode: str = "write-through"
+    ):
+        if mode not in RESPONSE_CACHE_MODES[1:]:
+            raise ValueError(
+                f"Invalid response cache mode: {mode}. Choose from {RESPONSE_CACHE_MODES[1:]}"
+            )
+        self.backend = backend
+        self.cache = cache
+        self.mode = mode
+        self.name = backend.name
+
+    def _key(self, model_name: str, messages: List[Dict], **options) -> str:
+        messages_hash = hashlib.sha256(
+            json.dumps(messages, ensure_ascii=False, sort_keys=True).encode()
+        ).hexdigest()
+        options = {
+            key: None if value is NOT_GIVEN else value for key, value in options.items()
+        }
+        fields = [
+            self.backend.name,
+            getattr(self.backend, "base_url", None),
+            model_name,
+            messages_hash,
+            options,
+        ]
+        return hashlib.sha256(
+            json.dumps(fields, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def _lookup(self, key: str):
+        if (cached := self.cache.get(key)) is None:
+            return None
+        cached = json.loads(cached)
+        record_cache_hit()
+        usage = CompletionUsage(
+            prompt_tokens=cached["prompt_tokens"],
+            completion_tokens=cached["completion_tokens"],
+            total_tokens=cached["prompt_tokens"] + cached["completion_tokens"],
+        )
+        return cached["output"], usage, None
+
+    def _store(self, key: str, result: tuple) -> tuple:
+        output, usage, error = result
+        if self.mode == "write-through" and error is None and output is not None:
+            entry = {
+                "output": output,
+                "prompt_tokens": usage.prompt_tokens,
+                "completion_tokens": usage.completion_tokens,
+            }
+            self.cache.put(key, json.dumps(entry, ensure_ascii=False))
+        return result
+
+    def chat_completion(
+        self,
+        model_name: str,
+        messages: List[Dict],
+        seed: Optional[int] = NOT_GIVEN,
+        json_response: bool = False,
+        stop: Optional[List[str]] = None,
+    ) -> Tuple[Optional[str], Optional[object], Optional[Exception]]:
+        key = self._key(
+            model_name, messages, seed=seed, json_response=json_response, stop=stop
+        )
+        if (cached := self._lookup(key)) is not None:
+            return cached
+        return self._store(
+            key,
+            self.backend.chat_completion(
+                model_name, messages, seed=seed, json_response=json_response, stop=stop
+            ),
+        )
+
+    async def chat_completion_async(
+        self,
+        model_name: str,
+        messages: List[Dict],
+        seed: Optional[int] = NOT_GIVEN,
+        json_response: bool = False,
+        stop: Optional[List[str]] = None,
+    ) -> Tuple[Optional[str], Optional[object], Optional[Exception]]:
+        key = self._key(
+            model_name, messages, seed=seed, json_response=json_response, stop=stop
+        )
+        if (cached := self._lookup(key)) is not None:
+            return cached
+        return self._store(
+            key,
+            await self.backend.chat_completion_async(
+                model_name, messages, seed=seed, json_response=json_response, stop=stop
+            ),
+        )
+
+    def sample_completions(
+        self,
+        model_name: str,
+        messages: List[Dict],
+        n: int,
+        temperature: Optional[float] = None,
+        seed: Optional[int] = NOT_GIVEN,
+        stop: Optional[List[str]] = None,
+    ) -> Tuple[Optional[List[str]], Optional[object], Optional[Exception]]:
+        key = self._key(
+            model_name, messages, n=n, temperature=temperature, seed=seed, stop=stop
+        )
+        if (cached := self._lookup(key)) is not None:
+            return cached
+        return self._store(
+            key,
+            self.backend.sample_completions(
+                model_name, messages, n, temperature=temperature, seed=seed, stop=stop
+            ),
+        )
+
+    async def sample_completions_async(
+        self,
+        model_name: str,
+        messages: List[Dict],
+        n: int,
+        temperature: Optional[float] = None,
+        seed: Optional[int] = NOT_GIVEN,
+        stop: Optional[List[str]] = None,
+    ) -> Tuple[Optional[List[str]], Optional[object], Optional[Exception]]:
+        key = self._key(
+            model_name, messages, n=n, temperature=temperature, seed=seed, stop=stop
+        )
+        if (cached := self._lookup(key)) is not None:
+            return cached
+        return self._store(
+            key,
+            await self.backend.sample_completions_async(
+                model_name, messages, n, temperature=temperature, seed=seed, stop=stop
+            ),
+        )
@@ -0,0 +1,220 @@
+import asyncio
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+import weakref
+
+from openai import NOT_GIVEN
+from openai.types import CompletionUsage
+
+from ..tracking import record_timing
+from .base import InferenceBackend
+
+
+class TransformersBackend(InferenceBackend):
+    """In-process generation with a `transformers` causal language model.
+
+    Concurrent `chat_completion_async` calls are collected for up to
+    `batch_wait` seconds and answered together by one left-padded `generate`
+    call of at most `batch_size` prompts, so running the methods with
+    `--execution async` batches many examples without any HTTP round trip.
+    Decoding is greedy, hence deterministic and independent of the seed.
+
+    Args:
+        model_name_or_path (str): The model name on the Hugging Face Hub or a local path.
+        device (str, optional): The torch device. Defaults to "cpu".
+        max_new_tokens (int, optional): The maximum number of generated tokens. Defaults to 1024.
+        batch_size (int, optional): The maximum number of prompts per `generate` call. Defaults to 8.
+        batch_wait (float, optional): Seconds to wait for more prompts before generating. Defaults to 0.05.
+        torch_dtype (str, optional): The torch dtype of the weights. Defaults to "auto".
+    """
+
+    name = "transformers"
+
+    def __init__(
+        self,
+        model_name_or_path: str,
+        device: str = "cpu",
+        max_new_tokens: int = 1024,
+        batch_size: int = 8,
+        batch_wait: float = 0.05,
+        torch_dtype: str = "auto",
+    ):
+        self.model_name_or_path = model_name_or_path
+        self.device = device
+        self.max_new_tokens = max_new_tokens
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.torch_dtype = torch_dtype
+        self._model = None
+        self._tokenizer = None
+        self._load_lock = threading.Lock()
+        self._generate_lock = threading.Lock()
+        self._queues: (
+            "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Queue]"
+        ) = weakref.WeakKeyDictionary()
+
+    def __getstate__(self) -> dict:
+        # Worker processes load their own copy of the model on first use
+        state = self.__dict__.copy()
+        state.update(_model=None, _tokenizer=None, _queues=None)
+        state.pop("_load_lock")
+        state.pop("_generate_lock")
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._load_lock = threading.Lock()
+        self._generate_lock = threading.Lock()
+        self._queues = weakref.WeakKeyDictionary()
+
+    def load(self) -> None:
+        """Load the tokenizer and the model if they are not loaded yet."""
+        with self._load_lock:
+            if self._model is not None:
+                return
+            try:
+                from transformers import AutoModelForCausalLM, AutoTokenizer
+            except ImportError as e:
+                raise ImportError(
+                    "The transformers backend requires `torch` and `transformers`."
+                ) from e
+
+            print(f"[+] Loading {self.model_name_or_path} on {self.device}")
+            tokenizer = AutoTokenizer.from_pretrained(
+                self.model_name_or_path, padding_side="left"
+            )
+            if tokenizer.pad_token is None:
+                tokenizer.pad_token = tokenizer.eos_token
+            model = AutoModelForCausalLM.from_pretrained(
+                self.model_name_or_path, torch_dtype=self.torch_dtype
+            )
+            model.to(self.device).eval()
+            self._tokenizer = tokenizer
+            self._model = model
+
+    def generate_batch(
+        self, batch_messages: List[List[Dict]], stop: Optional[List[str]] = None
+    ) -> List[Tuple[str, CompletionUsage]]:
+        """Answer several conversations with a single `generate` call.
+
+        Args:
+            batch_messages (List[List[Dict]]): The messages of each conversation.
+            stop (Optional[List[str]], optional): Stop sequences, excluded from the outputs. Defaults to None.
+        Returns:
+            List[Tuple[str, CompletionUsage]]: The output and usage of each conversation.
+        """
+        import torch
+
+        self.load()
+        prompts = [
+            self._tokenizer.apply_chat_template(
+                messages, tokenize=False, add_generation_prompt=True
+            )
+            for messages in batch_messages
+        ]
+        inputs = self._tokenizer(
+            prompts, return_tensors="pt", padding=True, add_special_tokens=False
+        ).to(self.device)
+        with self._generate_lock, torch.inference_mode():
+            output_ids = self._model.generate(
+                **inputs,
+                max_new_tokens=self.max_new_tokens,
+                do_sample=False,
+                pad_token_id=self._tokenizer.pad_token_id,
+                **(
+                    {"stop_strings": stop, "tokenizer": self._tokenizer} if stop else {}
+                ),
+            )
+        # Left padding aligns every prompt to end at the same position
+        generated_ids = output_ids[:, inputs["input_ids"].shape[1] :]
+
+        results = []
+        for prompt_mask, ids in zip(inputs["attention_mask"], generated_ids):
+            prompt_tokens = int(prompt_mask.sum())
+            completion_tokens = int((ids != self._tokenizer.pad_token_id).sum())
+            output = self._tokenizer.decode(ids, skip_special_tokens=True)
+            for stop_string in stop or []:
+                output = output.split(stop_string)[0]
+            results.append(
+                (
+                    output,
+                    CompletionUsage(
+                        prompt_tokens=prompt_tokens,
+                        completion_tokens=completion_tokens,
+                        total_tokens=prompt_tokens + completion_tokens,
+                    ),
+                )
+            )
+        return results
+
+    def chat_completion(
+        self,
+        model_name: str,
+        messages: List[Dict],
+        seed: Optional[int] = NOT_GIVEN,
+        json_response: bool = False,
+        stop: Optional[List[str]] = None,
+    ) -> Tuple[Optional[str], Optional[object], Optional[Exception]]:
+        start = time.monotonic()
+        try:
+            output, usage = self.generate_batch([messages], stop)[0]
+        except Exception as e:
+            print(f"[!] Generation failed: {e}", file=sys.stderr)
+            return None, None, e
+        record_timing(time.monotonic() - start)
+        return output, usage, None
+
+    async def chat_completion_async(
+        self,
+        model_name: str,
+        messages: List[Dict],
+        seed: Optional[int] = NOT_GIVEN,
+        json_response: bool = False,
+        stop: Optional[List[str]] = None,
+    ) -> Tuple[Optional[str], Optional[object], Optional[Exception]]:
+        loop = asyncio.get_running_loop()
+        if loop not in self._queues:
+            self._queues[loop] = asyncio.Queue()
+            loop.create_task(self._drain(self._queues[loop]))
+        start = time.monotonic()
+        future = loop.create_future()
+        await self._queues[loop].put((messages, stop, future))
+        output, usage, error = await future
+        if error is None:
+            record_timing(time.monotonic() - start)
+        return output, usage, error
+
+    async def _drain(self, queue: asyncio.Queue) -> None:
+        """Group the queued conversations into batches and answer them."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.batch_wait
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(
+                        await asyncio.wait_for(
+                            queue.get(), max(deadline - loop.time(), 0)
+                        )
+                    )
+                except asyncio.TimeoutError:
+                    break
+
+            # Requests of the same method share their stop sequences
+            stop = sorted({s for _, stops, _ in batch for s in stops or []})
+            try:
+                results = await asyncio.to_thread(
+                    self.generate_batch,
+                    [messages for messages, _, _ in batch],
+                    stop or None,
+                )
+            except Exception as e:
+                print(f"[!] Generation failed: {e}", file=sys.stderr)
+                results = [(None, None, e)] * len(batch)
+            else:
+                results = [(output, usage, None) for output, usage in results]
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
@@ -0,0 +1,117 @@
+from typing import Dict, List, Optional, Tuple
+
+from openai import NOT_GIVEN
+
+from ..utils import openai_chat_completion, openai_chat_completion_async
+from .base import InferenceBackend
+
+
+class OpenAIBackend(InferenceBackend):
+    """The OpenAI API or any OpenAI-compatible server (vLLM, llama.cpp, ...).
+
+    Args:
+        base_url (Optional[str], optional): The server URL, e.g. `http://localhost:8000/v1`. Defaults to the OpenAI API.
+        api_key (Optional[str], optional): The API key. Defaults to the `OPENAI_API_KEY` environment variable.
+        stream (bool, optional): Stream the responses to measure the time to first token and
+            to enforce the stop sequences client-side. Defaults to False.
+    """
+
+    name = "openai"
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        stream: bool = False,
+    ):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.stream = stream
+
+    def chat_completion(
+        self,
+        model_name: str,
+        messages: List[Dict],
+        seed: Optional[int] = NOT_GIVEN,
+        json_response: bool = False,
+        stop: Optional[List[str]] = None,
+    ) -> Tuple[Optional[str], Optional[object], Optional[Exception]]:
+        return openai_chat_completion(
+            model_name=model_name,
+            messages=messages,
+            seed=seed,
+            json_response=json_response,
+            base_url=self.base_url,
+            api_key=self.api_key,
+            stream=self.stream,
+            stop=stop,
+        )
+
+    async def chat_completion_async(
+        self,
+        model_name: str,
+        messages: List[Dict],
+        seed: Optional[int] = NOT_GIVEN,
+        json_response: bool = False,
+        stop: Optional[List[str]] = None,
+    ) -> Tuple[Optional[str], Optional[object], Optional[Exception]]:
+        return await openai_chat_completion_async(
+            model_name=model_name,
+            messages=messages,
+            seed=seed,
+            json_response=json_response,
+            base_url=self.base_url,
+            api_key=self.api_key,
+            stream=self.stream,
+            stop=stop,
+        )
+
+    def sample_completions(
+        self,
+        model_name: str,
+        messages: List[Dict],
+        n: int,
+        temperature: Optional[float] = None,
+        seed: Optional[int] = NOT_GIVEN,
+        stop: Optional[List[str]] = None,
+    ) -> Tuple[Optional[List[str]], Optional[object], Optional[Exception]]:
+        """Sample `n` outputs in one request, sharing its prompt tokens."""
+        outputs, usage, error = openai_chat_completion(
+            model_name=model_name,
+            messages=messages,
+            seed=seed,
+            base_url=self.base_url,
+            api_key=self.api_key,
+            stream=self.stream,
+            stop=stop,
+            n=n,
+            temperature=NOT_GIVEN if temperature is None else temperature,
+        )
+        return _as_list(outputs), usage, error
+
+    async def sample_completions_async(
+        self,
+        model_name: str,
+        messages: List[Dict],
+        n: int,
+        temperature: Optional[float] = None,
+        seed: Optional[int] = NOT_GIVEN,
+        stop: Optional[List[str]] = None,
+    ) -> Tuple[Optional[List[str]], Optional[object], Optional[Exception]]:
+        outputs, usage, error = await openai_chat_completion_async(
+            model_name=model_name,
+            messages=messages,
+            seed=seed,
+            base_url=self.base_url,
+            api_key=self.api_key,
+            stream=self.stream,
+            stop=stop,
+            n=n,
+            temperature=NOT_GIVEN if temperature is None else temperature,
+        )
+        return _as_list(outputs), usage, error
+
+
+def _as_list(outputs) -> Optional[List[str]]:
+    # A server may ignore `n` and answer a single choice
+    return [outputs] if isinstance(outputs, str) else outputs
@@ -0,0 +1,379 @@
+import asyncio
+import contextvars
+import json
+import os
+import sys
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+import uuid
+
+from openai import NOT_GIVEN
+from openai.types.chat import ChatCompletion, ChatCompletionMessageParam
+
+from .clients import get_client
+from .retry import PredictionError
+
+# Batch jobs accept at most 50,000 requests and 200 MB per input file; the
+# byte budget leaves room for the multipart upload around the file
+MAX_REQUESTS_PER_BATCH = 50_000
+MAX_BYTES_PER_BATCH = 190 * 1024 * 1024
+# Event loop iterations without new requests before a round is considered complete
+SETTLE_ITERATIONS = 10
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+_active_collector: contextvars.ContextVar[Optional["BatchCollector"]] = (
+    contextvars.ContextVar("active_batch_collector", default=None)
+)
+
+
+def get_active_collector() -> Optional["BatchCollector"]:
+    """Return the batch collector of the running batch round, if any."""
+    return _active_collector.get()
+
+
+def build_batch_request(
+    custom_id: str,
+    model_name: str,
+    messages: Iterable[ChatCompletionMessageParam],
+    seed: Optional[int] = NOT_GIVEN,
+    json_response: bool = False,
+    stop: Optional[List[str]] = None,
+    n: int = 1,
+    temperature: Optional[float] = NOT_GIVEN,
+    max_tokens: Optional[int] = NOT_GIVEN,
+) -> dict:
+    """Build one line of a Batch API input file for the chat completions endpoint."""
+    body = {"model": model_name, "messages": list(messages)}
+    if seed is not NOT_GIVEN and seed is not None:
+        body["seed"] = seed
+    if json_response:
+        body["response_format"] = {"type": "json_object"}
+    if stop:
+        body["stop"] = stop
+    if n > 1:
+        body["n"] = n
+    if temperature is not NOT_GIVEN and temperature is not None:
+        body["temperature"] = temperature
+    if max_tokens is not NOT_GIVEN and max_tokens is not None:
+        body["max_completion_tokens"] = max_tokens
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": body,
+    }
+
+
+def split_batch_lines(
+    requests: List[dict],
+    max_requests: int = MAX_REQUESTS_PER_BATCH,
+    max_bytes: int = MAX_BYTES_PER_BATCH,
+) -> List[List[bytes]]:
+    """Serialize batch requests into the lines of as few input files as the limits allow.
+
+    Args:
+        requests (List[dict]): The batch requests.
+        max_requests (int, optional): The requests of a file. Defaults to `MAX_REQUESTS_PER_BATCH`.
+        max_bytes (int, optional): The bytes of a file. Defaults to `MAX_BYTES_PER_BATCH`.
+    Returns:
+        List[List[bytes]]: The JSONL lines of every input file.
+    """
+    files: List[List[bytes]] = []
+    size = 0
+    for request in requests:
+        line = (json.dumps(request, ensure_ascii=False) + "\n").encode()
+        if not files or len(files[-1]) >= max_requests or size + len(line) > max_bytes:
+            if files and len(line) > max_bytes:
+                print(
+                    f"[!] Batch request {request['custom_id']} alone exceeds"
+                    f" {max_bytes} bytes",
+                    file=sys.stderr,
+                )
+            files.append([])
+            size = 0
+        files[-1].append(line)
+        size += len(line)
+    return files
+
+
+def parse_batch_output(
+    line: dict,
+) -> Tuple[Optional[str], Optional[object], Optional[Exception]]:
+    """Parse one line of a Batch API output file into (output, usage, error).
+
+    The output of a request with several choices is the list of their contents.
+    """
+    response = line.get("response") or {}
+    if line.get("error") or response.get("status_code") != 200:
+        message = json.dumps(line.get("error") or response.get("body"))
+        status_code = response.get("status_code") or 0
+        category = "server" if status_code >= 500 else "bad_request"
+        return None, None, PredictionError(message, category)
+    completion = ChatCompletion.model_validate(response["body"])
+    if len(completion.choices) > 1:
+        outputs = [choice.message.content for choice in completion.choices]
+        return outputs, completion.usage, None
+    return completion.choices[0].message.content, completion.usage, None
+
+
+class OpenAIBatchEndpoint:
+    """The OpenAI Batch API.
+
+    Args:
+        completion_window (str, optional): The batch completion window. Defaults to "24h".
+    """
+
+    def __init__(self, completion_window: str = "24h"):
+        self.completion_window = completion_window
+
+    def submit(self, input_path: str) -> str:
+        client = get_client()
+        with open(input_path, "rb") as f:
+            input_file = client.files.create(file=f, purpose="batch")
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return get_client().batches.retrieve(batch_id).status
+
+    def results(self, batch_id: str) -> List[dict]:
+        client = get_client()
+        batch = client.batches.retrieve(batch_id)
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id is None:
+                continue
+            content = client.files.content(file_id).text
+            lines.extend(json.loads(line) for line in content.splitlines() if line)
+        return lines
+
+
+class LocalBatchEndpoint:
+    """A file-based stand-in for the Batch API.
+
+    Each submitted input file is answered line by line by `responder` and the
+    results are written next to it in the Batch API output format. Useful for
+    tests and for OpenAI-compatible servers without a batch endpoint.
+
+    Args:
+        responder (Optional[Callable[[dict], Tuple[str, object, Optional[Exception]]]], optional):
+            Maps a request body to (output, usage, error). Defaults to a regular chat completion call.
+    """
+
+    def __init__(
+        self,
+        responder: Optional[
+            Callable[[dict], Tuple[Optional[str], object, Optional[Exception]]]
+        ] = None,
+    ):
+        self.responder = responder or self._chat_completion
+
+    @staticmethod
+    def _chat_completion(
+        body: dict,
+    ) -> Tuple[Optional[str], object, Optional[Exception]]:
+        from .utils import openai_chat_completion
+
+        return openai_chat_completion(
+            model_name=body["model"],
+            messages=body["messages"],
+            seed=body.get("seed", NOT_GIVEN),
+            json_response="response_format" in body,
+            stop=body.get("stop"),
+            n=body.get("n", 1),
+            temperature=body.get("temperature", NOT_GIVEN),
+            max_tokens=body.get("max_completion_tokens", NOT_GIVEN),
+        )
+
+    def submit(self, input_path: str) -> str:
+        output_path = input_path.rsplit(".", 1)[0] + ".output.jsonl"
+        with open(input_path) as src, open(output_path, "w") as dst:
+            for line in src:
+                request = json.loads(line)
+                output, usage, error = self.responder(request["body"])
+                dst.write(
+                    json.dumps(self._format_output(request, output, usage, error))
+                    + "\n"
+                )
+        return output_path
+
+    def status(self, batch_id: str) -> str:
+        return "completed" if os.path.exists(batch_id) else "failed"
+
+    def results(self, batch_id: str) -> List[dict]:
+        with open(batch_id) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    @staticmethod
+    def _format_output(
+        request: dict, output: Optional[str], usage: object, error: Optional[Exception]
+    ) -> dict:
+        if error is not None:
+            return {
+                "id": f"batch_req_{uuid.uuid4().hex}",
+                "custom_id": request["custom_id"],
+                "response": None,
+                "error": {"code": "local_error", "message": str(error)},
+            }
+        if usage is not None and hasattr(usage, "model_dump"):
+            usage = usage.model_dump()
+        return {
+            "id": f"batch_req_{uuid.uuid4().hex}",
+            "custom_id": request["custom_id"],
+            "response": {
+                "status_code": 200,
+                "request_id": uuid.uuid4().hex,
+                "body": {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request["body"]["model"],
+                    "choices": [
+                        {
+                            "index": index,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }
+                        for index, content in enumerate(
+                            output if isinstance(output, list) else [output]
+                        )
+                    ],
+                    "usage": usage,
+                },
+            },
+            "error": None,
+        }
+
+
+class BatchCollector:
+    """Runs coroutines whose completion calls are answered by batch jobs.
+
+    While a batch round is active, `openai_chat_completion_async` hands its
+    requests to the collector instead of calling the API. Once every running
+    coroutine is waiting on a request, the pending requests are written to
+    JSONL, submitted as batch jobs and polled; the answers then resume the
+    coroutines, which may issue the requests of their next step. Multi-step
+    methods therefore run one batch round per dependent step.
+
+    Args:
+        endpoint (OpenAIBatchEndpoint | LocalBatchEndpoint): The batch endpoint.
+        batch_dir (str): The directory for the batch input files.
+        poll_interval (float, optional): Seconds between two status checks. Defaults to 60.
+    """
+
+    def __init__(self, endpoint, batch_dir: str, poll_interval: float = 60.0):
+        self.endpoint = endpoint
+        self.batch_dir = batch_dir
+        self.poll_interval = poll_interval
+        self.num_rounds = 0
+        self._pending: Dict[str, Tuple[dict, asyncio.Future]] = {}
+
+    async def chat_completion(
+        self,
+        model_name: str,
+        messages: Iterable[ChatCompletionMessageParam],
+        seed: Optional[int] = NOT_GIVEN,
+        json_response: bool = False,
+        stop: Optional[List[str]] = None,
+        n: int = 1,
+        temperature: Optional[float] = NOT_GIVEN,
+        max_tokens: Optional[int] = NOT_GIVEN,
+    ) -> Tuple[Optional[str], Optional[object], Optional[Exception]]:
+        custom_id = f"request-{uuid.uuid4().hex}"
+        request = build_batch_request(
+            custom_id,
+            model_name,
+            messages,
+            seed=seed,
+            json_response=json_response,
+            stop=stop,
+            n=n,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        future = asyncio.get_running_loop().create_future()
+        self._pending[custom_id] = (request, future)
+        return await future
+
+    async def run(self, coroutines: Iterable[Awaitable]) -> List:
+        """Run the coroutines to completion, batching their completion calls.
+
+        Args:
+            coroutines (Iterable[Awaitable]): The coroutines to run.
+        Returns:
+            List: The results in the input order.
+        """
+        os.makedirs(self.batch_dir, exist_ok=True)
+        token = _active_collector.set(self)
+        try:
+            tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+        finally:
+            _active_collector.reset(token)
+
+        while True:
+            await self._settle()
+            running = [task for task in tasks if not task.done()]
+            if not running:
+                break
+            if self._pending:
+                await self._flush()
+            else:
+                # Nothing to batch: some coroutine waits on something else
+                await asyncio.wait(
+                    running,
+                    timeout=self.poll_interval,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+        return [task.result() for task in tasks]
+
+    async def _settle(self) -> None:
+        """Yield to the event loop until no coroutine issues new requests."""
+        while True:
+            num_pending = len(self._pending)
+            for _ in range(SETTLE_ITERATIONS):
+                await asyncio.sleep(0)
+            if len(self._pending) == num_pending:
+                return
+
+    async def _flush(self) -> None:
+        pending, self._pending = self._pending, {}
+        self.num_rounds += 1
+        requests = [request for request, _ in pending.values()]
+        batch_ids = []
+        for number, lines in enumerate(split_batch_lines(requests)):
+            input_path = os.path.join(
+                self.batch_dir,
+                f"round{self.num_rounds:03d}-{number:03d}-{uuid.uuid4().hex[:8]}.jsonl",
+            )
+            with open(input_path, "wb") as f:
+                f.writelines(lines)
+            batch_ids.append(await asyncio.to_thread(self.endpoint.submit, input_path))
+        print(
+            f"[+] Batch round {self.num_rounds}: submitted {len(requests)} requests"
+            f" in {len(batch_ids)} job(s)"
+        )
+
+        results: Dict[str, Tuple] = {}
+        for batch_id in batch_ids:
+            while (
+                status := await asyncio.to_thread(self.endpoint.status, batch_id)
+            ) not in TERMINAL_STATUSES:
+                await asyncio.sleep(self.poll_interval)
+            if status != "completed":
+                print(
+                    f"[!] Batch {batch_id} ended with status {status}", file=sys.stderr
+                )
+            for line in await asyncio.to_thread(self.endpoint.results, batch_id):
+                results[line["custom_id"]] = parse_batch_output(line)
+
+        for custom_id, (_, future) in pending.items():
+            future.set_result(
+                results.get(
+                    custom_id,
+                    (None, None, PredictionError("Missing batch result", "server")),
+                )
+            )
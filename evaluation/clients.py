@@ -0,0 +1,129 @@
+import asyncio
+import importlib.util
+import os
+import sys
+import threading
+from typing import Dict, Optional, Tuple
+import weakref
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+# Connection pool settings shared by every client created in this process.
+CLIENT_CONFIG = {
+    "max_connections": 256,
+    "max_keepalive_connections": 64,
+    "keepalive_expiry": 60.0,
+    # HTTP/2 needs the optional `h2` package
+    "http2": importlib.util.find_spec("h2") is not None,
+    "timeout": 600.0,
+    "connect_timeout": 10.0,
+}
+
+_lock = threading.Lock()
+_clients: Dict[Tuple[int, Optional[str], Optional[str]], OpenAI] = {}
+# Async clients are bound to the event loop that opened their connections.
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def configure_clients(**kwargs) -> None:
+    """Update the connection pool settings used for newly created clients.
+
+    Args:
+        max_connections (int): The maximum number of concurrent connections.
+        max_keepalive_connections (int): The maximum number of idle connections kept alive.
+        keepalive_expiry (float): The seconds an idle connection is kept alive.
+        http2 (bool): Whether to negotiate HTTP/2.
+        timeout (float): The request timeout in seconds.
+        connect_timeout (float): The connection timeout in seconds.
+    """
+    unknown = set(kwargs) - set(CLIENT_CONFIG)
+    if unknown:
+        raise ValueError(f"Unknown client options: {sorted(unknown)}")
+    with _lock:
+        CLIENT_CONFIG.update(kwargs)
+        _clients.clear()
+        _async_clients.clear()
+
+
+def _http2_enabled() -> bool:
+    if not CLIENT_CONFIG["http2"]:
+        return False
+    if importlib.util.find_spec("h2") is None:
+        print(
+            "[!] HTTP/2 requested but `h2` is not installed. Falling back to HTTP/1.1.",
+            file=sys.stderr,
+        )
+        CLIENT_CONFIG["http2"] = False
+        return False
+    return True
+
+
+def _http_client_options() -> dict:
+    return {
+        "limits": httpx.Limits(
+            max_connections=CLIENT_CONFIG["max_connections"],
+            max_keepalive_connections=CLIENT_CONFIG["max_keepalive_connections"],
+            keepalive_expiry=CLIENT_CONFIG["keepalive_expiry"],
+        ),
+        "timeout": httpx.Timeout(
+            CLIENT_CONFIG["timeout"], connect=CLIENT_CONFIG["connect_timeout"]
+        ),
+        "http2": _http2_enabled(),
+    }
+
+
+def get_client(base_url: Optional[str] = None, api_key: Optional[str] = None) -> OpenAI:
+    """Return the process-wide OpenAI client for the given endpoint.
+
+    Clients are keyed by process id so that workers forked by `datasets.map`
+    never share sockets with their parent.
+
+    Args:
+        base_url (Optional[str], optional): The API base URL. Defaults to the `OPENAI_BASE_URL` environment variable.
+        api_key (Optional[str], optional): The API key. Defaults to the `OPENAI_API_KEY` environment variable.
+    Returns:
+        OpenAI: The shared client.
+    """
+    key = (os.getpid(), base_url, api_key)
+    with _lock:
+        if key not in _clients:
+            options = _http_client_options()
+            _clients[key] = OpenAI(
+                base_url=base_url,
+                api_key=api_key,
+                timeout=options["timeout"],
+                # Retries are handled by `openai_chat_completion`
+                max_retries=0,
+                http_client=DefaultHttpxClient(**options),
+            )
+        return _clients[key]
+
+
+def get_async_client(
+    base_url: Optional[str] = None, api_key: Optional[str] = None
+) -> AsyncOpenAI:
+    """Return the AsyncOpenAI client for the given endpoint and running event loop.
+
+    Args:
+        base_url (Optional[str], optional): The API base URL. Defaults to the `OPENAI_BASE_URL` environment variable.
+        api_key (Optional[str], optional): The API key. Defaults to the `OPENAI_API_KEY` environment variable.
+    Returns:
+        AsyncOpenAI: The shared client.
+    """
+    loop = asyncio.get_running_loop()
+    key = (os.getpid(), base_url, api_key)
+    with _lock:
+        clients = _async_clients.setdefault(loop, {})
+        if key not in clients:
+            options = _http_client_options()
+            clients[key] = AsyncOpenAI(
+                base_url=base_url,
+                api_key=api_key,
+                timeout=options["timeout"],
+                max_retries=0,
+                http_client=DefaultAsyncHttpxClient(**options),
+            )
+        return clients[key]
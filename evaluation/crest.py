@@ -1,31 +1,95 @@
-import json
 import re
 import sys
 from collections import Counter
-from typing import Iterable, List, Literal, Tuple
+from typing import Dict, Iterable, List, Literal, Optional, Tuple
+
+import numpy as np
 
 from evaluation.method.baseline import BaselineMethod
 
 from .prompts.crest import (
     NON_REFUSAL_EVALUATION_PROMPT,
+    JSON_NON_REFUSAL_EVALUATION_PROMPT,
+    JSON_NON_REFUSAL_EVALUATION_KEYS,
+    JSON_NON_REFUSAL_EVALUATION_JUSTIFIED_KEYS,
     DIRECT_ANSWER_GENERATION_PROMPT,
     NAIVE_COT_ANSWER_GENERATION_PROMPT,
     COD_ANSWER_GENERATION_PROMPT,
     SEMI_STRUCTURED_ANSWER_GENERATION_PROMPT,
 )
-from .types import ERROR_TYPES, QAExampleAnswered, QAExampleEvaluated, QAFinalDatum
-from .utils import openai_chat_completion, remove_citation_from_answer
+from .documents import DocumentStore, load_documents
+from .index import MetadataIndex
+from .judge_cache import PROMPT_VERSIONS, get_verdict, judge_cache_key, put_verdict
+from .prejudge import prejudge as prejudge_answer
+from .retry import PredictionError
+from .scoring import prediction_failed_rows
+from .tracking import UsageTracker, track_usage
+from .types import (
+    ERROR_TYPES,
+    JudgeVerdict,
+    QAExampleAnswered,
+    QAExampleEvaluated,
+    QAFinalDatum,
+)
+from .utils import (
+    extract_json_data,
+    openai_chat_completion,
+    openai_chat_completion_async,
+    remove_citation_from_answer,
+)
 
-from datasets import disable_progress_bar
+from datasets import Dataset, disable_progress_bar
 
 disable_progress_bar()
 
+# "text" is the original judge prompt; the JSON formats answer with a
+# `JudgeVerdict`, with or without a justification before the decision.
+JUDGE_FORMATS = ["text", "json", "json_justified"]
+JSON_DECISION_SCORES = {"Correct": 2.0, "Partially Correct": 1.0, "Wrong": 0.0}
+
+# Why an evaluated non-refusal example is judged again (see `rejudge_reason`)
+REJUDGE_REASONS = ["failed", "stale_model", "stale_prompt"]
+
 
 def predict(
-    example: QAFinalDatum, method: BaselineMethod
+    example: QAFinalDatum,
+    method: BaselineMethod,
+    store: Optional[DocumentStore] = None,
 ) -> Iterable[QAExampleAnswered]:
+    with track_usage() as tracker:
+        try:
+            prediction = method.predict(
+                example["query"], load_documents(example, store)
+            )
+        except PredictionError as e:
+            return _record_failure(example, method, e, tracker)
+    return _record_prediction(example, method, prediction, tracker)
+
+
+async def predict_async(
+    example: QAFinalDatum,
+    method: BaselineMethod,
+    store: Optional[DocumentStore] = None,
+) -> QAExampleAnswered:
+    """Asynchronous version of `predict` used by the asyncio runner."""
+    with track_usage() as tracker:
+        try:
+            prediction = await method.predict_async(
+                example["query"], load_documents(example, store)
+            )
+        except PredictionError as e:
+            return _record_failure(example, method, e, tracker)
+    return _record_prediction(example, method, prediction, tracker)
+
+
+def _record_prediction(
+    example: QAFinalDatum,
+    method: BaselineMethod,
+    prediction: tuple,
+    tracker: Optional[UsageTracker] = None,
+) -> QAExampleAnswered:
     parsed_answer, prompt, entire_answer, prompt_tokens, completion_tokens = (
-        method.predict(example["query"], json.loads(example["documents"]))
+        prediction
     )
 
     example["raw_predicted_answer"] = entire_answer
@@ -33,15 +97,103 @@ def predict(
     example["prediction_details"] = {
         "prompt": prompt,
         "method": method.__class__.__name__,
-        "attrs": vars(method),
+        "attrs": {
+            key: value
+            for key, value in vars(method).items()
+            if not key.startswith("_")
+        },
+        **(tracker.details if tracker else {}),
     }
     example["predict_usage"] = {
         "prompt_tokens": prompt_tokens,
         "completion_tokens": completion_tokens,
+        "cached_tokens": tracker.cached_tokens if tracker else 0,
+        "num_calls": tracker.num_calls if tracker else 0,
+        "cache_hits": tracker.cache_hits if tracker else 0,
+        "latency": tracker.elapsed if tracker else None,
+        "call_latency": tracker.mean_latency if tracker else None,
+        "ttft": tracker.mean_ttft if tracker else None,
     }
+    example["predict_status"] = {"status": "ok", "error_type": "", "error": ""}
     return example
 
 
+def _record_failure(
+    example: QAFinalDatum,
+    method: BaselineMethod,
+    error: PredictionError,
+    tracker: Optional[UsageTracker] = None,
+) -> QAExampleAnswered:
+    """Keep a failed example in the dataset with an error status instead of dropping it."""
+    example = _record_prediction(example, method, ("", "", "", 0, 0), tracker)
+    example["predict_status"] = {
+        "status": "error",
+        "error_type": error.category,
+        "error": str(error),
+    }
+    return example
+
+
+def default_predict_status(example: QAExampleAnswered) -> dict:
+    """Status of an example predicted before `predict_status` was recorded."""
+    if example["predicted_answer"]:
+        return {"status": "ok", "error_type": "", "error": ""}
+    return {"status": "error", "error_type": "unknown", "error": "missing answer"}
+
+
+def prediction_failed(example: QAExampleAnswered) -> bool:
+    """Whether the example has no usable prediction and should be (re-)predicted.
+
+    Outputs written before `predict_status` existed dropped failed rows, so an
+    empty answer is the only signal available for them.
+    """
+    if "predicted_answer" not in example or example["predicted_answer"] is None:
+        return True
+    status = example.get("predict_status")
+    if status is None:
+        return example["predicted_answer"] == ""
+    return status["status"] != "ok"
+
+
+def rejudge_reason(
+    example: QAExampleEvaluated,
+    reasons: Iterable[str],
+    model_name: str,
+    judge_format: str = "text",
+) -> Optional[str]:
+    """Why an evaluated non-refusal example has to be judged again, if it does.
+
+    Examples without a usable prediction are never selected, judging them
+    again would not change their result.
+
+    Args:
+        example (QAExampleEvaluated): The evaluated example.
+        reasons (Iterable[str]): The `REJUDGE_REASONS` to check. "failed" selects judge
+            errors and unparsed verdicts, "stale_model" verdicts of another judge model
+            and "stale_prompt" verdicts of another judge prompt or format.
+        model_name (str): The current judge model.
+        judge_format (str, optional): The current judge format. Defaults to "text".
+    Returns:
+        Optional[str]: "missing" or the first matching reason, None if the result is current.
+    """
+    result = example.get("evaluation_result")
+    if result is None:
+        return "missing"
+    if prediction_failed(example):
+        return None
+    meta = result.get("meta") or {}
+    if "failed" in reasons and (meta.get("error") or result.get("score") is None):
+        return "failed"
+    if "stale_model" in reasons and meta.get("model") != model_name:
+        return "stale_model"
+    if "stale_prompt" in reasons and (
+        meta.get("prompt_version") != PROMPT_VERSIONS[judge_format]
+        or (meta.get("judge_format") or "text") != judge_format
+    ):
+        return "stale_prompt"
+    return None
+
+
 def parse_non_refusal_evaluation(output: str) -> Tuple[float, str]:
     """Parse the output of a non-refusal evaluation.
 
@@ -73,8 +225,31 @@ def parse_non_refusal_evaluation(output: str) -> Tuple[float, str]:
     return score, error_type
 
 
+def parse_json_non_refusal_evaluation(output: str) -> Tuple[float, str]:
+    """Parse the output of a JSON judge format, validated as a `JudgeVerdict`.
+
+    Args:
+        output (str): The JSON output of the judge.
+    Returns:
+        The score of the evaluation, None if the output is not a valid verdict, and the error type.
+    """
+    verdict = extract_json_data(output or "", JudgeVerdict)
+    if verdict is None:
+        return None, ""
+    score = JSON_DECISION_SCORES[verdict["decision"]]
+    error_type = verdict.get("error_type") or ""
+    return score, error_type if error_type in ERROR_TYPES else ""
+
+
+def parse_judge_output(output: str, judge_format: str = "text") -> Tuple[float, str]:
+    """Parse a judge output written in one of `JUDGE_FORMATS`."""
+    if judge_format == "text":
+        return parse_non_refusal_evaluation(output)
+    return parse_json_non_refusal_evaluation(output)
+
+
 def non_refusal_evaluation(
-    example: QAExampleAnswered, model_name: str, seed: int
+    example: QAExampleAnswered, model_name: str, seed: int, prejudge: bool = True
 ) -> QAExampleEvaluated:
     """Evaluate a non-refusal example using OpenAI Chat.
 
@@ -82,53 +257,162 @@ def non_refusal_evaluation(
         example (dict): The example to evaluate.
         model_name (str): The name of the model to use.
         seed (int): The seed to use for the evaluation.
+        prejudge (bool, optional): Decide trivial answers locally without the judge. Defaults to True.
     Returns:
         The evaluated example.
     """
+    messages = _prepare_non_refusal_evaluation(example, model_name, seed, prejudge)
+    if messages is None:
+        return example
+
+    output, usage, error = openai_chat_completion(
+        model_name=model_name,
+        messages=messages,
+        seed=seed,
+    )
+    return _record_non_refusal_evaluation(example, output, usage, error)
+
+
+async def non_refusal_evaluation_async(
+    example: QAExampleAnswered, model_name: str, seed: int, prejudge: bool = True
+) -> QAExampleEvaluated:
+    """Asynchronous version of `non_refusal_evaluation`."""
+    messages = _prepare_non_refusal_evaluation(example, model_name, seed, prejudge)
+    if messages is None:
+        return example
+
+    output, usage, error = await openai_chat_completion_async(
+        model_name=model_name,
+        messages=messages,
+        seed=seed,
+    )
+    return _record_non_refusal_evaluation(example, output, usage, error)
+
+
+def _prepare_non_refusal_evaluation(
+    example: QAExampleAnswered,
+    model_name: str,
+    seed: int,
+    prejudge: bool = True,
+    judge_format: str = "text",
+) -> Optional[List[dict]]:
+    """Initialize the evaluation result and build the judge messages.
+
+    `evaluation_result.judged_by` records what decided the example: "llm" for
+    the judge, "cache" for a verdict of the judge cache, or the path of
+    `evaluation.prejudge.prejudge` that settled it.
+
+    Returns:
+        The judge messages, or None if the example is decided without the judge.
+    """
     example["evaluation_result"] = {
-        "meta": {"model": model_name, "seed": seed, "error": None},
+        "meta": {
+            "model": model_name,
+            "seed": seed,
+            "error": None,
+            "judge_format": judge_format,
+            "prompt_version": PROMPT_VERSIONS[judge_format],
+        },
         "score": None,
         "justification": None,
         "error_type": None,
         "usage": {},
+        "judged_by": None,
     }
 
+    if prediction_failed(example):
+        example["evaluation_result"]["meta"]["error"] = "prediction failed"
+        return None
+
     if len(example["predicted_answer"]) == 0:
         example["evaluation_result"]["score"] = 0.0
-        return example
+        example["evaluation_result"]["judged_by"] = "empty"
+        return None
 
-    prompt = NON_REFUSAL_EVALUATION_PROMPT.format(
-        question=example["query"],
-        golden_answer=example["answer"],
-        predicted_answer=remove_citation_from_answer(example["predicted_answer"]),
+    decision = (
+        prejudge_answer(example["answer"], example["predicted_answer"]) if prejudge else None
     )
+    if decision is not None:
+        score, error_type, path = decision
+        example["evaluation_result"]["score"] = score
+        example["evaluation_result"]["error_type"] = error_type
+        example["evaluation_result"]["judged_by"] = path
+        return None
+
+    if (cached := get_verdict(_judge_cache_key(example))) is not None:
+        score, error_type = parse_judge_output(cached, judge_format)
+        example["evaluation_result"]["score"] = score
+        example["evaluation_result"]["error_type"] = error_type
+        example["evaluation_result"]["justification"] = cached
+        example["evaluation_result"]["judged_by"] = "cache"
+        return None
+
+    example["evaluation_result"]["judged_by"] = "llm"
+    return build_judge_messages(example, judge_format)
+
+
+def build_judge_messages(
+    example: QAExampleAnswered, judge_format: str = "text"
+) -> List[dict]:
+    """The judge prompt of one example in one of `JUDGE_FORMATS`."""
+    fields = {
+        "question": example["query"],
+        "golden_answer": example["answer"],
+        "predicted_answer": remove_citation_from_answer(example["predicted_answer"]),
+    }
+    if judge_format == "text":
+        prompt = NON_REFUSAL_EVALUATION_PROMPT.format(**fields)
+    else:
+        prompt = JSON_NON_REFUSAL_EVALUATION_PROMPT.format(
+            keys=JSON_NON_REFUSAL_EVALUATION_KEYS
+            if judge_format == "json"
+            else JSON_NON_REFUSAL_EVALUATION_JUSTIFIED_KEYS,
+            **fields,
+        )
+    return [{"role": "user", "content": prompt}]
 
-    output, usage, error = openai_chat_completion(
-        model_name=model_name,
-        messages=[
-            {"role": "user", "content": prompt},
-        ],
-        seed=seed,
-    )
 
+def _record_non_refusal_evaluation(
+    example: QAExampleAnswered,
+    output: Optional[str],
+    usage: Optional[object],
+    error: Optional[Exception],
+) -> QAExampleEvaluated:
+    if usage is not None:
+        # Also on errors, for the attempts that succeeded before a failed retry
+        example["evaluation_result"]["usage"] = {
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+        }
     if error is not None:
         example["evaluation_result"]["meta"]["error"] = str(error)
         return example
 
-    score, error_type = parse_non_refusal_evaluation(output)
+    judge_format = example["evaluation_result"]["meta"]["judge_format"]
+    score, error_type = parse_judge_output(output, judge_format)
     if score is None:
         print(f"[!] Parsing Error: {output}", file=sys.stderr)
 
     example["evaluation_result"]["score"] = score
     example["evaluation_result"]["error_type"] = error_type
     example["evaluation_result"]["justification"] = output
-    example["evaluation_result"]["usage"] = {
-        "prompt_tokens": usage.prompt_tokens,
-        "completion_tokens": usage.completion_tokens,
-    }
+    if score is not None:
+        put_verdict(_judge_cache_key(example), output)
     return example
 
 
+def _judge_cache_key(example: QAExampleAnswered) -> str:
+    meta = example["evaluation_result"]["meta"]
+    return judge_cache_key(
+        meta["model"],
+        meta["seed"],
+        meta["judge_format"],
+        example["query"],
+        example["answer"],
+        example["predicted_answer"],
+    )
+
+
 def refusal_evaluation(example: QAExampleAnswered) -> QAExampleEvaluated:
     """Evaluate a refusal example using OpenAI Chat.
 
@@ -147,6 +431,9 @@ def refusal_evaluation(example: QAExampleAnswered) -> QAExampleEvaluated:
         "score": correctness,
         "usage": {},
     }
+    if prediction_failed(example):
+        example["evaluation_result"]["meta"]["error"] = "prediction failed"
+        example["evaluation_result"]["score"] = None
     return example
 
 
@@ -161,9 +448,9 @@ def citation_evaluation(example: QAExampleAnswered) -> QAExampleEvaluated:
         The evaluated example.
     """
     document_number_dict = {
-        doc["docid"]: str(idx + 1) for idx, doc in enumerate(json.loads(example["documents"]))
+        doc["docid"]: str(idx + 1) for idx, doc in enumerate(example["documents"])
     }
-    golden_docs = [document_number_dict[i] for i in json.loads(example["citation_ids"])]
+    golden_docs = [document_number_dict[i] for i in example["citation_ids"]]
     citation_pattern = re.compile(r"\[(\d+)\]", re.IGNORECASE)
     predicted_docs = list(set(citation_pattern.findall(example["predicted_answer"])))
 
@@ -183,6 +470,16 @@ def citation_evaluation(example: QAExampleAnswered) -> QAExampleEvaluated:
     return example
 
 
+def predicted_rows(dataset: Dataset, rows: np.ndarray) -> np.ndarray:
+    """The rows among `rows` with a usable prediction.
+
+    Failed predictions are kept in the outputs so that `--resume` can retry
+    them, but an API outage says nothing about the model, so they are left
+    out of every score and counted separately.
+    """
+    return rows[~prediction_failed_rows(dataset)[rows]]
+
+
 def aggregate_score(
     dataset: Iterable[QAExampleEvaluated],
     language: Literal["en", "ko"],
@@ -190,17 +487,21 @@ def aggregate_score(
         "SimpleQA",
         "ComplexQA",
     ],
+    index: Optional[MetadataIndex] = None,
 ) -> Tuple[float, float, float, int]:
     """Aggregate the scores of a dataset.
 
     Args:
         dataset (list): The dataset to aggregate the scores
+        index (MetadataIndex, optional): The metadata index of the dataset
     Returns:
-        The average score and the number of invalid examples
+        The average score and the number of invalid examples, failed predictions excluded
     """
-    dataset = dataset.filter(
-        lambda x: json.loads(x["meta"])["language"] == language
-        and json.loads(x["meta"])["difficulty_type"] in difficulty_type
+    index = index or MetadataIndex(dataset)
+    dataset = dataset.select(
+        predicted_rows(
+            dataset, index.select_by(language=language, difficulty=difficulty_type)
+        )
     )
 
     valid_scores = [
@@ -233,10 +534,13 @@ def aggregate_citation_score(
     dataset: Iterable[QAExampleEvaluated],
     language: Literal["en", "ko"],
     difficulty_type: Literal["SimpleQA", "ComplexQA"],
+    index: Optional[MetadataIndex] = None,
 ) -> Tuple[float, float]:
-    dataset = dataset.filter(
-        lambda x: json.loads(x["meta"])["language"] == language
-        and json.loads(x["meta"])["difficulty_type"] == difficulty_type
+    index = index or MetadataIndex(dataset)
+    dataset = dataset.select(
+        predicted_rows(
+            dataset, index.select_by(language=language, difficulty=difficulty_type)
+        )
     )
     precision = [
         example["evaluation_result"]["citation_precision"] for example in dataset
@@ -252,19 +556,29 @@ def calculate_unified_score(
     dataset: Iterable[QAExampleEvaluated],
     language: Literal["en", "ko"],
     difficulty_type: List[Literal["SimpleQA", "ComplexQA"]],
+    indexes: Optional[Dict[str, MetadataIndex]] = None,
 ) -> float:
+    indexes = indexes or {split: MetadataIndex(dataset[split]) for split in dataset}
     refusal_score, refusal_cnt = 0.0, 0
-    for instance in dataset["refusal"].filter(
-        lambda x: json.loads(x["meta"])["language"] == language
-        and json.loads(x["meta"])["difficulty_type"] in difficulty_type
+    for instance in dataset["refusal"].select(
+        predicted_rows(
+            dataset["refusal"],
+            indexes["refusal"].select_by(
+                language=language, difficulty=difficulty_type
+            ),
+        )
     ):
         refusal_score += instance["evaluation_result"]["score"] or 0.0
         refusal_cnt += 1
     refusal_avg_score = refusal_score / refusal_cnt if refusal_cnt != 0 else 0.0
     non_refusal_score, non_refusal_cnt = 0.0, 0
-    for instance in dataset["non_refusal"].filter(
-        lambda x: json.loads(x["meta"])["language"] == language
-        and json.loads(x["meta"])["difficulty_type"] in difficulty_type
+    for instance in dataset["non_refusal"].select(
+        predicted_rows(
+            dataset["non_refusal"],
+            indexes["non_refusal"].select_by(
+                language=language, difficulty=difficulty_type
+            ),
+        )
     ):
         if instance["evaluation_result"]["score"] == 0:
             is_refusal = bool("unanswerable" in instance["predicted_answer"].lower())
@@ -302,15 +616,19 @@ def calculate_reasoning_type_unified_score(
     }
 
     for instance in dataset["refusal"]:
+        if prediction_failed(instance):
+            continue
         for reasoning_types in instance["reasoning_type"]:
             for reasoning_type in reasoning_types:
                 if reasoning_type not in reasoning_type_refusal_score_dict:
                     continue
                 reasoning_type_refusal_score_dict[reasoning_type].append(
-                    instance["evaluation_result"]["score"]
+                    instance["evaluation_result"]["score"] or 0.0
                 )
 
     for instance in dataset["non_refusal"]:
+        if prediction_failed(instance):
+            continue
         for reasoning_types in instance["reasoning_type"]:
             for reasoning_type in reasoning_types:
                 if reasoning_type not in reasoning_type_non_refusal_score_dict:
@@ -329,7 +647,7 @@ def calculate_reasoning_type_unified_score(
                         )
                 else:
                     reasoning_type_non_refusal_score_dict[reasoning_type].append(
-                        (instance["evaluation_result"]["score"]) / 2
+                        (instance["evaluation_result"]["score"] or 0.0) / 2
                     )
 
     reasoning_type_refusal_avg_score_dict = {
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from datasets import DatasetDict, Value, config
+import pyarrow as pa
+
+from .schema import JSON_DOCUMENT_FIELDS, document_refs_feature, infer_docid_feature
+from .types import DocumentInfo
+
+# Fields that describe the role of a document in one example. They stay with
+# the example (see `document_refs_feature`), every other field is shared
+# through the store.
+EXAMPLE_FIELDS = ("ground", "citation_idx")
+# File name of the store next to a dataset written by `safe_save`
+STORE_FILENAME = "documents.arrow"
+
+
+class DocumentStore:
+    """Documents shared by the examples, interned once in an Arrow table keyed by `docid`.
+
+    An interned example keeps a `document_keys` column with the store rows of
+    its documents and a typed `documents` column with only their `docid` and
+    the fields in `EXAMPLE_FIELDS`. The contents are read from the store when an
+    example is predicted. A store opened from a file is memory-mapped, so
+    forked workers share its pages and pickling it only sends the path.
+
+    Args:
+        table (pa.Table): One row per unique document.
+        fields (List[str]): The key order of the original document dicts.
+        path (Optional[str], optional): The memory-mapped file of the table. Defaults to None.
+    """
+
+    def __init__(self, table: pa.Table, fields: List[str], path: Optional[str] = None):
+        self.table = table
+        self.fields = fields
+        self.path = path
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    def __getstate__(self) -> dict:
+        if self.path is not None:
+            return {"path": self.path}
+        return self.__dict__.copy()
+
+    def __setstate__(self, state: dict) -> None:
+        if set(state) == {"path"}:
+            state = DocumentStore.load(state["path"]).__dict__
+        self.__dict__.update(state)
+
+    @classmethod
+    def load(cls, path: str) -> "DocumentStore":
+        """Memory-map a store written by `save`."""
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        fields = json.loads(table.schema.metadata[b"fields"])
+        return cls(table, fields, path)
+
+    def save(self, path: str) -> None:
+        table = self.table.replace_schema_metadata({"fields": json.dumps(self.fields)})
+        with pa.OSFile(path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    def resolve(self, keys: List[int], refs: List[dict]) -> List[DocumentInfo]:
+        """Rebuild the full document dicts of an example.
+
+        Args:
+            keys (List[int]): The store rows of the documents.
+            refs (List[dict]): The `docid` and example fields of the documents.
+        Returns:
+            List[DocumentInfo]: The documents in the original key order.
+        """
+        shared = self.table.take(pa.array(keys, type=pa.int64())).to_pylist()
+        docs = []
+        for row, ref in zip(shared, refs):
+            row.update(
+                (field, json.loads(value) if field in JSON_DOCUMENT_FIELDS else value)
+                for field, value in ref.items()
+            )
+            docs.append({field: row[field] for field in self.fields if field in row})
+        return docs
+
+
+def load_documents(example: dict, store: Optional[DocumentStore] = None) -> List[dict]:
+    """Return the documents of an example, resolving interned ones through `store`."""
+    if "document_keys" not in example:
+        return json.loads(example["documents"])
+    if store is None:
+        raise ValueError("The documents are interned. Pass the document store")
+    return store.resolve(example["document_keys"], example["documents"])
+
+
+def intern_documents(dataset: DatasetDict) -> Tuple[DatasetDict, DocumentStore]:
+    """Move the documents of every split into a shared store.
+
+    A `docid` is stored once unless its shared fields differ between examples,
+    in which case every variant gets its own row.
+
+    Args:
+        dataset (DatasetDict): The dataset with full documents.
+    Returns:
+        Tuple[DatasetDict, DocumentStore]: The dataset with document references and the store.
+    """
+    rows: List[dict] = []
+    fields: List[str] = []
+    # docid -> store rows sharing it
+    index: Dict[object, List[int]] = {}
+
+    def intern(doc: dict) -> int:
+        shared = {k: v for k, v in doc.items() if k not in EXAMPLE_FIELDS}
+        for key in index.setdefault(shared.get("docid"), []):
+            if rows[key] == shared:
+                return key
+        rows.append(shared)
+        index[shared.get("docid")].append(len(rows) - 1)
+        return len(rows) - 1
+
+    columns = {}
+    for split in dataset:
+        keys_column, refs_column = [], []
+        for documents in dataset[split]["documents"]:
+            keys, refs = [], []
+            for doc in json.loads(documents):
+                fields.extend(k for k in doc if k not in fields)
+                keys.append(intern(doc))
+                refs.append(
+                    {
+                        "docid": doc.get("docid"),
+                        **{
+                            field: (
+                                json.dumps(doc.get(field), ensure_ascii=False)
+                                if field in JSON_DOCUMENT_FIELDS
+                                else doc.get(field)
+                            )
+                            for field in EXAMPLE_FIELDS
+                        },
+                    }
+                )
+            keys_column.append(keys)
+            refs_column.append(refs)
+        columns[split] = (keys_column, refs_column)
+
+    refs_feature = document_refs_feature(infer_docid_feature(list(index)))
+    interned = {}
+    for split, (keys_column, refs_column) in columns.items():
+        interned[split] = (
+            dataset[split]
+            .remove_columns("documents")
+            .add_column("documents", refs_column, feature=refs_feature)
+            .add_column("document_keys", keys_column, feature=[Value("int64")])
+        )
+    return DatasetDict(interned), DocumentStore(pa.Table.from_pylist(rows), fields)
+
+
+def _cache_path(dataset: DatasetDict) -> str:
+    fingerprint = hashlib.sha256(
+        "".join(dataset[split]._fingerprint for split in sorted(dataset)).encode()
+    ).hexdigest()[:16]
+    cache_dir = os.path.join(config.HF_DATASETS_CACHE, "crest_documents")
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, f"{fingerprint}.arrow")
+
+
+def prepare_document_store(
+    dataset: DatasetDict, path: Optional[str] = None
+) -> Tuple[DatasetDict, DocumentStore]:
+    """Open the document store of a dataset, interning its documents if needed.
+
+    Args:
+        dataset (DatasetDict): The loaded dataset.
+        path (Optional[str], optional): The directory the dataset was loaded from. Defaults to None.
+    Returns:
+        Tuple[DatasetDict, DocumentStore]: The interned dataset and its memory-mapped store.
+    """
+    split = next(iter(dataset.values()))
+    if "document_keys" in split.column_names:
+        return dataset, DocumentStore.load(os.path.join(path, STORE_FILENAME))
+
+    cache_path = _cache_path(dataset)
+    dataset, store = intern_documents(dataset)
+    num_refs = sum(
+        len(keys) for split in dataset.values() for keys in split["document_keys"]
+    )
+    print(
+        f"[+] Interned {num_refs} document references into {len(store)} unique documents"
+    )
+    if not os.path.exists(cache_path):
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        store.save(tmp_path)
+        os.replace(tmp_path, cache_path)
+    return dataset, DocumentStore.load(cache_path)
@@ -0,0 +1,153 @@
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from datasets import Dataset
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Single-valued fields of an example, read from `meta` or a top-level column
+INDEXED_FIELDS = ("language", "difficulty_type", "question_type")
+
+Selector = Optional[Union[str, Iterable[str]]]
+
+
+def _encode(array: Union[pa.Array, pa.ChunkedArray]) -> Tuple[np.ndarray, List[str]]:
+    """Dictionary-encode `array` into integer codes, -1 for nulls."""
+    encoded = pc.dictionary_encode(array)
+    if isinstance(encoded, pa.ChunkedArray):
+        encoded = encoded.unify_dictionaries().combine_chunks()
+    codes = encoded.indices.fill_null(-1).to_numpy(zero_copy_only=False)
+    return codes.astype(np.int32), encoded.dictionary.to_pylist()
+
+
+def _multi_hot(column: pa.ChunkedArray, num_rows: int) -> Tuple[np.ndarray, List[str]]:
+    """Encode a (nested) list of labels per row into a boolean row x label matrix."""
+    values = column.combine_chunks()
+    rows = np.arange(num_rows)
+    while pa.types.is_list(values.type) or pa.types.is_large_list(values.type):
+        rows = rows[pc.list_parent_indices(values).to_numpy()]
+        values = pc.list_flatten(values)
+    codes, labels = _encode(values)
+    matrix = np.zeros((num_rows, len(labels)), dtype=bool)
+    valid = codes >= 0
+    matrix[rows[valid], codes[valid]] = True
+    return matrix, labels
+
+
+class MetadataIndex:
+    """Integer codes of the metadata of a split for slicing without scanning the rows.
+
+    Built once from the Arrow columns of the split. `select_by` combines NumPy
+    masks and returns the row indices to pass to `Dataset.select`. The index
+    follows the row order of the split, so build it again or use `take` after
+    reordering the rows.
+
+    Args:
+        dataset (Dataset): The split to index.
+    """
+
+    def __init__(self, dataset: Optional[Dataset] = None):
+        self.codes: Dict[str, np.ndarray] = {}
+        self.vocab: Dict[str, List[str]] = {}
+        self.reasoning_types = np.zeros((0, 0), dtype=bool)
+        self.reasoning_vocab: List[str] = []
+        self.num_rows = 0
+        if dataset is not None:
+            self._build(dataset)
+
+    def _build(self, dataset: Dataset) -> None:
+        # Encode the columns of the underlying table and map the codes through
+        # the indices of `select`/`filter`, which is much cheaper than
+        # materializing the mapped rows.
+        table = dataset.data.table
+        columns = [
+            name
+            for name in ("meta", "reasoning_type", *INDEXED_FIELDS)
+            if name in table.column_names
+        ]
+        self.num_rows = table.num_rows
+        meta_fields = (
+            {field.name for field in table.column("meta").type}
+            if "meta" in columns
+            else set()
+        )
+        for field in INDEXED_FIELDS:
+            if field in meta_fields:
+                array = pc.struct_field(table.column("meta"), field)
+            elif field in columns:
+                array = table.column(field)
+            else:
+                continue
+            self.codes[field], self.vocab[field] = _encode(array)
+        if "reasoning_type" in columns:
+            self.reasoning_types, self.reasoning_vocab = _multi_hot(
+                table.column("reasoning_type"), self.num_rows
+            )
+        if dataset._indices is not None:
+            self._take(dataset._indices.column(0).to_numpy())
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def _take(self, indices: np.ndarray) -> None:
+        self.num_rows = len(indices)
+        self.codes = {field: codes[indices] for field, codes in self.codes.items()}
+        self.reasoning_types = self.reasoning_types[indices]
+
+    def take(self, indices: Iterable[int]) -> "MetadataIndex":
+        """The index of `dataset.select(indices)`."""
+        index = MetadataIndex()
+        index.vocab = self.vocab
+        index.codes = self.codes
+        index.reasoning_vocab = self.reasoning_vocab
+        index.reasoning_types = self.reasoning_types
+        index._take(np.asarray(indices, dtype=np.int64))
+        return index
+
+    def _field_mask(self, field: str, values: Selector) -> np.ndarray:
+        if field not in self.codes:
+            raise KeyError(f"The dataset has no `{field}` metadata")
+        values = [values] if isinstance(values, str) else list(values)
+        wanted = [
+            code for code, value in enumerate(self.vocab[field]) if value in values
+        ]
+        return np.isin(self.codes[field], wanted)
+
+    def mask(
+        self,
+        language: Selector = None,
+        difficulty: Selector = None,
+        question_type: Selector = None,
+        reasoning_type: Selector = None,
+    ) -> np.ndarray:
+        """Boolean mask of the rows matching every given selector.
+
+        Each selector is a value or a collection of accepted values. `None`
+        matches every row. A row matches `reasoning_type` if it has any of the
+        given reasoning types.
+        """
+        mask = np.ones(self.num_rows, dtype=bool)
+        for field, values in (
+            ("language", language),
+            ("difficulty_type", difficulty),
+            ("question_type", question_type),
+        ):
+            if values is not None:
+                mask &= self._field_mask(field, values)
+        if reasoning_type is not None:
+            values = (
+                [reasoning_type]
+                if isinstance(reasoning_type, str)
+                else list(reasoning_type)
+            )
+            columns = [
+                code
+                for code, value in enumerate(self.reasoning_vocab)
+                if value in values
+            ]
+            mask &= self.reasoning_types[:, columns].any(axis=1)
+        return mask
+
+    def select_by(self, **selectors: Selector) -> np.ndarray:
+        """Row indices matching the selectors of `mask`, e.g. `select_by(language="en", difficulty="SimpleQA")`."""
+        return np.flatnonzero(self.mask(**selectors))
@@ -0,0 +1,331 @@
+import asyncio
+import re
+import sys
+from typing import Dict, List, Optional, Tuple
+
+from .backends.base import _sum_usage
+from .crest import (
+    _judge_cache_key,
+    _prepare_non_refusal_evaluation,
+    _record_non_refusal_evaluation,
+    non_refusal_evaluation,
+    non_refusal_evaluation_async,
+    parse_judge_output,
+    parse_non_refusal_evaluation,
+)
+from .judge_cache import put_verdict
+from .prompts.crest import (
+    BATCHED_NON_REFUSAL_EVALUATION_ITEM,
+    BATCHED_NON_REFUSAL_EVALUATION_PROMPT,
+)
+from .types import QAExampleAnswered, QAExampleEvaluated
+from .utils import (
+    openai_chat_completion,
+    openai_chat_completion_async,
+    remove_citation_from_answer,
+)
+
+# Completion token caps of the JSON judge formats, doubled on every retry
+JSON_JUDGE_MAX_TOKENS = {"json": 48, "json_justified": 160}
+# Retries of a JSON verdict that is truncated or does not validate
+JSON_JUDGE_PARSE_RETRIES = 2
+
+# Header line of every block of a batched judge output: "**Item**: 1" as the
+# prompt asks, but also "**Item 1**" as the items are written, "### Item 1",
+# "Item #1" and list items of these.
+ITEM_PATTERN = re.compile(
+    r"^[ \t>]*(?:(?:[-*]|\d+\.)[ \t]+)?(?:#{1,6}[ \t]*)?\**[ \t]*Item[ \t]*"
+    r"(?:\**[ \t]*:?[ \t]*\**[ \t]*)?(?:#|No\.?)?[ \t]*[\"'\[]*(\d+)[\]\"']*"
+    r"[ \t]*\**[ \t]*:?[ \t]*\**",
+    re.MULTILINE | re.IGNORECASE,
+)
+
+
+def build_batched_judge_messages(examples: List[QAExampleAnswered]) -> List[dict]:
+    """One judge prompt grading every example, numbered from 1."""
+    items = "\n".join(
+        BATCHED_NON_REFUSAL_EVALUATION_ITEM.format(
+            item_id=item_id,
+            question=example["query"],
+            golden_answer=example["answer"],
+            predicted_answer=remove_citation_from_answer(example["predicted_answer"]),
+        )
+        for item_id, example in enumerate(examples, start=1)
+    )
+    prompt = BATCHED_NON_REFUSAL_EVALUATION_PROMPT.format(items=items)
+    return [{"role": "user", "content": prompt}]
+
+
+def parse_batched_judge_output(output: str, num_items: int) -> Dict[int, str]:
+    """Split a batched judge output into the block of every item.
+
+    Args:
+        output (str): The judge output.
+        num_items (int): The number of graded items.
+    Returns:
+        Dict[int, str]: The block of every item found, keyed by its 1-based number.
+            Repeated numbers keep their first block.
+    """
+    blocks: Dict[int, str] = {}
+    parts = ITEM_PATTERN.split(output or "")
+    for item_id, block in zip(parts[1::2], parts[2::2]):
+        item_id = int(item_id)
+        if 1 <= item_id <= num_items and item_id not in blocks:
+            blocks[item_id] = block.strip().strip("`").strip()
+    return blocks
+
+
+def _share(total: int, index: int, num_items: int) -> int:
+    """Split `total` tokens evenly between the items, the remainder to the first ones."""
+    return total // num_items + (index < total % num_items)
+
+
+def _record_batched_evaluation(
+    examples: List[QAExampleAnswered],
+    pending: List[int],
+    output: Optional[str],
+    usage: Optional[object],
+    error: Optional[Exception],
+) -> List[int]:
+    """Record the decisions parsed from a batched judge output.
+
+    Returns:
+        List[int]: The examples without a parsable decision, to judge alone.
+    """
+    if error is not None:
+        print(
+            f"[!] Batched judge error, judging {len(pending)} examples alone: {error}",
+            file=sys.stderr,
+        )
+        return pending
+
+    blocks = parse_batched_judge_output(output, len(pending))
+    unparsed = []
+    for position, index in enumerate(pending):
+        block = blocks.get(position + 1)
+        score, error_type = parse_non_refusal_evaluation(block) if block else (None, "")
+        if score is None:
+            unparsed.append(index)
+            continue
+        result = examples[index]["evaluation_result"]
+        result["score"] = score
+        result["error_type"] = error_type
+        result["justification"] = block
+        put_verdict(_judge_cache_key(examples[index]), block)
+        result["usage"] = {
+            "prompt_tokens": _share(usage.prompt_tokens, position, len(pending)),
+            "completion_tokens": _share(
+                usage.completion_tokens, position, len(pending)
+            ),
+        }
+    if len(unparsed) == len(pending):
+        # Usually an item header format the parser does not know
+        preview = " ".join((output or "").split())[:200]
+        print(
+            f"[!] No item of a batched judge output could be parsed, judging all"
+            f" {len(pending)} alone: {preview!r}",
+            file=sys.stderr,
+        )
+    elif unparsed:
+        print(
+            f"[!] {len(unparsed)} of {len(pending)} batched judge items could not be parsed,"
+            " judging them alone",
+            file=sys.stderr,
+        )
+    return unparsed
+
+
+def _prepare_group(
+    examples: List[QAExampleAnswered], model_name: str, seed: int, prejudge: bool
+) -> Tuple[List[int], List[dict]]:
+    pending = [
+        index
+        for index, example in enumerate(examples)
+        if _prepare_non_refusal_evaluation(example, model_name, seed, prejudge)
+        is not None
+    ]
+    messages = build_batched_judge_messages([examples[index] for index in pending])
+    return pending, messages
+
+
+def non_refusal_evaluation_group(
+    examples: List[QAExampleAnswered],
+    model_name: str,
+    seed: int,
+    prejudge: bool = True,
+) -> List[QAExampleEvaluated]:
+    """Evaluate several non-refusal examples with one judge call.
+
+    The rubric is sent once for the whole group. Examples whose decision
+    cannot be parsed from the output, or all of them if the call fails, are
+    judged alone with `non_refusal_evaluation`. The usage of the call is split
+    evenly between the examples it decided.
+
+    Args:
+        examples (List[QAExampleAnswered]): The examples to evaluate.
+        model_name (str): The name of the judge model.
+        seed (int): The seed of the judge.
+        prejudge (bool, optional): Decide trivial answers locally without the judge. Defaults to True.
+    Returns:
+        List[QAExampleEvaluated]: The evaluated examples.
+    """
+    pending, messages = _prepare_group(examples, model_name, seed, prejudge)
+    if len(pending) <= 1:
+        for index in pending:
+            examples[index] = non_refusal_evaluation(
+                examples[index], model_name, seed, prejudge
+            )
+        return examples
+
+    output, usage, error = openai_chat_completion(
+        model_name=model_name, messages=messages, seed=seed
+    )
+    for index in _record_batched_evaluation(examples, pending, output, usage, error):
+        examples[index] = non_refusal_evaluation(
+            examples[index], model_name, seed, prejudge
+        )
+    return examples
+
+
+async def non_refusal_evaluation_group_async(
+    examples: List[QAExampleAnswered],
+    model_name: str,
+    seed: int,
+    prejudge: bool = True,
+) -> List[QAExampleEvaluated]:
+    """Asynchronous version of `non_refusal_evaluation_group`."""
+    pending, messages = _prepare_group(examples, model_name, seed, prejudge)
+    if len(pending) <= 1:
+        for index in pending:
+            examples[index] = await non_refusal_evaluation_async(
+                examples[index], model_name, seed, prejudge
+            )
+        return examples
+
+    output, usage, error = await openai_chat_completion_async(
+        model_name=model_name, messages=messages, seed=seed
+    )
+    unparsed = _record_batched_evaluation(examples, pending, output, usage, error)
+    results = await asyncio.gather(
+        *(
+            non_refusal_evaluation_async(examples[index], model_name, seed, prejudge)
+            for index in unparsed
+        )
+    )
+    for index, result in zip(unparsed, results):
+        examples[index] = result
+    return examples
+
+
+def non_refusal_evaluation_batch(
+    batch: Dict[str, list], model_name: str, seed: int, prejudge: bool = True
+) -> Dict[str, list]:
+    """`non_refusal_evaluation_group` over a batch of `Dataset.map(batched=True)`."""
+    examples = [dict(zip(batch, values)) for values in zip(*batch.values())]
+    examples = non_refusal_evaluation_group(examples, model_name, seed, prejudge)
+    return {column: [example[column] for example in examples] for column in examples[0]}
+
+
+def _json_judge_attempts(judge_format: str, max_tokens: Optional[int]) -> List[int]:
+    """The completion token cap of the first call and of every parse retry."""
+    if judge_format not in JSON_JUDGE_MAX_TOKENS:
+        raise ValueError(
+            f"Invalid JSON judge format: {judge_format}."
+            f" Choose from {sorted(JSON_JUDGE_MAX_TOKENS)}"
+        )
+    max_tokens = max_tokens or JSON_JUDGE_MAX_TOKENS[judge_format]
+    return [max_tokens * 2**attempt for attempt in range(JSON_JUDGE_PARSE_RETRIES + 1)]
+
+
+def _log_parse_retry(example: QAExampleAnswered, output: Optional[str]) -> None:
+    print(
+        f"[!] Invalid judge verdict for {example['id']}, retrying: {output}",
+        file=sys.stderr,
+    )
+
+
+def non_refusal_evaluation_json(
+    example: QAExampleAnswered,
+    model_name: str,
+    seed: int,
+    prejudge: bool = True,
+    judge_format: str = "json",
+    max_tokens: Optional[int] = None,
+) -> QAExampleEvaluated:
+    """Evaluate a non-refusal example with a capped JSON verdict.
+
+    The judge answers a `JudgeVerdict` in JSON mode, without a justification
+    for "json", so the completion is a few dozen tokens. Only a verdict that
+    is truncated or does not validate is requested again, with twice the
+    token cap, up to `JSON_JUDGE_PARSE_RETRIES` times; the usage of every
+    attempt is recorded.
+
+    Args:
+        example (QAExampleAnswered): The example to evaluate.
+        model_name (str): The name of the judge model.
+        seed (int): The seed of the judge.
+        prejudge (bool, optional): Decide trivial answers locally without the judge. Defaults to True.
+        judge_format (str, optional): "json" or "json_justified". Defaults to "json".
+        max_tokens (Optional[int], optional): The cap of the first call. Defaults to `JSON_JUDGE_MAX_TOKENS`.
+    Returns:
+        QAExampleEvaluated: The evaluated example.
+    """
+    attempts = _json_judge_attempts(judge_format, max_tokens)
+    messages = _prepare_non_refusal_evaluation(
+        example, model_name, seed, prejudge, judge_format
+    )
+    if messages is None:
+        return example
+
+    usages = []
+    for cap in attempts:
+        output, usage, error = openai_chat_completion(
+            model_name=model_name,
+            messages=messages,
+            seed=seed,
+            json_response=True,
+            max_tokens=cap,
+        )
+        if error is not None:
+            break
+        usages.append(usage)
+        if parse_judge_output(output, judge_format)[0] is not None:
+            break
+        if cap != attempts[-1]:
+            _log_parse_retry(example, output)
+    return _record_non_refusal_evaluation(example, output, _sum_usage(usages), error)
+
+
+async def non_refusal_evaluation_json_async(
+    example: QAExampleAnswered,
+    model_name: str,
+    seed: int,
+    prejudge: bool = True,
+    judge_format: str = "json",
+    max_tokens: Optional[int] = None,
+) -> QAExampleEvaluated:
+    """Asynchronous version of `non_refusal_evaluation_json`."""
+    attempts = _json_judge_attempts(judge_format, max_tokens)
+    messages = _prepare_non_refusal_evaluation(
+        example, model_name, seed, prejudge, judge_format
+    )
+    if messages is None:
+        return example
+
+    usages = []
+    for cap in attempts:
+        output, usage, error = await openai_chat_completion_async(
+            model_name=model_name,
+            messages=messages,
+            seed=seed,
+            json_response=True,
+            max_tokens=cap,
+        )
+        if error is not None:
+            break
+        usages.append(usage)
+        if parse_judge_output(output, judge_format)[0] is not None:
+            break
+        if cap != attempts[-1]:
+            _log_parse_retry(example, output)
+    return _record_non_refusal_evaluation(example, output, _sum_usage(usages), error)
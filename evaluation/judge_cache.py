@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+from typing import Optional
+import unicodedata
+
+from datasets import config
+
+from .prompts.crest import (
+    BATCHED_NON_REFUSAL_EVALUATION_ITEM,
+    BATCHED_NON_REFUSAL_EVALUATION_PROMPT,
+    JSON_NON_REFUSAL_EVALUATION_JUSTIFIED_KEYS,
+    JSON_NON_REFUSAL_EVALUATION_KEYS,
+    JSON_NON_REFUSAL_EVALUATION_PROMPT,
+    NON_REFUSAL_EVALUATION_PROMPT,
+)
+from .sqlite_cache import SQLiteCache
+from .utils import remove_citation_from_answer
+
+# Judge cache settings shared by every evaluation made in this process.
+JUDGE_CACHE_CONFIG = {
+    "enabled": True,
+    # Defaults to a file in the datasets cache directory
+    "path": None,
+    "max_entries": 100_000,
+    # False only refreshes the cache: every answer is judged again and stored
+    "read": True,
+}
+
+
+def _version(*prompts: str) -> str:
+    return hashlib.sha256("".join(prompts).encode()).hexdigest()[:16]
+
+
+# Version of the prompts of every judge format, in the verdict keys and in
+# `evaluation_result.meta.prompt_version`. The one-item and batched judge
+# grade with the same rubric and share the "text" version. Editing the
+# prompts of a format only starts a new cache namespace for that format.
+PROMPT_VERSIONS = {
+    "text": _version(
+        NON_REFUSAL_EVALUATION_PROMPT,
+        BATCHED_NON_REFUSAL_EVALUATION_PROMPT,
+        BATCHED_NON_REFUSAL_EVALUATION_ITEM,
+    ),
+    "json": _version(
+        JSON_NON_REFUSAL_EVALUATION_PROMPT, JSON_NON_REFUSAL_EVALUATION_KEYS
+    ),
+    "json_justified": _version(
+        JSON_NON_REFUSAL_EVALUATION_PROMPT, JSON_NON_REFUSAL_EVALUATION_JUSTIFIED_KEYS
+    ),
+}
+
+# The cache of the current settings, reopened when they change
+_cache: Optional[SQLiteCache] = None
+
+
+def configure_judge_cache(**kwargs) -> None:
+    """Update the judge cache settings.
+
+    Args:
+        enabled (bool): Whether verdicts are looked up and stored.
+        path (str): The SQLite file of the cache.
+        max_entries (int): The verdicts kept; the least recently used are evicted.
+        read (bool): Whether cached verdicts are reused, False to judge again and refresh them.
+    """
+    global _cache
+    unknown = set(kwargs) - set(JUDGE_CACHE_CONFIG)
+    if unknown:
+        raise ValueError(f"Unknown judge cache options: {sorted(unknown)}")
+    JUDGE_CACHE_CONFIG.update(kwargs)
+    _cache = None
+
+
+def judge_cache_path() -> str:
+    if JUDGE_CACHE_CONFIG["path"]:
+        return JUDGE_CACHE_CONFIG["path"]
+    return os.path.join(config.HF_DATASETS_CACHE, "crest_judge", "verdicts.sqlite")
+
+
+def normalize_cache_answer(answer: str) -> str:
+    """Fold case, Unicode forms, whitespace and the final punctuation of an answer.
+
+    Unlike `normalize_answer`, signs and decimal or thousands separators are
+    kept: "-5%" and "5%", or "1,234" and "1.234", need their own verdicts.
+    """
+    text = " ".join(unicodedata.normalize("NFKC", answer).lower().split())
+    return text.rstrip(".!?;:").strip("\"' ")
+
+
+def judge_cache_key(
+    model_name: str,
+    seed: int,
+    judge_format: str,
+    question: str,
+    golden: str,
+    predicted: str,
+) -> str:
+    """The content address of a verdict.
+
+    The predicted answer is compared without its citations and after
+    `normalize_cache_answer`, so answers differing only in citations, case,
+    spacing or final punctuation share a verdict.
+    """
+    fields = [
+        model_name,
+        seed,
+        PROMPT_VERSIONS[judge_format],
+        judge_format,
+        question,
+        golden,
+        normalize_cache_answer(remove_citation_from_answer(predicted)),
+    ]
+    return hashlib.sha256(json.dumps(fields, ensure_ascii=False).encode()).hexdigest()
+
+
+def _judge_cache() -> SQLiteCache:
+    global _cache
+    if _cache is None:
+        _cache = SQLiteCache(
+            judge_cache_path(), max_entries=JUDGE_CACHE_CONFIG["max_entries"]
+        )
+    return _cache
+
+
+def get_verdict(key: str) -> Optional[str]:
+    """The cached judge output of a key, or None on a miss."""
+    if not (JUDGE_CACHE_CONFIG["enabled"] and JUDGE_CACHE_CONFIG["read"]):
+        return None
+    return _judge_cache().get(key)
+
+
+def put_verdict(key: str, output: str) -> None:
+    """Store a judge output, evicting the least recently used verdicts over the limit."""
+    if JUDGE_CACHE_CONFIG["enabled"]:
+        _judge_cache().put(key, output)
@@ -1,8 +1,47 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
 import sys
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
 
-from ..prompts.crest import DIRECT_ANSWER_GENERATION_PROMPT
-from ..utils import openai_chat_completion
+from ..backends import InferenceBackend, OpenAIBackend
+from ..prompts.crest import (
+    DIRECT_ANSWER_GENERATION_PROMPT,
+    DOCUMENT_PREFIX_PROMPT,
+    DOCUMENT_PREFIX_REFERENCE,
+)
+from ..retry import PredictionError
+from ..serializers import DocumentSerializer
+from ..tracking import record_details, record_usage
+from ..voting import majority_vote
+
+# `default` renders each prompt as one user message in its original order.
+# `prefix_cache` moves the documents into a leading system message shared by all
+# the calls of an example, so that only the variable parts follow the cached prefix.
+PROMPT_LAYOUTS = ["default", "prefix_cache"]
+
+# Closing tag of the prompts that ask for the answer between <Answer> and </Answer>
+ANSWER_END_TAG = "</Answer>"
+
+T = TypeVar("T")
+
+
+def run_concurrently(calls: List[Callable[[], T]], max_workers: int = 16) -> List[T]:
+    """Run independent blocking calls from a thread pool and return their results in order.
+
+    Every call runs in a copy of the caller's context, so the completion calls
+    are still recorded by the active usage tracker.
+
+    Args:
+        calls (List[Callable[[], T]]): The calls to run.
+        max_workers (int, optional): The maximum number of calls in flight. Defaults to 16.
+    Returns:
+        List[T]: The results of the calls.
+    """
+    if len(calls) <= 1 or max_workers <= 1:
+        return [call() for call in calls]
+    with ThreadPoolExecutor(max_workers=min(len(calls), max_workers)) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, call) for call in calls]
+        return [future.result() for future in futures]
 
 
 class BaselineMethod:
@@ -11,17 +50,67 @@ class BaselineMethod:
     Args:
         model_name (str): The name of the model to use.
         seed (int): The seed to use for the answer generation.
+        backend (Optional[InferenceBackend]): The backend answering the prompts. Defaults to the OpenAI API.
+        prompt_layout (str): One of `PROMPT_LAYOUTS`. Defaults to "default".
+        early_stop (bool): Stop generating at the closing answer tag. Defaults to False.
+        doc_format (str): One of `evaluation.serializers.DOCUMENT_FORMATS`. Defaults to "raw".
+        n (int): The samples of the answer call, voted by self-consistency. Defaults to 1.
+        temperature (Optional[float]): The temperature of the answer call. Defaults to the API default.
     Attributes:
         base_prompt (str): The base prompt to use for the answer generation.
         model_name (str): The name of the model to use.
         seed (int): The seed to use for the answer generation.
+        backend_name (str): The name of the inference backend.
+        prompt_layout (str): The prompt layout.
+        early_stop (bool): Whether generation stops at the closing answer tag.
+        doc_format (str): The format of the documents in the prompts.
+        n (int): The samples of the answer call.
+        temperature (Optional[float]): The temperature of the answer call.
+
+    With `n` > 1 the call producing the final answer requests `n` samples at
+    once, so they share the prompt tokens, and returns the majority answer
+    (see `evaluation.voting.majority_vote`). The intermediate calls of the
+    multi-step methods are unchanged.
     """
 
     base_prompt = DIRECT_ANSWER_GENERATION_PROMPT
 
-    def __init__(self, model_name: str, seed: int = 42):
+    def __init__(
+        self,
+        model_name: str,
+        seed: int = 42,
+        backend: Optional[InferenceBackend] = None,
+        prompt_layout: str = "default",
+        early_stop: bool = False,
+        doc_format: str = "raw",
+        n: int = 1,
+        temperature: Optional[float] = None,
+    ):
+        if prompt_layout not in PROMPT_LAYOUTS:
+            raise ValueError(
+                f"Invalid prompt layout: {prompt_layout}. Choose from {PROMPT_LAYOUTS}"
+            )
         self.model_name = model_name
         self.seed = seed
+        self._backend = backend or OpenAIBackend()
+        self.backend_name = self._backend.name
+        self.prompt_layout = prompt_layout
+        self.early_stop = early_stop
+        self.doc_format = doc_format
+        self.n = n
+        self.temperature = temperature
+        self._serializer = DocumentSerializer(doc_format)
+
+    @property
+    def stop_sequences(self) -> Optional[List[str]]:
+        """The stop sequences of the answer generation calls, if early stopping applies.
+
+        Everything after the closing answer tag is discarded by the answer
+        parsing, so generating it only costs tokens and time.
+        """
+        if self.early_stop and ANSWER_END_TAG in self.base_prompt:
+            return [ANSWER_END_TAG]
+        return None
 
     def predict(
         self, question: str, docs: List[str]
@@ -34,18 +123,48 @@ class BaselineMethod:
 
         Returns:
             tuple[str, str, str, int, int]: The parsed answer, the prompt, the predicted answer, the prompt tokens, and the completion tokens.
+        Raises:
+            PredictionError: If the answer could not be generated.
         """
-        prompt = self.base_prompt.format(
-            question=question, docs=self.serialize_docs(docs)
+        messages = self.build_messages(
+            self.base_prompt, self.serialize_docs(docs), question=question
         )
-        messages = [{"role": "user", "content": prompt}]
-        predicted_answer, usage, error = self.get_response(messages)
+        prompt = self.render_prompt(messages)
+        predicted_answer, usage, error = self.get_answer_response(messages)
+        return self._build_prediction(question, prompt, predicted_answer, usage, error)
 
+    async def predict_async(
+        self, question: str, docs: List[str]
+    ) -> tuple[Optional[str], Optional[dict], Optional[Exception]]:
+        """Asynchronous version of `predict`.
+
+        Args:
+            question (str): The question to answer.
+            docs (List[str]): The documents to use for the answer.
+
+        Returns:
+            tuple[str, str, str, int, int]: The parsed answer, the prompt, the predicted answer, the prompt tokens, and the completion tokens.
+        """
+        messages = self.build_messages(
+            self.base_prompt, self.serialize_docs(docs), question=question
+        )
+        prompt = self.render_prompt(messages)
+        predicted_answer, usage, error = await self.get_answer_response_async(messages)
+        return self._build_prediction(question, prompt, predicted_answer, usage, error)
+
+    def _build_prediction(
+        self,
+        question: str,
+        prompt: str,
+        predicted_answer: Optional[str],
+        usage: Optional[dict],
+        error: Optional[Exception],
+    ) -> tuple[str, str, str, int, int]:
         if error is not None:
             print(f"[!] Error with question: {question}", file=sys.stderr)
-            return "", prompt, "", 0, 0
+            raise PredictionError.from_error(error)
 
-        parsed_answer = predicted_answer.split("<Answer>")[-1].split("</Answer>")[0]
+        parsed_answer = self.parse_answer(predicted_answer)
 
         return (
             parsed_answer,
@@ -55,15 +174,157 @@ class BaselineMethod:
             usage.completion_tokens,
         )
 
+    @staticmethod
+    def parse_answer(output: str) -> str:
+        """Extract the answer from a model output."""
+        return output.split("<Answer>")[-1].split("</Answer>")[0]
+
+    @staticmethod
+    def replace_answer(output: str, answer: str) -> str:
+        """Replace the answer that `parse_answer` extracts from a model output."""
+        head, tag, tail = output.rpartition("<Answer>")
+        end = tail.find("</Answer>")
+        return head + tag + answer + (tail[end:] if end != -1 else "")
+
+    def build_messages(
+        self, template: str, docs_str: str, **fields
+    ) -> List[Dict[str, str]]:
+        """Render a prompt template with the documents according to `prompt_layout`.
+
+        Args:
+            template (str): The prompt template with a `{docs}` field.
+            docs_str (str): The serialized documents.
+            **fields: The other fields of the template.
+        Returns:
+            List[Dict[str, str]]: The chat messages.
+        """
+        if self.prompt_layout == "prefix_cache":
+            return [
+                {"role": "system", "content": self.document_prefix(docs_str)},
+                {
+                    "role": "user",
+                    "content": template.format(
+                        docs=DOCUMENT_PREFIX_REFERENCE, **fields
+                    ),
+                },
+            ]
+        return [{"role": "user", "content": template.format(docs=docs_str, **fields)}]
+
+    @staticmethod
+    def document_prefix(docs_str: str) -> str:
+        return DOCUMENT_PREFIX_PROMPT.format(docs=docs_str)
+
+    @staticmethod
+    def render_prompt(messages: List[Dict[str, str]]) -> str:
+        """Flatten chat messages into the prompt string recorded with the prediction."""
+        return "\n\n".join(message["content"] for message in messages)
+
     def get_response(
         self, messages: List[Dict]
     ) -> tuple[Optional[str], Optional[dict], Optional[Exception]]:
-        return openai_chat_completion(
+        response, usage, error = self._backend.chat_completion(
+            model_name=self.model_name,
+            messages=messages,
+            seed=self.seed,
+            stop=self.stop_sequences,
+        )
+        record_usage(usage)
+        return response, usage, error
+
+    async def get_response_async(
+        self, messages: List[Dict]
+    ) -> tuple[Optional[str], Optional[dict], Optional[Exception]]:
+        response, usage, error = await self._backend.chat_completion_async(
             model_name=self.model_name,
             messages=messages,
             seed=self.seed,
+            stop=self.stop_sequences,
         )
+        record_usage(usage)
+        return response, usage, error
+
+    @property
+    def samples_answer(self) -> bool:
+        return self.n > 1 or self.temperature is not None
+
+    def get_answer_response(
+        self, messages: List[Dict]
+    ) -> tuple[Optional[str], Optional[dict], Optional[Exception]]:
+        """Like `get_response`, for the call producing the final answer.
+
+        Samples `n` outputs in one request and returns the output of the
+        majority answer when `n` > 1.
+        """
+        if not self.samples_answer:
+            return self.get_response(messages)
+        outputs, usage, error = self._backend.sample_completions(
+            model_name=self.model_name,
+            messages=messages,
+            n=self.n,
+            temperature=self.temperature,
+            seed=self.seed,
+            stop=self.stop_sequences,
+        )
+        record_usage(usage)
+        return self._vote(outputs), usage, error
+
+    async def get_answer_response_async(
+        self, messages: List[Dict]
+    ) -> tuple[Optional[str], Optional[dict], Optional[Exception]]:
+        """Asynchronous version of `get_answer_response`."""
+        if not self.samples_answer:
+            return await self.get_response_async(messages)
+        outputs, usage, error = await self._backend.sample_completions_async(
+            model_name=self.model_name,
+            messages=messages,
+            n=self.n,
+            temperature=self.temperature,
+            seed=self.seed,
+            stop=self.stop_sequences,
+        )
+        record_usage(usage)
+        return self._vote(outputs), usage, error
+
+    def _vote(self, outputs: Optional[List[Optional[str]]]) -> Optional[str]:
+        """The output of the majority answer, with the citations of its voters."""
+        if not outputs or all(output is None for output in outputs):
+            return None
+        if len(outputs) == 1:
+            return outputs[0]
+        answers = [
+            self.parse_answer(output) if output is not None else None
+            for output in outputs
+        ]
+        index, answer, votes = majority_vote(answers)
+        record_details(
+            self_consistency={"samples": answers, "votes": votes, "chosen": index}
+        )
+        return self.replace_answer(outputs[index], answer)
+
+    def plan_requests(
+        self, question: str, docs: List[str], completion_tokens: int = 512
+    ) -> List[Tuple[List[Dict[str, str]], int]]:
+        """List the requests `predict` sends for an example, without sending them.
+
+        Used by the dry-run planner. Model outputs that later prompts depend on
+        are replaced by placeholders of `completion_tokens` tokens.
+
+        Args:
+            question (str): The question to answer.
+            docs (List[str]): The documents to use for the answer.
+            completion_tokens (int, optional): The expected tokens of an answer. Defaults to 512.
+        Returns:
+            List[Tuple[List[Dict[str, str]], int]]: The messages of every request and its expected completion tokens.
+        """
+        messages = self.build_messages(
+            self.base_prompt, self.serialize_docs(docs), question=question
+        )
+        return [(messages, completion_tokens)]
 
     @staticmethod
-    def serialize_docs(docs: List[str]) -> str:
-        return "\n".join([f"[{i + 1}]\n{doc}" for i, doc in enumerate(docs)])
+    def placeholder_output(num_tokens: int) -> str:
+        """A stand-in model output of roughly `num_tokens` tokens."""
+        return " ".join(["token"] * num_tokens)
+
+    def serialize_docs(self, docs: List[str]) -> str:
+        return self._serializer.serialize(docs)
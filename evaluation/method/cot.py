@@ -18,9 +18,10 @@ class CoTMethod(BaselineMethod):
         seed (int): The seed to use for the answer generation.
     """
 
-    def __init__(self, model_name: str, seed: int = 42, reasoning: bool = False):
-        self.model_name = model_name
-        self.seed = seed
+    def __init__(
+        self, model_name: str, seed: int = 42, reasoning: bool = False, **kwargs
+    ):
+        super().__init__(model_name, seed, **kwargs)
         self.base_prompt = (
             NAIVE_COT_ANSWER_GENERATION_PROMPT
             if not reasoning
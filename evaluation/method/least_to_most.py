@@ -1,12 +1,41 @@
-import json
+import asyncio
+from functools import partial
+import re
 import sys
 from typing import Dict, List, Optional, Tuple
 
-from .baseline import BaselineMethod
+from ..retry import PredictionError
+from ..tracking import record_details
+from .baseline import BaselineMethod, run_concurrently
+
+# `sequential` solves the sub-questions in order within one growing conversation.
+# `graph` has the decomposition declare the dependencies of every sub-question,
+# solves independent sub-questions concurrently and passes each step only the
+# sub-answers it depends on.
+SOLVE_MODES = ["sequential", "graph"]
+
+# "<number>. <sub-question> [depends on: <numbers>]" lines of a graph decomposition
+SUB_QUESTION_PATTERN = re.compile(
+    r"^\s*(\d+)[.):]\s*(.+?)\s*(?:\[depends on:?([^\]]*)\])?\s*$", re.IGNORECASE
+)
+
+# A sub-question and the indices of the earlier sub-questions it depends on
+SubQuestion = Tuple[str, List[int]]
 
 
 class LeastToMostMethod(BaselineMethod):
-    """RAG QA using least-to-most prompting, extending NaiveMethod with staged methods."""
+    """RAG QA using least-to-most prompting, extending NaiveMethod with staged methods.
+
+    Args:
+        model_name (str): The name of the model to use.
+        seed (int): The random seed.
+        solve_mode (str): One of `SOLVE_MODES`. Defaults to "sequential".
+        max_parallel_calls (int): The maximum number of concurrent calls of `predict` in `graph` mode.
+
+    In `graph` mode the prompt of a step holds the documents, the sub-answers
+    it depends on and its sub-question, so it no longer grows with the whole
+    transcript. The final question depends on every sub-question.
+    """
 
     decomposition_template: str = (
         "You are an assistant that decomposes a question into simpler sub-questions.\n"
@@ -36,6 +65,39 @@ class LeastToMostMethod(BaselineMethod):
         "{sub_question}\n"
         "</Question>\n"
     )
+    graph_decomposition_template: str = (
+        "You are an assistant that decomposes a question into simpler sub-questions.\n"
+        "Context:\n{docs}\n"
+        "Question: {question}\n"
+        "Return each sub-question on its own line as `<number>. <sub-question> [depends on: <numbers>]`, numbered from 1.\n"
+        "List only the earlier sub-questions whose answers are needed to answer it, or write `[depends on: none]`."
+    )
+    dependency_template: str = (
+        "<SubQuestion>\n"
+        "{sub_question}\n"
+        "</SubQuestion>\n"
+        "<SubAnswer>\n"
+        "{sub_answer}\n"
+        "</SubAnswer>\n"
+    )
+    # Number of sub-questions assumed by the dry-run planner
+    planned_sub_questions: int = 3
+
+    def __init__(
+        self,
+        model_name: str,
+        seed: int = 42,
+        solve_mode: str = "sequential",
+        max_parallel_calls: int = 16,
+        **kwargs,
+    ):
+        if solve_mode not in SOLVE_MODES:
+            raise ValueError(
+                f"Invalid solve mode: {solve_mode}. Choose from {SOLVE_MODES}"
+            )
+        super().__init__(model_name, seed, **kwargs)
+        self.solve_mode = solve_mode
+        self.max_parallel_calls = max_parallel_calls
 
     def predict(
         self, question: str, docs: List[str]
@@ -48,23 +110,293 @@ class LeastToMostMethod(BaselineMethod):
             question, docs_string
         )
         if dec_error or not sub_questions:
-            return (
-                None,
-                dec_prompt,
-                dec_resp,
-                dec_usage.prompt_tokens if dec_usage else 0,
-                dec_usage.completion_tokens if dec_usage else 0,
+            self._raise_decomposition_failure(dec_error)
+
+        # Stage 2: Solve
+        if self.solve_mode == "graph":
+            final_answer, total_tokens = self._solve_graph(
+                self._with_final_question(sub_questions, question), docs_string
+            )
+        else:
+            sub_questions.append(question)
+            final_answer, total_tokens = self._solve_subquestions(
+                sub_questions, docs_string
             )
+        return self._build_final_prediction(
+            final_answer, total_tokens, dec_prompt, dec_resp, dec_usage
+        )
+
+    async def predict_async(
+        self, question: str, docs: List[str]
+    ) -> Tuple[Optional[str], Optional[str], Optional[str], int, int]:
+        """Asynchronous version of `predict`."""
+        docs_string = self.serialize_docs(docs)
+
+        # Stage 1: Decompose
+        sub_questions, dec_prompt, dec_resp, dec_usage, dec_error = (
+            await self._decompose_async(question, docs_string)
+        )
+        if dec_error or not sub_questions:
+            self._raise_decomposition_failure(dec_error)
 
         # Stage 2: Solve
-        sub_questions.append(question)
-        final_answer, total_tokens = self._solve_subquestions(
-            sub_questions, docs_string
+        if self.solve_mode == "graph":
+            final_answer, total_tokens = await self._solve_graph_async(
+                self._with_final_question(sub_questions, question), docs_string
+            )
+        else:
+            sub_questions.append(question)
+            final_answer, total_tokens = await self._solve_subquestions_async(
+                sub_questions, docs_string
+            )
+        return self._build_final_prediction(
+            final_answer, total_tokens, dec_prompt, dec_resp, dec_usage
+        )
+
+    def plan_requests(
+        self, question: str, docs: List[str], completion_tokens: int = 512
+    ) -> List[Tuple[List[Dict], int]]:
+        """List the decomposition and the solving requests with their growing conversation.
+
+        In `graph` mode every sub-question is assumed to depend on all the
+        earlier ones, an upper bound of the sub-answers passed forward.
+        """
+        docs_string = self.serialize_docs(docs)
+        sub_questions = [self.placeholder_output(32)] * self.planned_sub_questions
+        requests = [
+            (
+                self.build_messages(
+                    self._decomposition_template, docs_string, question=question
+                ),
+                32 * self.planned_sub_questions,
+            )
+        ]
+
+        if self.solve_mode == "graph":
+            steps = [
+                (sub_question, list(range(index)))
+                for index, sub_question in enumerate(sub_questions + [question])
+            ]
+            answers = [self.placeholder_output(completion_tokens)] * len(steps)
+            for index in range(len(steps)):
+                requests.append(
+                    (
+                        self._step_messages(steps, answers, index, docs_string),
+                        completion_tokens,
+                    )
+                )
+            return requests
+
+        messages = self.build_messages(self.solving_context_template, docs_string)
+        for sub_question in sub_questions + [question]:
+            messages = messages + [
+                {
+                    "role": "user",
+                    "content": self.solving_template.format(sub_question=sub_question),
+                }
+            ]
+            requests.append((messages, completion_tokens))
+            messages = messages + [
+                {
+                    "role": "assistant",
+                    "content": self.placeholder_output(completion_tokens),
+                }
+            ]
+        return requests
+
+    @property
+    def _decomposition_template(self) -> str:
+        if self.solve_mode == "graph":
+            return self.graph_decomposition_template
+        return self.decomposition_template
+
+    @staticmethod
+    def _with_final_question(
+        sub_questions: List[str], question: str
+    ) -> List[SubQuestion]:
+        """Parse the dependencies of the sub-questions and add the question depending on all of them.
+
+        Dependencies on missing or later sub-questions are dropped, so the
+        steps always form a DAG. A line without a number has no dependencies.
+        """
+        labels: Dict[str, int] = {}
+        steps: List[SubQuestion] = []
+        for line in sub_questions:
+            match = SUB_QUESTION_PATTERN.match(line)
+            if match is None:
+                steps.append((line.strip(), []))
+                continue
+            number, sub_question, depends_on = match.groups()
+            deps = [
+                labels[label]
+                for label in re.findall(r"\d+", depends_on or "")
+                if label in labels
+            ]
+            labels[number] = len(steps)
+            steps.append((sub_question, sorted(set(deps))))
+        steps.append((question, list(range(len(steps)))))
+        return steps
+
+    @staticmethod
+    def _levels(steps: List[SubQuestion]) -> List[List[int]]:
+        """Group the steps into levels whose dependencies are all in earlier levels."""
+        depths: List[int] = []
+        for _, deps in steps:
+            depths.append(1 + max((depths[dep] for dep in deps), default=-1))
+        levels: List[List[int]] = [[] for _ in range(max(depths) + 1)]
+        for index, depth in enumerate(depths):
+            levels[depth].append(index)
+        return levels
+
+    def _step_messages(
+        self,
+        steps: List[SubQuestion],
+        answers: List[Optional[str]],
+        index: int,
+        docs_string: str,
+    ) -> List[Dict]:
+        """The documents, the sub-answers a step depends on and its sub-question."""
+        sub_question, deps = steps[index]
+        context = "".join(
+            self.dependency_template.format(
+                sub_question=steps[dep][0],
+                sub_answer=answers[dep]
+                .split("<Answer>")[-1]
+                .split("</Answer>")[0]
+                .strip(),
+            )
+            for dep in deps
+        )
+        messages = self.build_messages(self.solving_context_template, docs_string)
+        messages.append(
+            {
+                "role": "user",
+                "content": context
+                + self.solving_template.format(sub_question=sub_question),
+            }
+        )
+        return messages
+
+    @staticmethod
+    def _parse_step(
+        sub_question: str,
+        response: Optional[str],
+        usage: Optional[object],
+        error: Optional[Exception],
+    ) -> Tuple[str, object]:
+        if error:
+            print(
+                f"[!] Solving error for sub-question: {sub_question}",
+                file=sys.stderr,
+            )
+            raise PredictionError.from_error(error)
+        return response, usage
+
+    def _solve_step(
+        self,
+        steps: List[SubQuestion],
+        answers: List[Optional[str]],
+        index: int,
+        docs_string: str,
+    ) -> Tuple[str, object]:
+        messages = self._step_messages(steps, answers, index, docs_string)
+        if index == len(steps) - 1:
+            response, usage, error = self.get_answer_response(messages)
+        else:
+            response, usage, error = self.get_response(messages)
+        return self._parse_step(steps[index][0], response, usage, error)
+
+    async def _solve_step_async(
+        self,
+        steps: List[SubQuestion],
+        answers: List[Optional[str]],
+        index: int,
+        docs_string: str,
+    ) -> Tuple[str, object]:
+        messages = self._step_messages(steps, answers, index, docs_string)
+        if index == len(steps) - 1:
+            response, usage, error = await self.get_answer_response_async(messages)
+        else:
+            response, usage, error = await self.get_response_async(messages)
+        return self._parse_step(steps[index][0], response, usage, error)
+
+    def _solve_graph(
+        self, steps: List[SubQuestion], docs_string: str
+    ) -> Tuple[str, Dict[str, int]]:
+        """Stage 2 in `graph` mode: solve the steps level by level, each level concurrently."""
+        answers: List[Optional[str]] = [None] * len(steps)
+        total_tokens = {"prompt_tokens": 0, "completion_tokens": 0}
+        levels = self._levels(steps)
+        for level in levels:
+            results = run_concurrently(
+                [
+                    partial(self._solve_step, steps, answers, index, docs_string)
+                    for index in level
+                ],
+                self.max_parallel_calls,
+            )
+            self._record_level(level, results, answers, total_tokens)
+        self._record_graph(steps, levels)
+        return answers[-1], total_tokens
+
+    async def _solve_graph_async(
+        self, steps: List[SubQuestion], docs_string: str
+    ) -> Tuple[str, Dict[str, int]]:
+        """Asynchronous version of `_solve_graph`."""
+        answers: List[Optional[str]] = [None] * len(steps)
+        total_tokens = {"prompt_tokens": 0, "completion_tokens": 0}
+        levels = self._levels(steps)
+        for level in levels:
+            results = await asyncio.gather(
+                *(
+                    self._solve_step_async(steps, answers, index, docs_string)
+                    for index in level
+                )
+            )
+            self._record_level(level, results, answers, total_tokens)
+        self._record_graph(steps, levels)
+        return answers[-1], total_tokens
+
+    @staticmethod
+    def _record_level(
+        level: List[int],
+        results: List[Tuple[str, object]],
+        answers: List[Optional[str]],
+        total_tokens: Dict[str, int],
+    ) -> None:
+        for index, (response, usage) in zip(level, results):
+            answers[index] = response
+            total_tokens["prompt_tokens"] += usage.prompt_tokens
+            total_tokens["completion_tokens"] += usage.completion_tokens
+
+    @staticmethod
+    def _record_graph(steps: List[SubQuestion], levels: List[List[int]]) -> None:
+        record_details(
+            decomposition={
+                "num_sub_questions": len(steps) - 1,
+                "num_levels": len(levels),
+                "dependencies": [deps for _, deps in steps[:-1]],
+            }
         )
+
+    @staticmethod
+    def _raise_decomposition_failure(dec_error: Optional[Exception]) -> None:
+        if dec_error is None:
+            dec_error = PredictionError("No sub-questions were generated")
+        raise PredictionError.from_error(dec_error)
+
+    @staticmethod
+    def _build_final_prediction(
+        final_answer: str,
+        total_tokens: Dict[str, int],
+        dec_prompt: str,
+        dec_resp: Optional[str],
+        dec_usage: object,
+    ) -> Tuple[Optional[str], Optional[str], Optional[str], int, int]:
         total_tokens["prompt_tokens"] += dec_usage.prompt_tokens
         total_tokens["completion_tokens"] += dec_usage.completion_tokens
 
-        parsed_answer = final_answer.split("<Answer>")[-1].split("</Answer>")[0]
+        parsed_answer = BaselineMethod.parse_answer(final_answer)
 
         return (
             parsed_answer,
@@ -76,20 +408,49 @@ class LeastToMostMethod(BaselineMethod):
 
     def _decompose(
         self, question: str, docs_string: str
-    ) -> Tuple[Optional[List[str]], str, Optional[str], Optional[object], bool]:
+    ) -> Tuple[
+        Optional[List[str]], str, Optional[str], Optional[object], Optional[Exception]
+    ]:
         """Stage 1: generate sub-questions from the main question."""
-        prompt = self.decomposition_template.format(docs=docs_string, question=question)
-        messages = [{"role": "user", "content": prompt}]
+        messages = self.build_messages(
+            self._decomposition_template, docs_string, question=question
+        )
+        prompt = self.render_prompt(messages)
         resp, usage, error = self.get_response(messages)
+        return self._parse_decomposition(question, prompt, resp, usage, error)
+
+    async def _decompose_async(
+        self, question: str, docs_string: str
+    ) -> Tuple[
+        Optional[List[str]], str, Optional[str], Optional[object], Optional[Exception]
+    ]:
+        """Asynchronous version of `_decompose`."""
+        messages = self.build_messages(
+            self._decomposition_template, docs_string, question=question
+        )
+        prompt = self.render_prompt(messages)
+        resp, usage, error = await self.get_response_async(messages)
+        return self._parse_decomposition(question, prompt, resp, usage, error)
+
+    @staticmethod
+    def _parse_decomposition(
+        question: str,
+        prompt: str,
+        resp: Optional[str],
+        usage: Optional[object],
+        error: Optional[Exception],
+    ) -> Tuple[
+        Optional[List[str]], str, Optional[str], Optional[object], Optional[Exception]
+    ]:
         if error:
             print(f"[!] Decomposition error for question: {question}", file=sys.stderr)
-            return None, prompt, None, None, True
+            return None, prompt, None, None, error
         try:
             sub_questions = [q for q in resp.strip().split("\n") if q.strip()]
-        except Exception:
+        except Exception as e:
             print(f"[!] Failed to parse sub-questions: {resp}", file=sys.stderr)
-            return None, prompt, resp, usage, True
-        return sub_questions, prompt, resp, usage, False
+            return None, prompt, resp, usage, PredictionError(str(e))
+        return sub_questions, prompt, resp, usage, None
 
     def _solve_subquestions(
         self, sub_questions: List[str], docs_string: str
@@ -98,23 +459,54 @@ class LeastToMostMethod(BaselineMethod):
         prompt_tokens = 0
         completion_tokens = 0
 
-        messages = [
-            {
-                "role": "user",
-                "content": self.solving_context_template.format(docs=docs_string),
-            }
-        ]
-        for sub_question in sub_questions:
+        messages = self.build_messages(self.solving_context_template, docs_string)
+        for index, sub_question in enumerate(sub_questions):
             prompt = self.solving_template.format(sub_question=sub_question)
             messages.append({"role": "user", "content": prompt})
 
-            response, usage, error = self.get_response(messages)
+            if index == len(sub_questions) - 1:
+                response, usage, error = self.get_answer_response(messages)
+            else:
+                response, usage, error = self.get_response(messages)
+            if error:
+                print(
+                    f"[!] Solving error for sub-question: {sub_question}",
+                    file=sys.stderr,
+                )
+                raise PredictionError.from_error(error)
+
+            messages.append({"role": "assistant", "content": response})
+            prompt_tokens += usage.prompt_tokens
+            completion_tokens += usage.completion_tokens
+
+        total_tokens = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+        }
+        return response, total_tokens
+
+    async def _solve_subquestions_async(
+        self, sub_questions: List[str], docs_string: str
+    ) -> Tuple[str, Dict[str, int]]:
+        """Asynchronous version of `_solve_subquestions`."""
+        prompt_tokens = 0
+        completion_tokens = 0
+
+        messages = self.build_messages(self.solving_context_template, docs_string)
+        for index, sub_question in enumerate(sub_questions):
+            prompt = self.solving_template.format(sub_question=sub_question)
+            messages.append({"role": "user", "content": prompt})
+
+            if index == len(sub_questions) - 1:
+                response, usage, error = await self.get_answer_response_async(messages)
+            else:
+                response, usage, error = await self.get_response_async(messages)
             if error:
                 print(
                     f"[!] Solving error for sub-question: {sub_question}",
                     file=sys.stderr,
                 )
-                break
+                raise PredictionError.from_error(error)
 
             messages.append({"role": "assistant", "content": response})
             prompt_tokens += usage.prompt_tokens
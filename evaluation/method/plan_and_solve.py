@@ -5,7 +5,6 @@ from .baseline import BaselineMethod
 class PlanAndSolveMethod(BaselineMethod):
     """RAG QA using Plan-and-Solve prompting, extending BaselineMethod."""
 
-    def __init__(self, model_name: str, seed: int = 42):
-        self.model_name = model_name
-        self.seed = seed
+    def __init__(self, model_name: str, seed: int = 42, **kwargs):
+        super().__init__(model_name, seed, **kwargs)
         self.base_prompt = PLAN_AND_SOLVE_ANSWER_GENERATION_PROMPT
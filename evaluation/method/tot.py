@@ -1,6 +1,80 @@
-from typing import List, Optional, Tuple
+import asyncio
+from functools import partial
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
-from .baseline import BaselineMethod
+from ..retry import PredictionError
+from ..tracking import record_details
+from .baseline import BaselineMethod, run_concurrently
+
+# Score of a candidate by evaluation label, `maybe` for unexpected answers
+SCORE_MAP = {"sure": 1.0, "maybe": 0.5, "impossible": 0.0}
+# "<number>: <label>" lines of a batched evaluation
+BATCH_SCORE_PATTERN = re.compile(r"(\d+)\W+(sure|maybe|impossible)\b", re.IGNORECASE)
+
+# (parent thoughts, candidates) scored by one evaluation task
+EvaluationTask = Tuple[Tuple[str, ...], List[str]]
+
+
+class SearchState:
+    """The frontier, memoized scores and statistics of the search of one example.
+
+    Attributes:
+        frontier (List[Tuple[List[str], float]]): The best paths found so far with their scores.
+        scores (Dict[Tuple[Tuple[str, ...], str], float]): The score of every evaluated (thoughts, candidate).
+        usage (List[int]): The prompt and completion tokens of the search calls.
+        num_calls (int): The number of search calls.
+        depth (int): The number of expanded levels.
+        widths (List[int]): The number of expanded paths of every level.
+        stop_reason (Optional[str]): Why the search stopped, None while it runs.
+    """
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.frontier: List[Tuple[List[str], float]] = [([], 0.0)]
+        self.scores: Dict[Tuple[Tuple[str, ...], str], float] = {}
+        self.usage = [0, 0]
+        self.num_calls = 0
+        self.depth = 0
+        self.widths: List[int] = []
+        self.nodes_expanded = 0
+        self.candidates_scored = 0
+        self.pruned = 0
+        self.last_level_seconds = 0.0
+        self.stop_reason: Optional[str] = None
+        self._level_start = self.start
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    def add_usage(self, usage: Tuple[int, int]) -> None:
+        self.num_calls += 1
+        self.usage[0] += usage[0]
+        self.usage[1] += usage[1]
+
+    def end_level(self, width: int) -> None:
+        now = time.monotonic()
+        self.last_level_seconds = now - self._level_start
+        self._level_start = now
+        self.depth += 1
+        self.widths.append(width)
+
+    def stats(self) -> Dict[str, Any]:
+        """The search statistics recorded in the prediction details."""
+        return {
+            "stop_reason": self.stop_reason,
+            "depth": self.depth,
+            "widths": self.widths,
+            "nodes_expanded": self.nodes_expanded,
+            "candidates_scored": self.candidates_scored,
+            "pruned": self.pruned,
+            "num_calls": self.num_calls,
+            "prompt_tokens": self.usage[0],
+            "completion_tokens": self.usage[1],
+            "elapsed": self.elapsed,
+        }
 
 
 class TreeOfThoughtMethod(BaselineMethod):
@@ -13,6 +87,22 @@ class TreeOfThoughtMethod(BaselineMethod):
         max_depth (int): The depth of ToT search.
         breadth (int): The number of candidates to retain at each step.
         k (int): The number of thought candidates to generate at once.
+        batch_scoring (bool): Score all candidates of a node in a single evaluation call.
+        max_parallel_calls (int): The maximum number of concurrent calls of `predict`.
+        stop_confidence (Optional[float]): Stop once the best path scores at least this, e.g. 1.0 for `sure`.
+        prune_impossible (bool): Drop the candidates scored `impossible` instead of expanding them.
+        max_tokens (Optional[int]): The token budget of the search of one example.
+        max_calls (Optional[int]): The call budget of the search of one example.
+        max_seconds (Optional[float]): The wall-clock budget of the search of one example.
+
+    The proposals of a depth level are requested concurrently, then the
+    evaluations of all their candidates, so a level takes two round-trips.
+    Scores are memoized per example by (thoughts, candidate).
+
+    The budgets only cover the search: when one runs out, the beam narrows to
+    the paths that still fit and the search stops with the best path found so
+    far, which is always followed by the final answer call. The search
+    statistics are added to the prediction details under `search`.
     """
 
     propose_prompt = (
@@ -32,6 +122,16 @@ class TreeOfThoughtMethod(BaselineMethod):
         "Candidate thought:\n{candidate}\n\n"
         "Just return exactly one word from [sure, maybe, impossible]."
     )
+    evaluate_batch_prompt = (
+        "Given the question, supporting documents, current reasoning steps, and candidate steps,\n"
+        "classify each candidate as one of [sure / maybe / impossible] for leading to a correct answer.\n\n"
+        "Question:\n{question}\n\n"
+        "Documents:\n{docs}\n\n"
+        "Current thoughts:\n{thoughts}\n\n"
+        "Candidate thoughts:\n{candidates}\n\n"
+        "Return one line per candidate in the form `<number>: <label>`, "
+        "where <label> is exactly one word from [sure, maybe, impossible]."
+    )
     final_prompt = (
         "You are a helpful assistant tasked with answering questions strictly based on the content of the provided documents. The documents may contain irrelevant or inaccurate information, so please reason carefully and critically when forming your answer.\n"
         "\n"
@@ -59,12 +159,26 @@ class TreeOfThoughtMethod(BaselineMethod):
         max_depth: int = 3,
         breadth: int = 5,
         k: int = 5,
+        batch_scoring: bool = False,
+        max_parallel_calls: int = 16,
+        stop_confidence: Optional[float] = None,
+        prune_impossible: bool = False,
+        max_tokens: Optional[int] = None,
+        max_calls: Optional[int] = None,
+        max_seconds: Optional[float] = None,
+        **kwargs,
     ):
-        self.model_name = model_name
-        self.seed = seed
+        super().__init__(model_name, seed, **kwargs)
         self.max_depth = max_depth
         self.breadth = breadth
         self.k = k
+        self.batch_scoring = batch_scoring
+        self.max_parallel_calls = max_parallel_calls
+        self.stop_confidence = stop_confidence
+        self.prune_impossible = prune_impossible
+        self.max_tokens = max_tokens
+        self.max_calls = max_calls
+        self.max_seconds = max_seconds
 
     def predict(
         self, question: str, docs: List[str]
@@ -78,26 +192,47 @@ class TreeOfThoughtMethod(BaselineMethod):
         Returns:
             Tuple[Optional[str], Optional[str], Optional[str], int, int]: The parsed answer, the prompt, the predicted answer, the prompt tokens, and the completion tokens.
         """
-        # Initialize token usage counters
-        total_prompt_tokens = 0
-        total_completion_tokens = 0
-
         best_path, search_usage = self._search_tree(question, docs)
-        total_prompt_tokens += search_usage[0]
-        total_completion_tokens += search_usage[1]
-
         final_answer, prompt, final_usage = self._final_answer(
             question, docs, best_path
         )
-        total_prompt_tokens += final_usage[0]
-        total_completion_tokens += final_usage[1]
+        return self._build_tot_prediction(
+            final_answer, prompt, search_usage, final_usage
+        )
+
+    async def predict_async(
+        self, question: str, docs: List[str]
+    ) -> Tuple[Optional[str], Optional[str], Optional[str], int, int]:
+        """Asynchronous version of `predict`.
+
+        Args:
+            question (str): The question to answer.
+            docs (List[str]): The documents to use for the answer.
+
+        Returns:
+            Tuple[Optional[str], Optional[str], Optional[str], int, int]: The parsed answer, the prompt, the predicted answer, the prompt tokens, and the completion tokens.
+        """
+        best_path, search_usage = await self._search_tree_async(question, docs)
+        final_answer, prompt, final_usage = await self._final_answer_async(
+            question, docs, best_path
+        )
+        return self._build_tot_prediction(
+            final_answer, prompt, search_usage, final_usage
+        )
 
+    @staticmethod
+    def _build_tot_prediction(
+        final_answer: str,
+        prompt: str,
+        search_usage: Tuple[int, int],
+        final_usage: Tuple[int, int],
+    ) -> Tuple[Optional[str], Optional[str], Optional[str], int, int]:
         return (
             final_answer,
             prompt,
             final_answer,  # Using the same final_answer as both parsed and predicted
-            total_prompt_tokens,
-            total_completion_tokens,
+            search_usage[0] + final_usage[0],
+            search_usage[1] + final_usage[1],
         )
 
     def _search_tree(
@@ -109,94 +244,407 @@ class TreeOfThoughtMethod(BaselineMethod):
         Returns:
             Tuple[List[str], Tuple[int, int]]: Best path and token usage (prompt_tokens, completion_tokens)
         """
-        frontier: List[Tuple[List[str], float]] = [([], 0.0)]
+        search = SearchState()
         docs_str = self.serialize_docs(docs)
 
-        # Track token usage
-        total_prompt_tokens = 0
-        total_completion_tokens = 0
+        while width := self._level_width(search):
+            frontier = search.frontier[:width]
+            proposals = run_concurrently(
+                [
+                    partial(self._generate_thoughts, question, docs_str, thoughts)
+                    for thoughts, _ in frontier
+                ],
+                self.max_parallel_calls,
+            )
+            tasks = self._evaluation_tasks(search, frontier, proposals)
+            results = run_concurrently(
+                [
+                    partial(self._score_candidates, question, docs_str, task)
+                    for task in tasks
+                ],
+                self.max_parallel_calls,
+            )
+            self._record_scores(search, tasks, results)
+            self._advance(search, frontier, proposals)
+
+        return self._finish_search(search)
+
+    async def _search_tree_async(
+        self, question: str, docs: List[str]
+    ) -> Tuple[List[str], Tuple[int, int]]:
+        """Asynchronous version of `_search_tree`."""
+        search = SearchState()
+        docs_str = self.serialize_docs(docs)
 
-        for _ in range(self.max_depth):
-            all_candidates: List[Tuple[List[str], float]] = []
-            for thoughts, _ in frontier:
-                next_ths, gen_usage = self._generate_thoughts(
-                    question, docs_str, thoughts
+        while width := self._level_width(search):
+            frontier = search.frontier[:width]
+            proposals = await asyncio.gather(
+                *(
+                    self._generate_thoughts_async(question, docs_str, thoughts)
+                    for thoughts, _ in frontier
+                )
+            )
+            tasks = self._evaluation_tasks(search, frontier, proposals)
+            results = await asyncio.gather(
+                *(
+                    self._score_candidates_async(question, docs_str, task)
+                    for task in tasks
                 )
-                total_prompt_tokens += gen_usage[0]
-                total_completion_tokens += gen_usage[1]
+            )
+            self._record_scores(search, tasks, results)
+            self._advance(search, frontier, proposals)
 
-                for cand in next_ths:
-                    score, eval_usage = self._evaluate_thought(
-                        question, docs_str, thoughts, cand
-                    )
-                    total_prompt_tokens += eval_usage[0]
-                    total_completion_tokens += eval_usage[1]
-                    all_candidates.append((thoughts + [cand], score))
+        return self._finish_search(search)
 
-            all_candidates.sort(key=lambda x: x[1], reverse=True)
-            frontier = all_candidates[: self.breadth]
+    def _level_width(self, search: SearchState) -> int:
+        """The number of frontier paths to expand at the next level, 0 to stop.
 
-        best_path, _ = max(frontier, key=lambda x: x[1]) if frontier else ([], 0.0)
-        return best_path, (total_prompt_tokens, total_completion_tokens)
+        The beam is narrowed to the paths whose proposal and evaluations still
+        fit the remaining call and token budgets, the tokens of a call being
+        estimated from the calls made so far.
+        """
+        if search.stop_reason is None and search.depth >= self.max_depth:
+            search.stop_reason = "max_depth"
+        if search.stop_reason is not None:
+            return 0
 
-    def _generate_thoughts(
+        width = len(search.frontier)
+        calls_per_path = 1 + (1 if self.batch_scoring else self.k)
+        if self.max_calls is not None:
+            width = min(width, (self.max_calls - search.num_calls) // calls_per_path)
+            if width < 1:
+                search.stop_reason = "call_budget"
+                return 0
+        if self.max_tokens is not None and search.num_calls:
+            tokens_per_call = sum(search.usage) / search.num_calls
+            remaining = self.max_tokens - sum(search.usage)
+            width = min(width, int(remaining // (tokens_per_call * calls_per_path)))
+            if width < 1:
+                search.stop_reason = "token_budget"
+                return 0
+        # Levels run their calls concurrently, so the last one predicts the next
+        if (
+            self.max_seconds is not None
+            and search.elapsed + search.last_level_seconds > self.max_seconds
+        ):
+            search.stop_reason = "time_budget"
+            return 0
+        return width
+
+    def _evaluation_tasks(
+        self,
+        search: SearchState,
+        frontier: List[Tuple[List[str], float]],
+        proposals: List[Tuple[List[str], Tuple[int, int]]],
+    ) -> List[EvaluationTask]:
+        """Group the candidates without a memoized score into evaluation calls."""
+        tasks: List[EvaluationTask] = []
+        pending = set()
+        for (thoughts, _), (candidates, gen_usage) in zip(frontier, proposals):
+            search.add_usage(gen_usage)
+            parent = tuple(thoughts)
+            new = []
+            for cand in candidates:
+                if (parent, cand) not in search.scores and (
+                    parent,
+                    cand,
+                ) not in pending:
+                    pending.add((parent, cand))
+                    new.append(cand)
+            if self.batch_scoring:
+                tasks.extend([(parent, new)] if new else [])
+            else:
+                tasks.extend((parent, [cand]) for cand in new)
+        search.nodes_expanded += len(frontier)
+        return tasks
+
+    @staticmethod
+    def _record_scores(
+        search: SearchState,
+        tasks: List[EvaluationTask],
+        results: List[Tuple[List[float], Tuple[int, int]]],
+    ) -> None:
+        for (parent, candidates), (cand_scores, eval_usage) in zip(tasks, results):
+            search.add_usage(eval_usage)
+            search.candidates_scored += len(candidates)
+            for cand, score in zip(candidates, cand_scores):
+                search.scores[(parent, cand)] = score
+
+    def _advance(
+        self,
+        search: SearchState,
+        frontier: List[Tuple[List[str], float]],
+        proposals: List[Tuple[List[str], Tuple[int, int]]],
+    ) -> None:
+        """Move to the next level, keeping the best-scored `breadth` candidates."""
+        all_candidates = [
+            (thoughts + [cand], search.scores[(tuple(thoughts), cand)])
+            for (thoughts, _), (candidates, _) in zip(frontier, proposals)
+            for cand in candidates
+        ]
+        if self.prune_impossible:
+            search.pruned += sum(score <= 0.0 for _, score in all_candidates)
+            all_candidates = [path for path in all_candidates if path[1] > 0.0]
+        search.end_level(len(frontier))
+        if not all_candidates:
+            # Keep the previous frontier, the best paths found so far
+            search.stop_reason = (
+                "all_pruned" if self.prune_impossible else "no_thoughts"
+            )
+            return
+
+        all_candidates.sort(key=lambda x: x[1], reverse=True)
+        search.frontier = all_candidates[: self.breadth]
+        if (
+            self.stop_confidence is not None
+            and search.frontier[0][1] >= self.stop_confidence
+        ):
+            search.stop_reason = "confident"
+
+    @staticmethod
+    def _finish_search(search: SearchState) -> Tuple[List[str], Tuple[int, int]]:
+        record_details(search=search.stats())
+        best_path, _ = max(search.frontier, key=lambda x: x[1])
+        return best_path, (search.usage[0], search.usage[1])
+
+    def plan_requests(
+        self, question: str, docs: List[str], completion_tokens: int = 512
+    ) -> List[Tuple[List[Dict], int]]:
+        """List the requests of a full search, an upper bound of what `predict` sends.
+
+        Every proposal is assumed to return `k` distinct thoughts and every
+        frontier to be full, so depth `d` expands `min(breadth, k**d)` paths
+        with one proposal and `k` evaluations each (a single one with
+        `batch_scoring`), followed by the final answer. With `max_calls`, only
+        the search calls that fit the budget are listed.
+        """
+        docs_str = self.serialize_docs(docs)
+        thought = self.placeholder_output(max(completion_tokens // self.k, 1))
+        requests = []
+        for depth in range(self.max_depth):
+            thoughts = [thought] * depth
+            for _ in range(min(self.breadth, self.k**depth)):
+                requests.append(
+                    (
+                        self._propose_messages(question, docs_str, thoughts),
+                        completion_tokens,
+                    )
+                )
+                if self.batch_scoring:
+                    # One "<number>: <label>" line per candidate
+                    requests.append(
+                        (
+                            self._evaluate_batch_messages(
+                                question, docs_str, thoughts, [thought] * self.k
+                            ),
+                            4 * self.k,
+                        )
+                    )
+                    continue
+                for _ in range(self.k):
+                    # The evaluation answers with a single label
+                    requests.append(
+                        (
+                            self._evaluate_messages(
+                                question, docs_str, thoughts, thought
+                            ),
+                            2,
+                        )
+                    )
+        if self.max_calls is not None:
+            requests = requests[: self.max_calls]
+        requests.append(
+            (
+                self._final_messages(question, docs, [thought] * self.max_depth),
+                completion_tokens,
+            )
+        )
+        return requests
+
+    @staticmethod
+    def _usage_tuple(usage: Optional[object]) -> Tuple[int, int]:
+        return (
+            usage.prompt_tokens if usage else 0,
+            usage.completion_tokens if usage else 0,
+        )
+
+    def _propose_messages(
         self, question: str, docs_str: str, thoughts: List[str]
-    ) -> Tuple[List[str], Tuple[int, int]]:
-        prompt = self.propose_prompt.format(
+    ) -> List[Dict]:
+        return self.build_messages(
+            self.propose_prompt,
+            docs_str,
             question=question,
-            docs=docs_str,
             thoughts="\n".join(thoughts) if thoughts else "(none)",
             k=self.k,
         )
-        resp, usage, err = self.get_response([{"role": "user", "content": prompt}])
+
+    def _parse_thoughts(
+        self, resp: Optional[str], usage: Optional[object], err: Optional[Exception]
+    ) -> Tuple[List[str], Tuple[int, int]]:
         if err:
-            return [], (
-                usage.prompt_tokens if usage else 0,
-                usage.completion_tokens if usage else 0,
-            )
+            return [], self._usage_tuple(usage)
 
         thoughts = [line.strip() for line in resp.splitlines() if line.strip()][
             : self.k
         ]
-        return thoughts, (usage.prompt_tokens, usage.completion_tokens)
+        return thoughts, self._usage_tuple(usage)
 
-    def _evaluate_thought(
+    def _generate_thoughts(
+        self, question: str, docs_str: str, thoughts: List[str]
+    ) -> Tuple[List[str], Tuple[int, int]]:
+        messages = self._propose_messages(question, docs_str, thoughts)
+        resp, usage, err = self.get_response(messages)
+        return self._parse_thoughts(resp, usage, err)
+
+    async def _generate_thoughts_async(
+        self, question: str, docs_str: str, thoughts: List[str]
+    ) -> Tuple[List[str], Tuple[int, int]]:
+        messages = self._propose_messages(question, docs_str, thoughts)
+        resp, usage, err = await self.get_response_async(messages)
+        return self._parse_thoughts(resp, usage, err)
+
+    def _evaluate_messages(
         self, question: str, docs_str: str, thoughts: List[str], candidate: str
-    ) -> Tuple[float, Tuple[int, int]]:
-        prompt = self.evaluate_prompt.format(
+    ) -> List[Dict]:
+        return self.build_messages(
+            self.evaluate_prompt,
+            docs_str,
             question=question,
-            docs=docs_str,
             thoughts="\n".join(thoughts) if thoughts else "(none)",
             candidate=candidate,
         )
-        resp, usage, err = self.get_response([{"role": "user", "content": prompt}])
 
+    def _parse_score(
+        self, resp: Optional[str], usage: Optional[object], err: Optional[Exception]
+    ) -> Tuple[float, Tuple[int, int]]:
         if err:
-            return 0.0, (
-                usage.prompt_tokens if usage else 0,
-                usage.completion_tokens if usage else 0,
-            )
+            return 0.0, self._usage_tuple(usage)
 
         label = resp.strip().lower()
-        score_map = {"sure": 1.0, "maybe": 0.5, "impossible": 0.0}
-        score = score_map.get(label, 0.5)  # Default to maybe if unexpected response
+        score = SCORE_MAP.get(label, 0.5)  # Default to maybe if unexpected response
 
-        return score, (usage.prompt_tokens, usage.completion_tokens)
+        return score, self._usage_tuple(usage)
 
-    def _final_answer(
+    def _evaluate_thought(
+        self, question: str, docs_str: str, thoughts: List[str], candidate: str
+    ) -> Tuple[float, Tuple[int, int]]:
+        messages = self._evaluate_messages(question, docs_str, thoughts, candidate)
+        resp, usage, err = self.get_response(messages)
+        return self._parse_score(resp, usage, err)
+
+    async def _evaluate_thought_async(
+        self, question: str, docs_str: str, thoughts: List[str], candidate: str
+    ) -> Tuple[float, Tuple[int, int]]:
+        messages = self._evaluate_messages(question, docs_str, thoughts, candidate)
+        resp, usage, err = await self.get_response_async(messages)
+        return self._parse_score(resp, usage, err)
+
+    def _evaluate_batch_messages(
+        self, question: str, docs_str: str, thoughts: List[str], candidates: List[str]
+    ) -> List[Dict]:
+        return self.build_messages(
+            self.evaluate_batch_prompt,
+            docs_str,
+            question=question,
+            thoughts="\n".join(thoughts) if thoughts else "(none)",
+            candidates="\n".join(
+                f"{idx + 1}. {cand}" for idx, cand in enumerate(candidates)
+            ),
+        )
+
+    def _parse_batch_scores(
+        self,
+        num_candidates: int,
+        resp: Optional[str],
+        usage: Optional[object],
+        err: Optional[Exception],
+    ) -> Tuple[List[float], Tuple[int, int]]:
+        if err:
+            return [0.0] * num_candidates, self._usage_tuple(usage)
+
+        # Default to maybe for the candidates without a label
+        scores = [0.5] * num_candidates
+        for number, label in BATCH_SCORE_PATTERN.findall(resp):
+            if 1 <= int(number) <= num_candidates:
+                scores[int(number) - 1] = SCORE_MAP[label.lower()]
+        return scores, self._usage_tuple(usage)
+
+    def _score_candidates(
+        self, question: str, docs_str: str, task: EvaluationTask
+    ) -> Tuple[List[float], Tuple[int, int]]:
+        """Score the candidates of a task with one call, or one call per candidate."""
+        thoughts, candidates = list(task[0]), task[1]
+        if not self.batch_scoring:
+            score, usage = self._evaluate_thought(
+                question, docs_str, thoughts, candidates[0]
+            )
+            return [score], usage
+        messages = self._evaluate_batch_messages(
+            question, docs_str, thoughts, candidates
+        )
+        resp, usage, err = self.get_response(messages)
+        return self._parse_batch_scores(len(candidates), resp, usage, err)
+
+    async def _score_candidates_async(
+        self, question: str, docs_str: str, task: EvaluationTask
+    ) -> Tuple[List[float], Tuple[int, int]]:
+        """Asynchronous version of `_score_candidates`."""
+        thoughts, candidates = list(task[0]), task[1]
+        if not self.batch_scoring:
+            score, usage = await self._evaluate_thought_async(
+                question, docs_str, thoughts, candidates[0]
+            )
+            return [score], usage
+        messages = self._evaluate_batch_messages(
+            question, docs_str, thoughts, candidates
+        )
+        resp, usage, err = await self.get_response_async(messages)
+        return self._parse_batch_scores(len(candidates), resp, usage, err)
+
+    def _final_messages(
         self, question: str, docs: List[str], thoughts: List[str]
-    ) -> Tuple[str, str, Tuple[int, int]]:
-        docs_str = self.serialize_docs(docs)
-        prompt = self.final_prompt.format(
+    ) -> List[Dict]:
+        return self.build_messages(
+            self.final_prompt,
+            self.serialize_docs(docs),
             question=question,
-            docs=docs_str,
             thoughts="\n".join(thoughts),
         )
-        resp, usage, err = self.get_response([{"role": "user", "content": prompt}])
+
+    def _parse_final_answer(
+        self,
+        prompt: str,
+        resp: Optional[str],
+        usage: Optional[object],
+        err: Optional[Exception],
+    ) -> Tuple[str, str, Tuple[int, int]]:
         if err:
-            return "", (
-                usage.prompt_tokens if usage else 0,
-                usage.completion_tokens if usage else 0,
-            )
+            raise PredictionError.from_error(err)
+
+        return self.parse_answer(resp), prompt, self._usage_tuple(usage)
+
+    @staticmethod
+    def parse_answer(output: str) -> str:
+        """The final answer is the whole output."""
+        return output.strip()
 
-        return resp.strip(), prompt, (usage.prompt_tokens, usage.completion_tokens)
+    @staticmethod
+    def replace_answer(output: str, answer: str) -> str:
+        return answer
+
+    def _final_answer(
+        self, question: str, docs: List[str], thoughts: List[str]
+    ) -> Tuple[str, str, Tuple[int, int]]:
+        messages = self._final_messages(question, docs, thoughts)
+        resp, usage, err = self.get_answer_response(messages)
+        prompt = self.render_prompt(messages)
+        return self._parse_final_answer(prompt, resp, usage, err)
+
+    async def _final_answer_async(
+        self, question: str, docs: List[str], thoughts: List[str]
+    ) -> Tuple[str, str, Tuple[int, int]]:
+        messages = self._final_messages(question, docs, thoughts)
+        resp, usage, err = await self.get_answer_response_async(messages)
+        prompt = self.render_prompt(messages)
+        return self._parse_final_answer(prompt, resp, usage, err)
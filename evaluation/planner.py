@@ -0,0 +1,362 @@
+from collections import defaultdict
+import sys
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from datasets import DatasetDict
+from tqdm.auto import tqdm
+
+from .crest import build_judge_messages
+from .documents import DocumentStore, load_documents
+from .judge import JSON_JUDGE_MAX_TOKENS, build_batched_judge_messages
+from .method.baseline import BaselineMethod
+from .prejudge import prejudge as prejudge_answer
+
+# Context windows in tokens, matched by the longest model name prefix
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16_385,
+    "gpt-4": 8_192,
+    "gpt-4-turbo": 128_000,
+    "gpt-4o": 128_000,
+    "gpt-4.1": 1_047_576,
+    "gpt-5": 400_000,
+    "o1": 200_000,
+    "o3": 200_000,
+    "o4-mini": 200_000,
+}
+
+# USD per million (input, output) tokens, matched by the longest model name prefix
+MODEL_PRICING = {
+    "gpt-3.5-turbo": (0.5, 1.5),
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-4.1": (2.0, 8.0),
+    "gpt-4.1-mini": (0.4, 1.6),
+    "gpt-4.1-nano": (0.1, 0.4),
+    "o1": (15.0, 60.0),
+    "o3": (2.0, 8.0),
+    "o3-mini": (1.1, 4.4),
+    "o4-mini": (1.1, 4.4),
+}
+
+# Tokens added by the chat format around every message and before the reply
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+# Expected tokens of a judge reply: justification, decision and error type
+JUDGE_COMPLETION_TOKENS = 128
+# Examples listed when reporting context-window overflows
+MAX_LISTED_EXAMPLES = 20
+
+
+def _lookup(table: dict, model_name: str):
+    model_name = model_name.split("/")[-1]
+    matches = [name for name in table if model_name.startswith(name)]
+    return table[max(matches, key=len)] if matches else None
+
+
+def get_context_window(model_name: str) -> Optional[int]:
+    return _lookup(MODEL_CONTEXT_WINDOWS, model_name)
+
+
+def get_pricing(model_name: str) -> Optional[Tuple[float, float]]:
+    return _lookup(MODEL_PRICING, model_name)
+
+
+class TokenCounter:
+    """Counts the prompt tokens of chat messages without calling the API.
+
+    Uses the `tiktoken` encoding of the model when it is installed and cached
+    locally, the local Hugging Face tokenizer of `tokenizer_path` if given, and
+    falls back to about 4 characters per token otherwise.
+
+    Args:
+        model_name (str): The model name.
+        tokenizer_path (Optional[str], optional): A local Hugging Face tokenizer. Defaults to None.
+    """
+
+    def __init__(self, model_name: str, tokenizer_path: Optional[str] = None):
+        self.model_name = model_name
+        self.name = "heuristic (4 characters per token)"
+        self._encode: Callable[[str], int] = lambda text: len(text) // 4
+        if tokenizer_path is not None:
+            self._load_transformers(tokenizer_path)
+        else:
+            self._load_tiktoken()
+
+    def _load_tiktoken(self) -> None:
+        try:
+            import tiktoken
+
+            try:
+                encoding = tiktoken.encoding_for_model(self.model_name)
+            except KeyError:
+                encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            # Encodings are downloaded once and cached (see TIKTOKEN_CACHE_DIR)
+            print(
+                f"[!] tiktoken encoding unavailable ({type(e).__name__})."
+                " Token counts are approximate.",
+                file=sys.stderr,
+            )
+            return
+        self.name = f"tiktoken/{encoding.name}"
+        self._encode = lambda text: len(encoding.encode(text, disallowed_special=()))
+
+    def _load_transformers(self, tokenizer_path: str) -> None:
+        try:
+            from transformers import AutoTokenizer
+
+            tokenizer = AutoTokenizer.from_pretrained(
+                tokenizer_path, local_files_only=True
+            )
+        except Exception as e:
+            print(
+                f"[!] Could not load the tokenizer of {tokenizer_path} ({e})."
+                " Token counts are approximate.",
+                file=sys.stderr,
+            )
+            return
+        self.name = f"transformers/{tokenizer_path}"
+        self._encode = lambda text: len(
+            tokenizer.encode(text, add_special_tokens=False)
+        )
+
+    def count(self, text: str) -> int:
+        return self._encode(text)
+
+    def count_messages(self, messages: Iterable[Dict[str, str]]) -> int:
+        return (
+            sum(
+                self.count(message["content"]) + TOKENS_PER_MESSAGE
+                for message in messages
+            )
+            + TOKENS_PER_REPLY
+        )
+
+
+def estimate_wall_time(
+    num_requests: int,
+    num_tokens: int,
+    rpm: Optional[float] = None,
+    tpm: Optional[float] = None,
+) -> Optional[float]:
+    """Estimate the seconds needed to send the requests under the rate limits.
+
+    Args:
+        num_requests (int): The number of requests.
+        num_tokens (int): The total tokens of the requests.
+        rpm (Optional[float], optional): Requests per minute. Defaults to None.
+        tpm (Optional[float], optional): Tokens per minute. Defaults to None.
+    Returns:
+        Optional[float]: The estimated seconds, or None without any rate limit.
+    """
+    minutes = []
+    if rpm:
+        minutes.append(num_requests / rpm)
+    if tpm:
+        minutes.append(num_tokens / tpm)
+    return max(minutes) * 60 if minutes else None
+
+
+def _new_totals() -> Dict[str, int]:
+    return {
+        "examples": 0,
+        "requests": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "max_request_tokens": 0,
+        "over_context": 0,
+    }
+
+
+def plan_predictions(
+    dataset: DatasetDict,
+    method: BaselineMethod,
+    counter: TokenCounter,
+    completion_tokens: int = 512,
+    context_window: Optional[int] = None,
+    store: Optional[DocumentStore] = None,
+) -> Tuple[Dict[Tuple[str, str, str], Dict[str, int]], List[dict]]:
+    """Count the tokens of every request `method` would send for the dataset.
+
+    Args:
+        dataset (DatasetDict): The dataset splits to plan.
+        method (BaselineMethod): The answer generation method.
+        counter (TokenCounter): The token counter.
+        completion_tokens (int, optional): The expected tokens of an answer. Defaults to 512.
+        context_window (Optional[int], optional): The context window of the model. Defaults to None.
+        store (Optional[DocumentStore], optional): The store of the interned documents. Defaults to None.
+    Returns:
+        Tuple[Dict[Tuple[str, str, str], Dict[str, int]], List[dict]]:
+            The totals per (split, language, difficulty) and the examples exceeding the context window.
+    """
+    totals = defaultdict(_new_totals)
+    over_context = []
+    for split, examples in dataset.items():
+        for example in tqdm(examples, desc=f"Planning {split} split"):
+            meta = example["meta"]
+            group = totals[(split, meta["language"], meta["difficulty_type"])]
+            group["examples"] += 1
+
+            max_request_tokens = 0
+            requests = method.plan_requests(
+                example["query"], load_documents(example, store), completion_tokens
+            )
+            for position, (messages, expected_tokens) in enumerate(requests):
+                prompt_tokens = counter.count_messages(messages)
+                # The last request is the answer call, sampled `n` times at once
+                samples = method.n if position == len(requests) - 1 else 1
+                group["requests"] += 1
+                group["prompt_tokens"] += prompt_tokens
+                group["completion_tokens"] += expected_tokens * samples
+                max_request_tokens = max(
+                    max_request_tokens, prompt_tokens + expected_tokens
+                )
+            group["max_request_tokens"] = max(
+                group["max_request_tokens"], max_request_tokens
+            )
+            if context_window is not None and max_request_tokens > context_window:
+                group["over_context"] += 1
+                over_context.append(
+                    {"split": split, "id": example["id"], "tokens": max_request_tokens}
+                )
+    return dict(totals), over_context
+
+
+def plan_judge(
+    dataset: DatasetDict,
+    counter: TokenCounter,
+    completion_tokens: int = 512,
+    group_size: int = 1,
+    prejudge: bool = True,
+    judge_format: str = "text",
+    judge_max_tokens: Optional[int] = None,
+) -> Dict[str, int]:
+    """Count the tokens of the non-refusal judge requests.
+
+    Examples with a predicted answer that the pre-judge decides are not
+    counted; without predictions every example is assumed to need the judge.
+
+    Args:
+        dataset (DatasetDict): The dataset splits to plan.
+        counter (TokenCounter): The token counter of the judge model.
+        completion_tokens (int, optional): The expected tokens of a predicted answer. Defaults to 512.
+        group_size (int, optional): The examples graded per judge call. Defaults to 1.
+        prejudge (bool, optional): Skip the examples decided by the pre-judge. Defaults to True.
+        judge_format (str, optional): One of `evaluation.crest.JUDGE_FORMATS`. Defaults to "text".
+        judge_max_tokens (Optional[int], optional): The completion token cap of the JSON formats.
+            Defaults to `evaluation.judge.JSON_JUDGE_MAX_TOKENS`.
+    Returns:
+        Dict[str, int]: The totals of the judge requests.
+    """
+    totals = _new_totals()
+    predicted_answer = BaselineMethod.placeholder_output(completion_tokens)
+    examples = [
+        {
+            **example,
+            "predicted_answer": example.get("predicted_answer") or predicted_answer,
+        }
+        for example in dataset["non_refusal"]
+        if not (
+            prejudge
+            and example.get("predicted_answer") is not None
+            and prejudge_answer(example["answer"], example["predicted_answer"])
+        )
+    ]
+    for start in range(0, len(examples), max(group_size, 1)):
+        group = examples[start : start + max(group_size, 1)]
+        if len(group) == 1:
+            messages = build_judge_messages(group[0], judge_format)
+        else:
+            messages = build_batched_judge_messages(group)
+        prompt_tokens = counter.count_messages(messages)
+        if judge_format == "text":
+            expected_tokens = JUDGE_COMPLETION_TOKENS * len(group)
+        else:
+            # The cap bounds the reply; parse retries are not counted
+            expected_tokens = judge_max_tokens or JSON_JUDGE_MAX_TOKENS[judge_format]
+        totals["examples"] += len(group)
+        totals["requests"] += 1
+        totals["prompt_tokens"] += prompt_tokens
+        totals["completion_tokens"] += expected_tokens
+        totals["max_request_tokens"] = max(
+            totals["max_request_tokens"], prompt_tokens + expected_tokens
+        )
+    return totals
+
+
+def _format_cost(model_name: str, totals: Dict[str, int], pricing) -> str:
+    pricing = pricing or get_pricing(model_name)
+    if pricing is None:
+        return "n/a (unknown pricing)"
+    cost = (
+        totals["prompt_tokens"] * pricing[0] + totals["completion_tokens"] * pricing[1]
+    ) / 1_000_000
+    return f"${cost:,.2f}"
+
+
+def _format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "n/a (set the rate limits)"
+    hours, rest = divmod(int(seconds), 3600)
+    return f"{hours}h {rest // 60:02d}m {rest % 60:02d}s"
+
+
+def print_plan(
+    model_name: str,
+    totals: Dict[Tuple[str, str, str], Dict[str, int]],
+    over_context: List[dict],
+    context_window: Optional[int] = None,
+    pricing: Optional[Tuple[float, float]] = None,
+    rpm: Optional[float] = None,
+    tpm: Optional[float] = None,
+) -> None:
+    """Print the planned requests, tokens, cost and wall time per split, language and difficulty."""
+    header = (
+        f"{'split':<12}{'lang':<6}{'difficulty':<12}{'examples':>9}{'requests':>10}"
+        f"{'prompt tok':>13}{'compl. tok':>12}{'max req':>10}{'> ctx':>7}  cost"
+    )
+    print(header)
+    grand = _new_totals()
+    for (split, language, difficulty), group in sorted(totals.items()):
+        print(
+            f"{split:<12}{language:<6}{difficulty:<12}{group['examples']:>9}"
+            f"{group['requests']:>10}{group['prompt_tokens']:>13,}"
+            f"{group['completion_tokens']:>12,}{group['max_request_tokens']:>10,}"
+            f"{group['over_context']:>7}  {_format_cost(model_name, group, pricing)}"
+        )
+        for key, value in group.items():
+            grand[key] = (
+                max(grand[key], value)
+                if key == "max_request_tokens"
+                else grand[key] + value
+            )
+    print(
+        f"{'total':<30}{grand['examples']:>9}{grand['requests']:>10}"
+        f"{grand['prompt_tokens']:>13,}{grand['completion_tokens']:>12,}"
+        f"{grand['max_request_tokens']:>10,}{grand['over_context']:>7}"
+        f"  {_format_cost(model_name, grand, pricing)}"
+    )
+
+    wall_time = estimate_wall_time(
+        grand["requests"], grand["prompt_tokens"] + grand["completion_tokens"], rpm, tpm
+    )
+    print(f"[+] Estimated wall time for {model_name}: {_format_duration(wall_time)}")
+    if context_window is None:
+        print(f"[!] Unknown context window of {model_name}. Set --context-window")
+    elif over_context:
+        print(
+            f"[!] {len(over_context)} examples exceed the {context_window:,}-token"
+            f" context window of {model_name}:",
+            file=sys.stderr,
+        )
+        for example in over_context[:MAX_LISTED_EXAMPLES]:
+            print(
+                f"    {example['split']} id={example['id']}: {example['tokens']:,} tokens",
+                file=sys.stderr,
+            )
+        if len(over_context) > MAX_LISTED_EXAMPLES:
+            print(
+                f"    ... and {len(over_context) - MAX_LISTED_EXAMPLES} more",
+                file=sys.stderr,
+            )
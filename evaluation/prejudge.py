@@ -0,0 +1,282 @@
+import re
+from typing import List, Optional, Tuple
+import unicodedata
+
+from .scoring import CITATION_PATTERN
+from .utils import normalize_answer
+
+# Paths that decide a non-refusal example without the judge model, recorded in
+# `evaluation_result.judged_by`. "llm" is the judge itself.
+PREJUDGE_PATHS = ("empty", "refusal", "exact", "numeric", "date")
+
+# Relative tolerance of a numeric match, for float formatting only
+NUMERIC_TOLERANCE = 1e-6
+
+HANGUL_PATTERN = re.compile(r"[가-힣]")
+# Sentence endings of a short Korean answer, e.g. "42명입니다"
+KOREAN_ENDINGS = re.compile(r"(입니다|이에요|예요|에요|이다|임|요)$")
+
+NUMBER_PATTERN = re.compile(
+    r"(?<![\w.])([-+]?\d{1,3}(?:,\d{3})+(?:\.\d+)?|[-+]?\d+(?:\.\d+)?)"
+    r"\s*(thousand|million|billion|trillion|천|만|억|조)?"
+)
+SCALES = {
+    "thousand": 1e3,
+    "million": 1e6,
+    "billion": 1e9,
+    "trillion": 1e12,
+    "천": 1e3,
+    "만": 1e4,
+    "억": 1e8,
+    "조": 1e12,
+}
+# Units a number may carry, by their canonical name. A golden answer with any
+# other text around its number is left to the judge.
+UNITS = {
+    "%": "%",
+    "percent": "%",
+    "퍼센트": "%",
+    "$": "usd",
+    "usd": "usd",
+    "dollar": "usd",
+    "dollars": "usd",
+    "달러": "usd",
+    "원": "krw",
+    "won": "krw",
+    "krw": "krw",
+    "명": "people",
+    "people": "people",
+    "person": "people",
+    "persons": "people",
+    "개": "items",
+    "건": "cases",
+    "세": "age",
+    "살": "age",
+    "배": "times",
+    "회": "times",
+    "times": "times",
+    "년": "years",
+    "year": "years",
+    "years": "years",
+    "시간": "hours",
+    "hours": "hours",
+    "분": "minutes",
+    "minutes": "minutes",
+    "초": "seconds",
+    "seconds": "seconds",
+    "km": "km",
+    "m": "m",
+    "cm": "cm",
+    "mm": "mm",
+    "kg": "kg",
+    "g": "g",
+}
+UNIT_PATTERN = re.compile(r"\s*(\$|%|[가-힣]+|[a-z]+)", re.IGNORECASE)
+# Negations and qualifiers that change what a number or date in the answer
+# claims ("not 42", "about 42", "42 이상"). An answer using any the golden
+# answer does not is left to the judge.
+QUALIFIER_PATTERN = re.compile(
+    r"\b(?:not|no|never|none|neither|nor|except|excluding|approximately|approx|about"
+    r"|around|roughly|nearly|almost|over|under|above|below|least|most|more|less"
+    r"|fewer|greater|up to|estimated|between)\b|n't|[~<>≈≤≥±]"
+    r"|아니|않|없|못|약|대략|정도|쯤|가량|이상|이하|미만|초과|넘|제외|외에|빼고|사이",
+    re.IGNORECASE,
+)
+
+MONTHS = {
+    name: number
+    for number, names in enumerate(
+        [
+            ("january", "jan"),
+            ("february", "feb"),
+            ("march", "mar"),
+            ("april", "apr"),
+            ("may",),
+            ("june", "jun"),
+            ("july", "jul"),
+            ("august", "aug"),
+            ("september", "sep", "sept"),
+            ("october", "oct"),
+            ("november", "nov"),
+            ("december", "dec"),
+        ],
+        start=1,
+    )
+    for name in names
+}
+_MONTH_NAMES = "|".join(sorted(MONTHS, key=len, reverse=True))
+DATE_PATTERNS = [
+    # 2023-05-01, 2023.5.1, 2023/05/01, 2023년 5월 1일
+    (
+        re.compile(
+            r"(\d{4})\s*(?:[-./]|년)\s*(\d{1,2})\s*(?:[-./]|월)\s*(\d{1,2})\s*일?"
+        ),
+        ("y", "m", "d"),
+    ),
+    # May 1, 2023 / May 1st 2023
+    (
+        re.compile(
+            rf"\b({_MONTH_NAMES})\.?\s+(\d{{1,2}})(?:st|nd|rd|th)?,?\s+(\d{{4}})",
+            re.IGNORECASE,
+        ),
+        ("m", "d", "y"),
+    ),
+    # 1 May 2023
+    (
+        re.compile(
+            rf"\b(\d{{1,2}})(?:st|nd|rd|th)?\s+({_MONTH_NAMES})\.?,?\s+(\d{{4}})",
+            re.IGNORECASE,
+        ),
+        ("d", "m", "y"),
+    ),
+]
+
+# The decision of a pre-judge path: score, error type and path
+PrejudgeDecision = Tuple[float, str, str]
+
+
+def normalize_korean_aware(text: str) -> str:
+    """`normalize_answer` that also folds Unicode forms, and for Korean text the
+    spacing and the sentence endings of short answers."""
+    text = normalize_answer(unicodedata.normalize("NFKC", text))
+    if HANGUL_PATTERN.search(text):
+        text = KOREAN_ENDINGS.sub("", text.replace(" ", ""))
+    return text
+
+
+# Characters `normalize_answer` drops that still tell answers apart, e.g. in
+# "AA+" and "AA-", "C++" and "C" or "C#"; sentence punctuation is left out.
+SYMBOL_PATTERN = re.compile(r"[^\w\s.,!?;:'\"“”‘’()\[\]]")
+
+
+def _fold(text: str) -> str:
+    """NFKC, with the Unicode minus sign written as "-"."""
+    return unicodedata.normalize("NFKC", text).replace("\u2212", "-")
+
+
+def number_tokens(text: str) -> List[str]:
+    """The numbers of a text as written, with their sign, separators and scale word."""
+    return [
+        match.group(0).replace(" ", "")
+        for match in NUMBER_PATTERN.finditer(_fold(text))
+    ]
+
+
+def symbols(text: str) -> List[str]:
+    """The `SYMBOL_PATTERN` characters of a text, in order."""
+    return SYMBOL_PATTERN.findall(_fold(text))
+
+
+def qualifiers(text: str) -> set:
+    """The negations and qualifiers of `QUALIFIER_PATTERN` used in a text."""
+    return {match.lower() for match in QUALIFIER_PATTERN.findall(_fold(text))}
+
+
+def _unit(text: str) -> str:
+    """The unit at the start of a text: canonical if known, else the raw word."""
+    match = UNIT_PATTERN.match(text)
+    if match is None:
+        return ""
+    word = KOREAN_ENDINGS.sub("", match.group(1).lower()) or match.group(1)
+    return UNITS.get(word, word)
+
+
+def extract_numbers(text: str) -> List[Tuple[float, str]]:
+    """The numbers of a text with their scale applied, and the unit of each one.
+
+    A "$" right before a number is its unit; otherwise the word after it is.
+    """
+    numbers = []
+    for match in NUMBER_PATTERN.finditer(text):
+        value = float(match.group(1).replace(",", ""))
+        value *= SCALES.get((match.group(2) or "").lower(), 1.0)
+        unit = "usd" if text[: match.start()].rstrip().endswith("$") else ""
+        numbers.append((value, unit or _unit(text[match.end() :])))
+    return numbers
+
+
+def _numeric_golden(golden: str) -> Optional[Tuple[float, str]]:
+    """The value and unit of a golden answer that is a number with an optional known unit."""
+    text = _fold(golden).strip().rstrip(".")
+    match = NUMBER_PATTERN.search(text) if len(extract_numbers(text)) == 1 else None
+    if match is None:
+        return None
+    prefix = text[: match.start()].strip()
+    suffix = text[match.end() :].strip().lower()
+    if prefix not in ("", "$") or (suffix and suffix not in UNITS):
+        return None
+    return extract_numbers(text)[0]
+
+
+def extract_dates(text: str) -> List[Tuple[int, int, int]]:
+    """The distinct (year, month, day) dates written in a text."""
+    dates = []
+    for pattern, order in DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            fields = dict(zip(order, match.groups()))
+            month = fields["m"]
+            month = int(month) if month.isdigit() else MONTHS[month.lower()]
+            date = (int(fields["y"]), month, int(fields["d"]))
+            if 1 <= date[1] <= 12 and 1 <= date[2] <= 31 and date not in dates:
+                dates.append(date)
+    return dates
+
+
+def is_refusal(answer: str) -> bool:
+    return "unanswerable" in answer.lower()
+
+
+def prejudge(golden: str, predicted: str) -> Optional[PrejudgeDecision]:
+    """Decide a non-refusal example locally when the outcome is unambiguous.
+
+    Only clear cases are settled: an empty answer or a refusal of an
+    answerable question is Wrong; an answer stating only the golden number
+    (without another unit) or date, or equal to the golden answer after
+    normalization with the same numbers and symbols written the same way,
+    is Correct. Negated or qualified
+    answers and everything else are left to the judge model.
+
+    Args:
+        golden (str): The golden answer.
+        predicted (str): The predicted answer.
+    Returns:
+        Optional[PrejudgeDecision]: The score, error type and path, or None for the judge.
+    """
+    answer = CITATION_PATTERN.sub(" ", predicted).strip()
+    if not answer:
+        return 0.0, "", "empty"
+    if is_refusal(answer):
+        return 0.0, "AnswerRefusal", "refusal"
+    golden = golden or ""
+    if qualifiers(answer) != qualifiers(golden):
+        return None
+
+    numeric_golden = _numeric_golden(golden)
+    if numeric_golden is not None:
+        golden_value, golden_unit = numeric_golden
+        numbers = set(extract_numbers(_fold(answer)))
+        if len({value for value, _ in numbers}) != 1:
+            return None
+        value, unit = numbers.pop()
+        # A bare number may omit the golden unit, but not add one ("42 months",
+        # "3rd") or change it
+        if unit and unit != golden_unit:
+            return None
+        if abs(value - golden_value) <= NUMERIC_TOLERANCE * max(abs(golden_value), 1):
+            return 2.0, "", "numeric"
+        return None
+
+    # The normalization drops signs, separators, symbols and Korean spacing,
+    # which must not merge "-5" into "5", "3.5억" into "35억" or "AA+" into "AA-"
+    if (
+        golden
+        and normalize_korean_aware(answer) == normalize_korean_aware(golden)
+        and number_tokens(answer) == number_tokens(golden)
+        and symbols(answer) == symbols(golden)
+    ):
+        return 2.0, "", "exact"
+
+    golden_dates = extract_dates(golden)
+    if len(golden_dates) == 1 and extract_dates(answer) == golden_dates:
+        return 2.0, "", "date"
+    return None
@@ -120,6 +120,20 @@ Return thinking steps between <Thinking> and </Thinking> and the answer between
 </Documents>
 """
 
+# Stable prefix of the `prefix_cache` prompt layout: every call made for the same
+# documents starts with this exact message, so providers can reuse its cached prefix.
+DOCUMENT_PREFIX_PROMPT = """The following documents are the only source of information for this conversation. Refer to them by their numbers, e.g. [1], [2].
+
+<Documents>
+{docs}
+</Documents>
+"""
+
+# Replaces `{docs}` in the method prompts when the documents are in the prefix
+DOCUMENT_PREFIX_REFERENCE = (
+    "(The documents are provided at the beginning of the conversation.)"
+)
+
 NON_REFUSAL_EVALUATION_PROMPT = """You are an evaluator for a Retrieval Question Answering (QA) task. Your task is to assess how closely the predicted answer matches the golden answer.
 
 **Evaluation Categories:**
@@ -154,3 +168,83 @@ NON_REFUSAL_EVALUATION_PROMPT = """You are an evaluator for a Retrieval Question
 **ErrorType**: <AnswerRefusal/NumericMistakes/MissingDetail/Others>  // Keep empty if the evaluation is **Correct**
 ```
 """
+
+JSON_NON_REFUSAL_EVALUATION_PROMPT = """You are an evaluator for a Retrieval Question Answering (QA) task. Your task is to assess how closely the predicted answer matches the golden answer.
+
+**Evaluation Categories:**
+- **Correct**: The predicted answer is a perfect match or semantically identical to the golden answer.
+- **Partially Correct**: The predicted answer contains some key information from the golden answer but may be incomplete, missing details, or only partially aligned.
+- **Wrong**: The predicted answer is completely incorrect, missing essential details, or contains misleading information.
+
+**Consider the following factors when evaluating:**
+- **Exactness**: Does the predicted answer exactly match the golden answer?
+- **Paraphrasing**: If reworded, does it retain the same meaning?
+- **Completeness**: Is the full answer provided, or is it partial?
+- **Incorrect Information**: Does the predicted answer introduce any false or misleading details?
+
+**Error Category Guidelines:**
+*If the evaluation is not **Correct** (i.e., it is either "Partially Correct" or "Wrong"), also identify the most severe error type present by providing an **ErrorType** field. This field should contain one of the following categories that best describes the main error:*
+
+- **AnswerRefusal**: The answer refuses to provide a response or gives up on answering, despite a clear expectation to do so.
+- **NumericMistakes**: The answer contains incorrect arithmetic or inaccurate numeric references (e.g., population sizes, years, differences in ages, championship tallies).
+- **MissingDetail**: The answer shows a partial understanding by identifying the correct domain or background but omitting the necessary numeric or textual detail.
+- **Others**: Any other error types not covered by the above categories.
+
+**Input:**
+- **Question**: {question}
+- **Golden Answer**: {golden_answer}
+- **Predicted Answer**: {predicted_answer}
+
+**Respond with a JSON object only, with these keys:**
+{keys}
+"""
+
+JSON_NON_REFUSAL_EVALUATION_KEYS = """- "decision": "Correct", "Partially Correct" or "Wrong"
+- "error_type": "AnswerRefusal", "NumericMistakes", "MissingDetail" or "Others"; "" if the decision is "Correct"
+"""
+
+# Asks for the justification first, so the decision follows the reasoning
+JSON_NON_REFUSAL_EVALUATION_JUSTIFIED_KEYS = (
+    """- "justification": one brief sentence explaining your evaluation
+""" + JSON_NON_REFUSAL_EVALUATION_KEYS
+)
+
+BATCHED_NON_REFUSAL_EVALUATION_PROMPT = """You are an evaluator for a Retrieval Question Answering (QA) task. Your task is to assess, for each numbered item, how closely the predicted answer matches the golden answer. Evaluate every item independently.
+
+**Evaluation Categories:**
+- **Correct**: The predicted answer is a perfect match or semantically identical to the golden answer.
+- **Partially Correct**: The predicted answer contains some key information from the golden answer but may be incomplete, missing details, or only partially aligned.
+- **Wrong**: The predicted answer is completely incorrect, missing essential details, or contains misleading information.
+
+**Consider the following factors when evaluating:**
+- **Exactness**: Does the predicted answer exactly match the golden answer?
+- **Paraphrasing**: If reworded, does it retain the same meaning?
+- **Completeness**: Is the full answer provided, or is it partial?
+- **Incorrect Information**: Does the predicted answer introduce any false or misleading details?
+
+**Error Category Guidelines:**
+*If the evaluation is not **Correct** (i.e., it is either "Partially Correct" or "Wrong"), also identify the most severe error type present by providing an **ErrorType** field. This field should contain one of the following categories that best describes the main error:*
+
+- **AnswerRefusal**: The answer refuses to provide a response or gives up on answering, despite a clear expectation to do so.
+- **NumericMistakes**: The answer contains incorrect arithmetic or inaccurate numeric references (e.g., population sizes, years, differences in ages, championship tallies).
+- **MissingDetail**: The answer shows a partial understanding by identifying the correct domain or background but omitting the necessary numeric or textual detail.
+- **Others**: Any other error types not covered by the above categories.
+
+**Input:**
+{items}
+
+**Your response should contain one block per item, in the same order, formatted as follows:**
+
+```plaintext
+**Item**: <item number>
+**Justification**: <brief explanation of your evaluation>
+**Decision**: <Correct/Partially Correct/Wrong>
+**ErrorType**: <AnswerRefusal/NumericMistakes/MissingDetail/Others>  // Keep empty if the evaluation is **Correct**
+```
+"""
+
+BATCHED_NON_REFUSAL_EVALUATION_ITEM = """**Item {item_id}**
+- **Question**: {question}
+- **Golden Answer**: {golden_answer}
+- **Predicted Answer**: {predicted_answer}
+"""
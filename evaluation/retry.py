@@ -0,0 +1,126 @@
+import random
+from typing import Optional
+
+import openai
+
+# Retry policy shared by every completion call made in this process
+RETRY_CONFIG = {
+    "max_retries": 5,
+    "base_delay": 1.0,
+    "max_delay": 60.0,
+}
+
+ERROR_CATEGORIES = [
+    "rate_limit",
+    "timeout",
+    "connection",
+    "server",
+    "context_length",
+    "content_filter",
+    "bad_request",
+    "authentication",
+    "unknown",
+]
+
+# Transient failures that are worth another attempt
+RETRYABLE_CATEGORIES = {"rate_limit", "timeout", "connection", "server"}
+
+
+class PredictionError(Exception):
+    """Raised by a method when no answer could be generated for an example.
+
+    Args:
+        message (str): The error message.
+        category (str): One of `ERROR_CATEGORIES`.
+    """
+
+    def __init__(self, message: str, category: str = "unknown"):
+        super().__init__(message)
+        self.category = category
+
+    @classmethod
+    def from_error(cls, error: Optional[Exception]) -> "PredictionError":
+        if isinstance(error, PredictionError):
+            return error
+        return cls(str(error), classify_error(error))
+
+
+def configure_retries(**kwargs) -> None:
+    """Update the retry policy.
+
+    Args:
+        max_retries (int): The number of retries after the first attempt.
+        base_delay (float): The backoff base in seconds.
+        max_delay (float): The upper bound of a single backoff in seconds.
+    """
+    unknown = set(kwargs) - set(RETRY_CONFIG)
+    if unknown:
+        raise ValueError(f"Unknown retry options: {sorted(unknown)}")
+    RETRY_CONFIG.update(kwargs)
+
+
+def classify_error(error: Optional[Exception]) -> str:
+    """Map an exception raised by a completion call to one of `ERROR_CATEGORIES`.
+
+    Args:
+        error (Optional[Exception]): The exception.
+    Returns:
+        str: The error category.
+    """
+    if isinstance(error, PredictionError):
+        return error.category
+    if isinstance(error, openai.RateLimitError):
+        # Exhausted credit is reported as 429 as well but never recovers
+        if "insufficient_quota" in str(error):
+            return "authentication"
+        return "rate_limit"
+    if isinstance(error, openai.APITimeoutError):
+        return "timeout"
+    if isinstance(error, openai.APIConnectionError):
+        return "connection"
+    if isinstance(error, openai.InternalServerError):
+        return "server"
+    if isinstance(error, (openai.AuthenticationError, openai.PermissionDeniedError)):
+        return "authentication"
+    if isinstance(error, openai.BadRequestError):
+        message = str(error)
+        if "context_length_exceeded" in message or "maximum context length" in message:
+            return "context_length"
+        if "content_filter" in message or "content_policy" in message:
+            return "content_filter"
+        return "bad_request"
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code == 408:
+            return "timeout"
+        if error.status_code >= 500:
+            return "server"
+        return "bad_request"
+    return "unknown"
+
+
+def is_retryable(error: Optional[Exception]) -> bool:
+    return classify_error(error) in RETRYABLE_CATEGORIES
+
+
+def backoff_delay(attempt: int, error: Optional[Exception] = None) -> float:
+    """Return the jittered exponential backoff before retry number `attempt`.
+
+    Uses "full jitter": a uniform draw between 0 and the exponential bound, so
+    that many workers failing together do not retry in lockstep. A provider
+    `retry-after` header is honoured as a lower bound.
+
+    Args:
+        attempt (int): The zero-based retry number.
+        error (Optional[Exception], optional): The error that triggered the retry. Defaults to None.
+    Returns:
+        float: The delay in seconds.
+    """
+    bound = min(RETRY_CONFIG["max_delay"], RETRY_CONFIG["base_delay"] * 2**attempt)
+    delay = random.uniform(0, bound)
+    if isinstance(error, openai.APIStatusError):
+        retry_after = error.response.headers.get("retry-after")
+        try:
+            delay = max(delay, float(retry_after))
+        except (TypeError, ValueError):
+            pass
+    return delay
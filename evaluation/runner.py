@@ -0,0 +1,340 @@
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from datasets import Dataset, Features
+from tqdm.auto import tqdm
+
+from .batch import BatchCollector
+
+
+async def _gather_bounded(
+    examples: List[dict],
+    function: Callable[[dict], Awaitable[dict]],
+    max_concurrency: int,
+    desc: Optional[str] = None,
+) -> List[dict]:
+    """Run `function` over all examples with at most `max_concurrency` in flight.
+
+    Args:
+        examples (List[dict]): The examples to process.
+        function (Callable[[dict], Awaitable[dict]]): The coroutine function to apply.
+        max_concurrency (int): The maximum number of examples processed at once.
+        desc (Optional[str], optional): The progress bar description. Defaults to None.
+    Returns:
+        List[dict]: The processed examples in the input order.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    results: List[Optional[dict]] = [None] * len(examples)
+
+    with tqdm(total=len(examples), desc=desc) as progress:
+
+        async def worker(idx: int, example: dict) -> None:
+            async with semaphore:
+                results[idx] = await function(example)
+            progress.update(1)
+
+        await asyncio.gather(
+            *(worker(idx, example) for idx, example in enumerate(examples))
+        )
+    return results
+
+
+def _groups(examples: List[dict], group_size: Optional[int]) -> List:
+    if group_size is None:
+        return examples
+    return [
+        examples[start : start + group_size]
+        for start in range(0, len(examples), group_size)
+    ]
+
+
+def _ungroup(results: List, group_size: Optional[int]) -> List[dict]:
+    if group_size is None:
+        return results
+    return [result for group in results for result in group]
+
+
+def _merge_results(
+    dataset: Dataset, results: List[dict], features: Optional[Features] = None
+) -> Dataset:
+    return dataset.map(
+        lambda _, idx: results[idx],
+        with_indices=True,
+        keep_in_memory=True,
+        features=features,
+    )
+
+
+def async_map(
+    dataset: Dataset,
+    function: Callable[[dict], Awaitable[dict]],
+    max_concurrency: int = 256,
+    desc: Optional[str] = None,
+    features: Optional[Features] = None,
+    group_size: Optional[int] = None,
+) -> Dataset:
+    """Apply a coroutine function to every example from a single event loop.
+
+    This is the asyncio counterpart of `Dataset.map(num_proc=...)`: instead of
+    forking processes that block on network I/O, all requests are kept in
+    flight concurrently from one process.
+
+    Args:
+        dataset (Dataset): The dataset to map over.
+        function (Callable[[dict], Awaitable[dict]]): The coroutine function to apply.
+        max_concurrency (int, optional): The maximum number of examples processed at once. Defaults to 256.
+        desc (Optional[str], optional): The progress bar description. Defaults to None.
+        features (Optional[Features], optional): The features of the mapped dataset. Defaults to None.
+        group_size (Optional[int], optional): Pass lists of up to `group_size` consecutive examples
+            to `function`, which returns the list of their results. `max_concurrency` then
+            counts groups. Defaults to None, one example per call.
+    Returns:
+        Dataset: The mapped dataset.
+    """
+    groups = _groups(dataset.to_list(), group_size)
+    results = asyncio.run(_gather_bounded(groups, function, max_concurrency, desc))
+    return _merge_results(dataset, _ungroup(results, group_size), features)
+
+
+def batch_map(
+    dataset: Dataset,
+    function: Callable[[dict], Awaitable[dict]],
+    collector: BatchCollector,
+    features: Optional[Features] = None,
+    group_size: Optional[int] = None,
+) -> Dataset:
+    """Apply a coroutine function to every example, answering its completion calls with batch jobs.
+
+    Args:
+        dataset (Dataset): The dataset to map over.
+        function (Callable[[dict], Awaitable[dict]]): The coroutine function to apply.
+        collector (BatchCollector): The collector that submits and polls the batch jobs.
+        features (Optional[Features], optional): The features of the mapped dataset. Defaults to None.
+        group_size (Optional[int], optional): See `async_map`. Defaults to None.
+    Returns:
+        Dataset: The mapped dataset.
+    """
+    groups = _groups(dataset.to_list(), group_size)
+    results = asyncio.run(collector.run([function(group) for group in groups]))
+    return _merge_results(dataset, _ungroup(results, group_size), features)
+
+
+class Stage:
+    """One step of `pipeline_map`, applied to every example as soon as the previous step returns it.
+
+    Args:
+        name (str): The name of the step in the summary.
+        function (Callable[[dict], Awaitable[dict]]): The coroutine function to apply.
+        max_concurrency (int): The maximum number of calls of `function` in flight.
+        group_size (Optional[int], optional): Pass lists of up to `group_size` examples that
+            are waiting together, as in `async_map`. Defaults to None, one example per call.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        function: Callable[[dict], Awaitable[dict]],
+        max_concurrency: int,
+        group_size: Optional[int] = None,
+    ):
+        self.name = name
+        self.function = function
+        self.max_concurrency = max_concurrency
+        self.group_size = group_size
+        # Wall time with at least one call in flight
+        self.busy_seconds = 0.0
+        self._in_flight = 0
+        self._busy_since = 0.0
+
+    async def __call__(self, examples: List[dict]) -> List[dict]:
+        if self._in_flight == 0:
+            self._busy_since = time.perf_counter()
+        self._in_flight += 1
+        try:
+            if self.group_size is None:
+                return [await self.function(examples[0])]
+            return await self.function(examples)
+        finally:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self.busy_seconds += time.perf_counter() - self._busy_since
+
+
+# Marks the end of the examples in a pipeline queue
+_DONE = object()
+
+
+async def _get_group(queue: asyncio.Queue, group_size: Optional[int]) -> List:
+    """The next `group_size` items of a queue, fewer at its end, none once it is done."""
+    items = [await queue.get()]
+    while items[-1] is not _DONE and len(items) < (group_size or 1):
+        items.append(await queue.get())
+    if items[-1] is _DONE:
+        # Left for the other workers of the stage
+        await queue.put(items.pop())
+    return items
+
+
+async def _run_stage(stage: Stage, inbox: asyncio.Queue, outbox: asyncio.Queue) -> None:
+    # Groups are filled one at a time, so they are complete whenever the inbox allows
+    lock = asyncio.Lock()
+
+    async def worker() -> None:
+        while True:
+            async with lock:
+                items = await _get_group(inbox, stage.group_size)
+            if not items:
+                return
+            results = await stage([example for _, example in items])
+            for (idx, _), result in zip(items, results):
+                await outbox.put((idx, result))
+
+    await asyncio.gather(*(worker() for _ in range(stage.max_concurrency)))
+    await outbox.put(_DONE)
+
+
+def _load_checkpoint(path: str, fingerprint: Optional[dict]) -> Dict[str, dict]:
+    """The finished rows of a pipeline checkpoint, by id.
+
+    The first line of a checkpoint is the fingerprint of the run that wrote
+    it; the rows of another fingerprint are not reused. Unreadable lines,
+    such as the last one of an interrupted run, are skipped.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    records = []
+    for number, line in enumerate(lines, start=1):
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            print(f"[!] Skipping unreadable line {number} of {path}", file=sys.stderr)
+    if not records or records[0].get("fingerprint", {}) != (fingerprint or {}):
+        if records:
+            print(
+                f"[!] {path} was written by a run with other settings. Starting over",
+                file=sys.stderr,
+            )
+        return {}
+    return {row["id"]: row for row in records[1:]}
+
+
+async def _pipeline(
+    examples: List[dict],
+    stages: List[Stage],
+    queue_size: int,
+    checkpoint: Optional[str],
+    fingerprint: Optional[dict],
+    desc: Optional[str],
+) -> List[dict]:
+    """Stream the examples through the stages, with bounded queues between them."""
+    results: List[Optional[dict]] = [None] * len(examples)
+    done = _load_checkpoint(checkpoint, fingerprint) if checkpoint else {}
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+
+    async def feed() -> None:
+        for idx, example in enumerate(examples):
+            if example["id"] in done:
+                results[idx] = done[example["id"]]
+            else:
+                await queues[0].put((idx, example))
+        await queues[0].put(_DONE)
+
+    def write(f, record: dict) -> None:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+
+    async def collect(progress: tqdm) -> None:
+        # Rewritten from the rows read back, dropping any partial last line
+        with open(checkpoint or os.devnull, "w", encoding="utf-8") as f:
+            write(f, {"fingerprint": fingerprint or {}})
+            for row in done.values():
+                write(f, row)
+            while (item := await queues[-1].get()) is not _DONE:
+                idx, result = item
+                results[idx] = result
+                write(f, result)
+                progress.update(1)
+
+    with tqdm(total=len(examples), initial=len(done), desc=desc) as progress:
+        await asyncio.gather(
+            feed(),
+            *(
+                _run_stage(stage, queues[i], queues[i + 1])
+                for i, stage in enumerate(stages)
+            ),
+            collect(progress),
+        )
+    return results
+
+
+def pipeline_map(
+    datasets: Dict[str, Dataset],
+    stages: Dict[str, List[Stage]],
+    queue_size: int = 64,
+    checkpoint_dir: Optional[str] = None,
+    fingerprint: Optional[dict] = None,
+    column_features: Optional[Dict[str, dict]] = None,
+) -> Dict[str, Dataset]:
+    """Apply a chain of coroutine functions to the examples of several splits, as a stream.
+
+    Every example moves to the next stage as soon as a stage returns it,
+    instead of waiting for the whole split as consecutive `async_map` calls
+    would, so the stages overlap and the wall time approaches the one of
+    the slowest stage. All splits share one event loop. Bounded queues
+    between the stages keep a fast stage from running far ahead of a slow
+    one.
+
+    Args:
+        datasets (Dict[str, Dataset]): The datasets to map over, by split.
+        stages (Dict[str, List[Stage]]): The stages of every split, in order.
+        queue_size (int, optional): The examples waiting between two stages. Defaults to 64.
+        checkpoint_dir (Optional[str], optional): A directory where every example is appended to
+            `<split>.jsonl` once it leaves the last stage. Examples found there are not processed
+            again. Defaults to None, no checkpoint.
+        fingerprint (Optional[dict], optional): The settings the rows depend on, such as the
+            models. A checkpoint written with other settings is started over. Defaults to None.
+        column_features (Optional[Dict[str, dict]], optional): The features of columns added by
+            the stages, set explicitly instead of inferred. Defaults to None.
+    Returns:
+        Dict[str, Dataset]: The mapped datasets, by split.
+    """
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    async def run_all() -> List[List[dict]]:
+        return await asyncio.gather(
+            *(
+                _pipeline(
+                    datasets[split].to_list(),
+                    stages[split],
+                    queue_size,
+                    checkpoint_dir and os.path.join(checkpoint_dir, f"{split}.jsonl"),
+                    fingerprint,
+                    f"Pipelining {split} split",
+                )
+                for split in datasets
+            )
+        )
+
+    mapped = {}
+    for split, results in zip(datasets, asyncio.run(run_all())):
+        columns = {
+            name: feature
+            for name, feature in (column_features or {}).items()
+            if results and name in results[0]
+        }
+        values = {name: [result.pop(name) for result in results] for name in columns}
+        mapped[split] = _merge_results(datasets[split], results)
+        for name, feature in columns.items():
+            if name in mapped[split].column_names:
+                mapped[split] = mapped[split].remove_columns(name)
+            mapped[split] = mapped[split].add_column(
+                name, values[name], feature=feature
+            )
+    return mapped
@@ -0,0 +1,242 @@
+import asyncio
+import re
+import threading
+import time
+from typing import Dict, Iterable, Mapping, Optional
+
+from openai import RateLimitError
+from openai.types.chat import ChatCompletionMessageParam
+
+# Seconds to wait between two admission checks while a pool is saturated
+POLL_INTERVAL = 0.05
+
+
+def estimate_prompt_tokens(messages: Iterable[ChatCompletionMessageParam]) -> int:
+    """Roughly estimate the prompt tokens of a chat request before sending it.
+
+    Args:
+        messages (Iterable[ChatCompletionMessageParam]): The messages
+    Returns:
+        int: The estimated number of prompt tokens (about 4 characters per token)
+    """
+    num_chars = 0
+    num_messages = 0
+    for message in messages:
+        content = message.get("content") or ""
+        num_chars += len(content) if isinstance(content, str) else len(str(content))
+        num_messages += 1
+    return num_chars // 4 + 4 * num_messages
+
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """Parse a rate-limit reset header such as `1m30s`, `6s` or `120ms` into seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    found = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+    if not found:
+        return None
+    scale = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+    return sum(float(amount) * scale[unit] for amount, unit in found)
+
+
+class TokenBucket:
+    """A token bucket refilled continuously at `rate_per_minute`.
+
+    Args:
+        rate_per_minute (float): The sustained rate, e.g. requests or tokens per minute.
+        capacity (Optional[float], optional): The maximum burst size. Defaults to one minute of quota.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Return the seconds until `amount` can be taken (0 if available now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+    def limit_remaining(self, remaining: float) -> None:
+        """Align the bucket with the remaining quota reported by the provider."""
+        self.tokens = min(self.tokens, remaining)
+
+
+class RateLimitScheduler:
+    """Admission control for the completion calls of a single model.
+
+    Every call acquires one request and its estimated prompt tokens from the
+    RPM/TPM buckets, plus a concurrency slot. The concurrency limit follows
+    AIMD: it grows additively while calls succeed and is halved whenever the
+    provider answers with a rate-limit error.
+
+    Args:
+        name (str): The pool name, usually the model name.
+        rpm (Optional[float], optional): Requests per minute. Learned from the response headers if None.
+        tpm (Optional[float], optional): Tokens per minute. Learned from the response headers if None.
+        max_concurrency (int, optional): The upper bound of requests in flight. Defaults to 256.
+        min_concurrency (int, optional): The lower bound of requests in flight. Defaults to 1.
+        initial_concurrency (int, optional): The starting limit. Defaults to 8.
+        decrease_factor (float, optional): The multiplicative decrease on rate limits. Defaults to 0.5.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        max_concurrency: int = 256,
+        min_concurrency: int = 1,
+        initial_concurrency: int = 8,
+        decrease_factor: float = 0.5,
+    ):
+        self.name = name
+        self.request_bucket = TokenBucket(rpm) if rpm else None
+        self.token_bucket = TokenBucket(tpm) if tpm else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(min(initial_concurrency, max_concurrency))
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.slow_start = True
+        self.num_rate_limited = 0
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            wait = self.paused_until - now
+            if self.in_flight >= int(self.concurrency):
+                wait = max(wait, POLL_INTERVAL)
+            if self.request_bucket is not None:
+                wait = max(wait, self.request_bucket.wait_time(1, now))
+            if self.token_bucket is not None:
+                wait = max(wait, self.token_bucket.wait_time(tokens, now))
+            if wait > 0:
+                return wait
+
+            if self.request_bucket is not None:
+                self.request_bucket.take(1)
+            if self.token_bucket is not None:
+                self.token_bucket.take(tokens)
+            self.in_flight += 1
+            return 0.0
+
+    def acquire(self, tokens: int) -> None:
+        """Block until a request with `tokens` estimated prompt tokens may be sent."""
+        while (wait := self._try_acquire(tokens)) > 0:
+            time.sleep(min(wait, 1.0))
+
+    async def acquire_async(self, tokens: int) -> None:
+        """Asynchronous version of `acquire`."""
+        while (wait := self._try_acquire(tokens)) > 0:
+            await asyncio.sleep(min(wait, 1.0))
+
+    def release(
+        self,
+        estimated_tokens: int,
+        used_tokens: Optional[int] = None,
+        headers: Optional[Mapping[str, str]] = None,
+        error: Optional[Exception] = None,
+    ) -> None:
+        """Return the concurrency slot and adapt the limits to the call outcome.
+
+        Args:
+            estimated_tokens (int): The tokens reserved by `acquire`.
+            used_tokens (Optional[int], optional): The tokens actually billed. Defaults to None.
+            headers (Optional[Mapping[str, str]], optional): The response headers. Defaults to None.
+            error (Optional[Exception], optional): The error raised by the call. Defaults to None.
+        """
+        if isinstance(error, RateLimitError) and headers is None:
+            headers = error.response.headers
+        with self._lock:
+            self.in_flight -= 1
+            if self.token_bucket is not None and used_tokens is not None:
+                # Charge the difference between the estimate and the billed usage
+                self.token_bucket.tokens -= used_tokens - estimated_tokens
+            if headers is not None:
+                self._apply_headers(headers)
+
+            if isinstance(error, RateLimitError):
+                self.num_rate_limited += 1
+                self.slow_start = False
+                self.concurrency = max(
+                    self.min_concurrency, self.concurrency * self.decrease_factor
+                )
+                retry_after = parse_reset_duration(
+                    (headers or {}).get("retry-after")
+                ) or parse_reset_duration(
+                    (headers or {}).get("x-ratelimit-reset-requests")
+                )
+                self.paused_until = max(
+                    self.paused_until, time.monotonic() + (retry_after or 1.0)
+                )
+            elif error is None:
+                increase = 1.0 if self.slow_start else 1.0 / max(self.concurrency, 1.0)
+                self.concurrency = min(
+                    self.max_concurrency, self.concurrency + increase
+                )
+
+    def _apply_headers(self, headers: Mapping[str, str]) -> None:
+        for kind in ("requests", "tokens"):
+            limit = headers.get(f"x-ratelimit-limit-{kind}")
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            attr = "request_bucket" if kind == "requests" else "token_bucket"
+            try:
+                limit = float(limit) if limit is not None else None
+                remaining = float(remaining) if remaining is not None else None
+            except ValueError:
+                continue
+            if getattr(self, attr) is None and limit:
+                # Learn the quota of an unconfigured pool from the provider
+                setattr(self, attr, TokenBucket(limit))
+            bucket = getattr(self, attr)
+            if bucket is not None and remaining is not None:
+                bucket.limit_remaining(remaining)
+            if remaining == 0:
+                reset = parse_reset_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    self.paused_until = max(self.paused_until, time.monotonic() + reset)
+
+
+_schedulers: Dict[str, RateLimitScheduler] = {}
+_scheduler_options: Dict[str, dict] = {}
+_lock = threading.Lock()
+
+
+def configure_scheduler(model_name: str, **kwargs) -> None:
+    """Set the rate limits of the pool used for `model_name`.
+
+    Args:
+        model_name (str): The model name.
+        **kwargs: The `RateLimitScheduler` options (rpm, tpm, max_concurrency, ...).
+    """
+    with _lock:
+        _scheduler_options[model_name] = kwargs
+        _schedulers.pop(model_name, None)
+
+
+def get_scheduler(model_name: str) -> RateLimitScheduler:
+    """Return the scheduler pool of `model_name`, creating it on first use."""
+    with _lock:
+        if model_name not in _schedulers:
+            _schedulers[model_name] = RateLimitScheduler(
+                model_name, **_scheduler_options.get(model_name, {})
+            )
+        return _schedulers[model_name]
@@ -0,0 +1,80 @@
+import json
+from typing import Dict, List
+
+from datasets import Dataset, DatasetDict, Value
+from datasets.features.features import generate_from_arrow_type
+import pyarrow as pa
+
+# Free-form document fields that stay JSON-encoded inside the typed columns
+JSON_DOCUMENT_FIELDS = ("citation_idx",)
+# Meta fields read by the evaluation. Any other field keeps its inferred type.
+META_FEATURES = {
+    "language": Value("string"),
+    "difficulty_type": Value("string"),
+}
+
+
+def infer_docid_feature(docids: list) -> Value:
+    """The Arrow type of the document ids, `int64` for the released dataset."""
+    return Value(str(pa.array(docids).type)) if docids else Value("int64")
+
+
+def document_refs_feature(docid: Value) -> list:
+    """Features of the `documents` column of an interned example."""
+    return [
+        {
+            "docid": docid,
+            "ground": Value("bool"),
+            "citation_idx": Value("string"),
+        }
+    ]
+
+
+def citation_ids_feature(docid: Value) -> list:
+    return [docid]
+
+
+def meta_feature(metas: List[dict]) -> Dict[str, Value]:
+    """Features of `meta`: the declared fields and any other field found in `metas`."""
+    feature = generate_from_arrow_type(pa.array(metas).type) if metas else {}
+    feature.update(META_FEATURES)
+    return feature
+
+
+def parse_json_columns(dataset: DatasetDict) -> DatasetDict:
+    """Decode the JSON-encoded `meta` and `citation_ids` columns into typed Arrow columns.
+
+    Runs once when the dataset is loaded, so the prediction, evaluation and
+    aggregation loops read nested values without calling `json.loads`. Columns
+    that are already typed, e.g. in a saved output, are left as they are.
+
+    Args:
+        dataset (DatasetDict): The interned dataset.
+    Returns:
+        DatasetDict: The dataset with typed `meta` and `citation_ids` columns.
+    """
+    parsed = {}
+    for split, examples in dataset.items():
+        docid = examples.features["documents"].feature["docid"]
+        for column in ("meta", "citation_ids"):
+            if examples.features.get(column) != Value("string"):
+                continue
+            values = [json.loads(value) for value in examples[column]]
+            feature = (
+                meta_feature(values)
+                if column == "meta"
+                else citation_ids_feature(docid)
+            )
+            examples = examples.remove_columns(column).add_column(
+                column, values, feature=feature
+            )
+        parsed[split] = examples
+    return DatasetDict(parsed)
+
+
+def arrow_columns(dataset: Dataset, columns: List[str]) -> pa.Table:
+    """Read `columns` of a split as an Arrow table, in the row order of the split."""
+    table = dataset.data.table.select(columns)
+    if dataset._indices is not None:
+        table = table.take(dataset._indices.column(0))
+    return table
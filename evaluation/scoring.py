@@ -0,0 +1,214 @@
+import re
+from typing import List, Tuple
+
+from datasets import Dataset
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from .schema import arrow_columns
+
+CITATION_PATTERN = re.compile(r"\[(\d+)\]")
+# Rows scored per Arrow record batch
+SCORING_BATCH_SIZE = 65_536
+
+
+def _list_rows(array: pa.ListArray) -> Tuple[np.ndarray, np.ndarray]:
+    """Parent row and 1-based position of every value of a list array."""
+    rows = pc.list_parent_indices(array).to_numpy()
+    starts = np.asarray(array.offsets)[:-1] - array.offsets[0].as_py()
+    positions = np.arange(len(rows)) - starts[rows] + 1
+    return rows, positions
+
+
+def prediction_failed_mask(batch: pa.RecordBatch) -> np.ndarray:
+    """Vectorized `prediction_failed` over a batch of predicted examples."""
+    answers = batch.column("predicted_answer")
+    missing = pc.is_null(answers).to_numpy(zero_copy_only=False)
+    empty = pc.fill_null(pc.equal(answers, ""), True).to_numpy(zero_copy_only=False)
+    if "predict_status" not in batch.schema.names:
+        return missing | empty
+    status = pc.struct_field(batch.column("predict_status"), "status")
+    not_ok = pc.fill_null(pc.not_equal(status, "ok"), False)
+    unknown = pc.is_null(status).to_numpy(zero_copy_only=False)
+    return missing | np.where(unknown, empty, not_ok.to_numpy(zero_copy_only=False))
+
+
+def prediction_failed_rows(dataset: Dataset) -> np.ndarray:
+    """Vectorized `prediction_failed` over a whole split, one boolean per row."""
+    columns = [
+        name
+        for name in ("predicted_answer", "predict_status")
+        if name in dataset.column_names
+    ]
+    batches = arrow_columns(dataset, columns).to_batches(SCORING_BATCH_SIZE)
+    if not batches:
+        return np.zeros(len(dataset), dtype=bool)
+    return np.concatenate([prediction_failed_mask(batch) for batch in batches])
+
+
+def refusal_scores(answers: pa.Array) -> np.ndarray:
+    """1.0 where the answer refuses with "unanswerable", case-insensitively, 0.0 otherwise."""
+    refused = pc.match_substring(pc.utf8_lower(answers), "unanswerable")
+    return pc.fill_null(refused, False).to_numpy(zero_copy_only=False).astype(float)
+
+
+def citation_scores(
+    documents: pa.ListArray, citation_ids: pa.ListArray, answers: pa.Array
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Citation precision and recall of a batch, as computed by `citation_evaluation`.
+
+    The cited numbers `[n]` of an answer are compared as a set with the
+    1-based positions of the golden documents in the example.
+
+    Args:
+        documents (pa.ListArray): The documents of every example, with their `docid`.
+        citation_ids (pa.ListArray): The golden `docid`s of every example.
+        answers (pa.Array): The predicted answers.
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The precision and the recall of every example.
+    """
+    num_rows = len(answers)
+    doc_rows, doc_positions = _list_rows(documents)
+    gold_rows, _ = _list_rows(citation_ids)
+    docids = pc.struct_field(pc.list_flatten(documents), "docid")
+    codes = pc.dictionary_encode(
+        pa.concat_arrays([docids, pc.list_flatten(citation_ids).cast(docids.type)])
+    ).indices.to_numpy(zero_copy_only=False)
+    num_codes = int(codes.max()) + 1 if len(codes) else 1
+
+    # Position of every golden docid in its example, the last one for duplicates
+    doc_keys = doc_rows.astype(np.int64) * num_codes + codes[: len(doc_rows)]
+    gold_keys = gold_rows.astype(np.int64) * num_codes + codes[len(doc_rows) :]
+    order = np.argsort(doc_keys, kind="stable")
+    found = np.searchsorted(doc_keys[order], gold_keys, side="right") - 1
+    if len(gold_keys) and (
+        (found < 0).any() or (doc_keys[order][found] != gold_keys).any()
+    ):
+        raise KeyError("A citation id is not among the documents of its example")
+    gold_positions = doc_positions[order][found]
+
+    # Distinct cited numbers of every answer
+    matches = [CITATION_PATTERN.findall(answer or "") for answer in answers.to_pylist()]
+    cited_rows = np.repeat(np.arange(num_rows), [len(m) for m in matches])
+    cited = pc.dictionary_encode(
+        pa.array([number for m in matches for number in m], pa.string())
+    )
+    vocab = cited.dictionary.to_pylist()
+    cited_keys = np.unique(
+        cited_rows.astype(np.int64) * max(len(vocab), 1)
+        + cited.indices.to_numpy(zero_copy_only=False)
+    )
+    cited_rows = cited_keys // max(len(vocab), 1)
+    max_position = int(doc_positions.max()) if len(doc_positions) else 0
+    # Numbers written differently from the document number, e.g. [01], or
+    # out of range never match a golden document but still count as citations
+    numbers = np.array(
+        [int(n) if str(int(n)) == n and int(n) <= max_position else -1 for n in vocab],
+        dtype=np.int64,
+    )
+    cited_positions = numbers[cited_keys % max(len(vocab), 1)]
+
+    width = max_position + 1
+    hits = np.isin(
+        cited_rows * width + cited_positions,
+        gold_rows.astype(np.int64) * width + gold_positions,
+    ) & (cited_positions > 0)
+    num_hits = np.bincount(cited_rows[hits], minlength=num_rows)
+    num_cited = np.bincount(cited_rows, minlength=num_rows)
+    num_gold = np.bincount(gold_rows, minlength=num_rows)
+    precision = np.divide(
+        num_hits, num_cited, out=np.zeros(num_rows), where=num_cited != 0
+    )
+    recall = np.divide(num_hits, num_gold, out=np.zeros(num_rows), where=num_gold != 0)
+    return precision, recall
+
+
+def _replace_column(dataset: Dataset, name: str, chunks: List[pa.Array]) -> Dataset:
+    if name in dataset.column_names:
+        dataset = dataset.remove_columns(name)
+    return dataset.add_column(name, pa.chunked_array(chunks))
+
+
+def refusal_evaluation_batched(
+    dataset: Dataset, batch_size: int = SCORING_BATCH_SIZE
+) -> Dataset:
+    """Vectorized `refusal_evaluation` over a whole split, in-process.
+
+    Args:
+        dataset (Dataset): The predicted refusal split.
+        batch_size (int, optional): The rows per Arrow record batch. Defaults to `SCORING_BATCH_SIZE`.
+    Returns:
+        Dataset: The split with its `evaluation_result`.
+    """
+    columns = [
+        name
+        for name in ("predicted_answer", "predict_status")
+        if name in dataset.column_names
+    ]
+    chunks = []
+    for batch in arrow_columns(dataset, columns).to_batches(batch_size):
+        num_rows = batch.num_rows
+        failed = prediction_failed_mask(batch)
+        scores = refusal_scores(batch.column("predicted_answer"))
+        meta = pa.StructArray.from_arrays(
+            [
+                pa.nulls(num_rows, pa.string()),
+                pa.nulls(num_rows, pa.int64()),
+                pa.array(np.where(failed, "prediction failed", None), pa.string()),
+            ],
+            names=["model", "seed", "error"],
+        )
+        chunks.append(
+            pa.StructArray.from_arrays(
+                [
+                    meta,
+                    pa.array(scores, mask=failed),
+                    pa.array([{}] * num_rows, pa.struct([])),
+                ],
+                names=["meta", "score", "usage"],
+            )
+        )
+    return _replace_column(dataset, "evaluation_result", chunks)
+
+
+def citation_evaluation_batched(
+    dataset: Dataset, batch_size: int = SCORING_BATCH_SIZE
+) -> Dataset:
+    """Vectorized `citation_evaluation` over a whole split, in-process.
+
+    Adds `citation_precision` and `citation_recall` to the `evaluation_result`
+    of every example, replacing the ones of a previous run.
+
+    Args:
+        dataset (Dataset): The evaluated non-refusal split.
+        batch_size (int, optional): The rows per Arrow record batch. Defaults to `SCORING_BATCH_SIZE`.
+    Returns:
+        Dataset: The split with the citation scores.
+    """
+    table = arrow_columns(
+        dataset, ["documents", "citation_ids", "predicted_answer", "evaluation_result"]
+    )
+    chunks = []
+    for batch in table.to_batches(batch_size):
+        precision, recall = citation_scores(
+            batch.column("documents"),
+            batch.column("citation_ids"),
+            batch.column("predicted_answer"),
+        )
+        result = batch.column("evaluation_result")
+        fields = [
+            (field.name, array)
+            for field, array in zip(result.type, result.flatten())
+            if field.name not in ("citation_precision", "citation_recall")
+        ]
+        fields += [
+            ("citation_precision", pa.array(precision)),
+            ("citation_recall", pa.array(recall)),
+        ]
+        chunks.append(
+            pa.StructArray.from_arrays(
+                [array for _, array in fields], names=[name for name, _ in fields]
+            )
+        )
+    return _replace_column(dataset, "evaluation_result", chunks)
@@ -0,0 +1,288 @@
+from collections import OrderedDict
+from html import escape
+from html.parser import HTMLParser
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+
+# `raw` keeps the original prompt text: every parsed document dict verbatim.
+# The other formats keep only the document contents and rewrite HTML tables.
+DOCUMENT_FORMATS = ["raw", "markdown", "tsv", "html"]
+
+# Tags that start a new line when HTML is flattened to text
+BLOCK_TAGS = set(
+    "p div li ul ol h1 h2 h3 h4 h5 h6 caption section header footer blockquote pre".split()
+)
+
+
+class _Cell:
+    def __init__(self, header: bool, colspan: int, rowspan: int):
+        self.header = header
+        self.colspan = colspan
+        self.rowspan = rowspan
+        self.parts: List[str] = []
+
+    @property
+    def text(self) -> str:
+        return " ".join("".join(self.parts).split())
+
+
+class _HTMLStructureParser(HTMLParser):
+    """Splits an HTML document into text blocks and tables of cells.
+
+    Tables nested in a cell are flattened into the text of that cell.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks: List[Union[str, List[List[_Cell]]]] = []
+        self._text: List[str] = []
+        self._rows: Optional[List[List[_Cell]]] = None
+        self._cell: Optional[_Cell] = None
+        self._depth = 0
+
+    def _flush_text(self) -> None:
+        text = "\n".join(
+            " ".join(line.split()) for line in "".join(self._text).splitlines()
+        ).strip()
+        if text:
+            self.blocks.append(text)
+        self._text = []
+
+    def _write(self, text: str) -> None:
+        if self._cell is not None:
+            self._cell.parts.append(text)
+        elif self._depth == 0:
+            self._text.append(text)
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]):
+        if tag == "table":
+            self._depth += 1
+            if self._depth == 1:
+                self._flush_text()
+                self._rows = []
+            else:
+                self._write(" ")
+        elif self._depth > 1:
+            self._write(" ")
+        elif tag == "tr" and self._rows is not None:
+            self._rows.append([])
+        elif tag in ("td", "th") and self._rows is not None:
+            attrs = dict(attrs)
+            self._cell = _Cell(
+                tag == "th",
+                _parse_span(attrs.get("colspan")),
+                _parse_span(attrs.get("rowspan")),
+            )
+            if not self._rows:
+                self._rows.append([])
+            self._rows[-1].append(self._cell)
+        elif tag == "br" or tag in BLOCK_TAGS:
+            self._write("\n" if self._cell is None else " ")
+
+    def handle_endtag(self, tag: str):
+        if tag == "table" and self._depth > 0:
+            self._depth -= 1
+            if self._depth == 0:
+                self.blocks.append(self._rows)
+                self._rows = None
+                self._cell = None
+        elif self._depth == 1 and tag in ("td", "th"):
+            self._cell = None
+        elif tag in BLOCK_TAGS:
+            self._write("\n" if self._cell is None else " ")
+
+    def handle_data(self, data: str):
+        self._write(data)
+
+    def close(self):
+        super().close()
+        if self._rows is not None:
+            # Unclosed table
+            self.blocks.append(self._rows)
+            self._rows = None
+        self._flush_text()
+
+
+def _parse_span(value: Optional[str]) -> int:
+    try:
+        return max(1, min(int(value), 1000))
+    except (TypeError, ValueError):
+        return 1
+
+
+def _table_grid(rows: List[List[_Cell]]) -> List[List[str]]:
+    """Expand the row and column spans of a table into a rectangular grid of texts."""
+    grid: List[List[str]] = []
+    # Column -> (remaining rows, text) of the cells spanning down
+    pending: Dict[int, Tuple[int, str]] = {}
+    for row in rows:
+        out: List[str] = []
+
+        def fill_pending() -> None:
+            while len(out) in pending:
+                remaining, text = pending.pop(len(out))
+                if remaining > 1:
+                    pending[len(out)] = (remaining - 1, text)
+                out.append(text)
+
+        for cell in row:
+            fill_pending()
+            for _ in range(cell.colspan):
+                if cell.rowspan > 1:
+                    pending[len(out)] = (cell.rowspan - 1, cell.text)
+                out.append(cell.text)
+        fill_pending()
+        for col in sorted(c for c in pending if c >= len(out)):
+            out.extend([""] * (col - len(out)))
+            remaining, text = pending.pop(col)
+            if remaining > 1:
+                pending[col] = (remaining - 1, text)
+            out.append(text)
+        if out:
+            grid.append(out)
+
+    width = max((len(row) for row in grid), default=0)
+    return [row + [""] * (width - len(row)) for row in grid]
+
+
+def _markdown_table(rows: List[List[_Cell]]) -> str:
+    grid = _table_grid(rows)
+    if not grid:
+        return ""
+    grid = [[text.replace("|", "\\|") for text in row] for row in grid]
+    lines = ["| " + " | ".join(grid[0]) + " |", "|" + "---|" * len(grid[0])]
+    lines.extend("| " + " | ".join(row) + " |" for row in grid[1:])
+    return "\n".join(lines)
+
+
+def _tsv_table(rows: List[List[_Cell]]) -> str:
+    return "\n".join("\t".join(row) for row in _table_grid(rows))
+
+
+def _structure_table(rows: List[List[_Cell]]) -> str:
+    lines = ["<table>"]
+    for row in rows:
+        cells = []
+        for cell in row:
+            tag = "th" if cell.header else "td"
+            attrs = "".join(
+                f' {name}="{value}"'
+                for name, value in (
+                    ("colspan", cell.colspan),
+                    ("rowspan", cell.rowspan),
+                )
+                if value > 1
+            )
+            cells.append(f"<{tag}{attrs}>{escape(cell.text, quote=False)}</{tag}>")
+        lines.append("<tr>" + "".join(cells) + "</tr>")
+    lines.append("</table>")
+    return "\n".join(lines)
+
+
+_TABLE_FORMATTERS = {
+    "markdown": _markdown_table,
+    "tsv": _tsv_table,
+    "html": _structure_table,
+}
+
+
+def convert_html(content: str, doc_format: str) -> str:
+    """Rewrite an HTML document in a compact format.
+
+    Args:
+        content (str): The HTML content.
+        doc_format (str): One of `DOCUMENT_FORMATS` except `raw`.
+    Returns:
+        str: The text blocks and the tables of the document, in order.
+    """
+    parser = _HTMLStructureParser()
+    parser.feed(content)
+    parser.close()
+    format_table = _TABLE_FORMATTERS[doc_format]
+    return "\n".join(
+        block if isinstance(block, str) else format_table(block)
+        for block in parser.blocks
+    )
+
+
+def _is_html(doc: Union[dict, str]) -> bool:
+    if isinstance(doc, dict):
+        return doc.get("type") == "html"
+    return "<table" in doc or "<tr" in doc
+
+
+def _content(doc: Union[dict, str]) -> str:
+    return doc.get("content", "") if isinstance(doc, dict) else str(doc)
+
+
+class DocumentSerializer:
+    """Renders the documents of an example into the prompt block `[1]\\n...\\n[2]\\n...`.
+
+    Serialized document lists are kept in an LRU cache, so the multiple calls
+    of ToT or least-to-most for the same example convert the HTML only once.
+
+    Args:
+        doc_format (str, optional): One of `DOCUMENT_FORMATS`. Defaults to "raw".
+        cache_size (int, optional): The number of cached document lists. Defaults to 1024.
+    Attributes:
+        hits (int): The number of cache hits.
+        misses (int): The number of cache misses.
+    """
+
+    def __init__(self, doc_format: str = "raw", cache_size: int = 1024):
+        if doc_format not in DOCUMENT_FORMATS:
+            raise ValueError(
+                f"Invalid document format: {doc_format}. Choose from {DOCUMENT_FORMATS}"
+            )
+        self.doc_format = doc_format
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_cache"] = OrderedDict()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(docs: List[Union[dict, str]]) -> tuple:
+        return tuple(
+            (
+                (doc.get("docid"), doc.get("content"))
+                if isinstance(doc, dict)
+                else (None, doc)
+            )
+            for doc in docs
+        )
+
+    def serialize(self, docs: List[Union[dict, str]]) -> str:
+        key = self._key(docs)
+        with self._lock:
+            if (cached := self._cache.get(key)) is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        serialized = "\n".join(
+            f"[{i + 1}]\n{self.serialize_document(doc)}" for i, doc in enumerate(docs)
+        )
+        with self._lock:
+            self._cache[key] = serialized
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return serialized
+
+    def serialize_document(self, doc: Union[dict, str]) -> str:
+        if self.doc_format == "raw":
+            return f"{doc}"
+        if _is_html(doc):
+            return convert_html(_content(doc), self.doc_format)
+        return _content(doc)
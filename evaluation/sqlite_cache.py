@@ -0,0 +1,138 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+"""
+
+
+class SQLiteCache:
+    """A string key-value store in an SQLite file, shared by the workers of a run.
+
+    Every thread of every process opens its own connection; WAL journaling
+    lets them read while one of them writes. Entries older than `ttl` are
+    misses, and above `max_entries` entries or `max_bytes` stored bytes the
+    least recently used are evicted. Database errors are reported once and
+    turn the cache into a no-op rather than failing the evaluation.
+
+    Args:
+        path (str): The SQLite file, created with its directory if missing.
+        max_entries (Optional[int], optional): The entries kept. Defaults to no limit.
+        max_bytes (Optional[int], optional): The bytes of the values kept. Defaults to no limit.
+        ttl (Optional[float], optional): The seconds an entry stays valid. Defaults to no expiry.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._local = threading.local()
+        self._failed = False
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_local"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        """The connection of the current thread, reopened in forked workers."""
+        state = getattr(self._local, "state", None)
+        if state is not None and state[0] == os.getpid():
+            return state[1]
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+        self._local.state = (os.getpid(), connection)
+        return connection
+
+    def _warn(self, error: sqlite3.Error) -> None:
+        if not self._failed:
+            print(f"[!] Cache {self.path} unavailable: {error}", file=sys.stderr)
+        self._failed = True
+
+    def get(self, key: str) -> Optional[str]:
+        """The value of a key, or None on a miss."""
+        if self._failed:
+            return None
+        try:
+            connection = self._connection()
+            row = connection.execute(
+                "SELECT value, created FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if self.ttl is not None and now - row[1] > self.ttl:
+                connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            connection.execute(
+                "UPDATE entries SET last_used = ? WHERE key = ?", (now, key)
+            )
+            return row[0]
+        except sqlite3.Error as error:
+            self._warn(error)
+            return None
+
+    def put(self, key: str, value: str) -> None:
+        """Store a value, evicting the least recently used entries over the limits."""
+        if self._failed:
+            return
+        try:
+            connection = self._connection()
+            now = time.time()
+            connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode()), now, now),
+            )
+            self._evict(connection)
+        except sqlite3.Error as error:
+            self._warn(error)
+
+    def _evict(self, connection: sqlite3.Connection) -> None:
+        if self.max_entries is not None:
+            (count,) = connection.execute("SELECT COUNT(*) FROM entries").fetchone()
+            if count > self.max_entries:
+                connection.execute(
+                    "DELETE FROM entries WHERE key IN "
+                    "(SELECT key FROM entries ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+        if self.max_bytes is not None:
+            (total,) = connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+            if total > self.max_bytes:
+                # Drop the oldest entries until the rest fits in the budget
+                connection.execute(
+                    "DELETE FROM entries WHERE key IN ("
+                    " SELECT key FROM ("
+                    "  SELECT key, SUM(size) OVER (ORDER BY last_used DESC) AS kept"
+                    "  FROM entries"
+                    " ) WHERE kept > ?"
+                    ")",
+                    (self.max_bytes,),
+                )
@@ -0,0 +1,104 @@
+from contextlib import contextmanager
+import contextvars
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+_active_tracker: contextvars.ContextVar[Optional["UsageTracker"]] = (
+    contextvars.ContextVar("active_usage_tracker", default=None)
+)
+
+
+class UsageTracker:
+    """Accumulates the usage details of the completion calls made for one example.
+
+    The token counts returned by the methods only cover prompt and completion
+    tokens; the tracker collects the provider details and timings on the side,
+    so that no method has to thread them through its return values.
+
+    Attributes:
+        start (float): The `time.monotonic()` at which tracking started.
+        num_calls (int): The number of completion calls.
+        cached_tokens (int): The prompt tokens served from the provider prefix cache.
+        cache_hits (int): The completion calls replayed from the response cache.
+        latencies (List[float]): The latency in seconds of every answered call.
+        ttfts (List[float]): The time to first token in seconds of every streamed call.
+        details (Dict[str, Any]): Method-specific details added to the prediction details.
+    """
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.num_calls = 0
+        self.cached_tokens = 0
+        self.cache_hits = 0
+        self.latencies: List[float] = []
+        self.ttfts: List[float] = []
+        self.details: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def record(self, usage: Optional[object]) -> None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        with self._lock:
+            self.num_calls += 1
+            self.cached_tokens += getattr(details, "cached_tokens", None) or 0
+
+    def record_timing(self, latency: float, ttft: Optional[float] = None) -> None:
+        with self._lock:
+            self.latencies.append(latency)
+            if ttft is not None:
+                self.ttfts.append(ttft)
+
+    def record_cache_hit(self) -> None:
+        with self._lock:
+            self.cache_hits += 1
+
+    @property
+    def elapsed(self) -> float:
+        """The wall time in seconds since tracking started."""
+        return time.monotonic() - self.start
+
+    @property
+    def mean_latency(self) -> Optional[float]:
+        return sum(self.latencies) / len(self.latencies) if self.latencies else None
+
+    @property
+    def mean_ttft(self) -> Optional[float]:
+        return sum(self.ttfts) / len(self.ttfts) if self.ttfts else None
+
+
+@contextmanager
+def track_usage() -> Iterator[UsageTracker]:
+    """Collect the usage of the completion calls made within the block.
+
+    Tasks and threads started inside the block share the same tracker.
+    """
+    tracker = UsageTracker()
+    token = _active_tracker.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _active_tracker.reset(token)
+
+
+def record_usage(usage: Optional[object]) -> None:
+    """Add the usage of a completion call to the active tracker, if any."""
+    if (tracker := _active_tracker.get()) is not None:
+        tracker.record(usage)
+
+
+def record_cache_hit() -> None:
+    """Count a call answered by the response cache in the active tracker, if any."""
+    if (tracker := _active_tracker.get()) is not None:
+        tracker.record_cache_hit()
+
+
+def record_timing(latency: float, ttft: Optional[float] = None) -> None:
+    """Add the latency and time to first token of a call to the active tracker, if any."""
+    if (tracker := _active_tracker.get()) is not None:
+        tracker.record_timing(latency, ttft)
+
+
+def record_details(**details: Any) -> None:
+    """Add method-specific details, e.g. search statistics, to the active tracker, if any."""
+    if (tracker := _active_tracker.get()) is not None:
+        tracker.details.update(details)
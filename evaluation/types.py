@@ -1,5 +1,7 @@
 from typing import Any, Dict, List, Literal, Optional, TypedDict, Union
 
+from typing_extensions import NotRequired, TypedDict as ExtTypedDict
+
 
 class EvaluationAPIResponse(TypedDict):
     justification: str
@@ -14,6 +16,15 @@ ERROR_TYPES = [
 ]
 
 
+# pydantic validates TypedDicts from `typing_extensions` only before Python 3.12
+class JudgeVerdict(ExtTypedDict):
+    """The JSON output of the JSON judge formats."""
+
+    decision: Literal["Correct", "Partially Correct", "Wrong"]
+    error_type: NotRequired[Optional[str]]
+    justification: NotRequired[Optional[str]]
+
+
 class DocumentInfo(TypedDict):
     # Document ID corresponding to the id of `Document`
     docid: int
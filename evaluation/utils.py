@@ -1,17 +1,28 @@
+import asyncio
 import json
 import os
 import re
 import shutil
 import string
 import sys
-from typing import Iterable, Optional, Tuple
+import time
+from typing import Iterable, List, Optional, Tuple
 
-from datasets import Dataset
-from openai import NOT_GIVEN, OpenAI
+from datasets import Dataset, DatasetDict, load_dataset, load_from_disk
+from openai import NOT_GIVEN
+from openai.types import CompletionUsage
 from openai.types.chat import ChatCompletionMessageParam
 from pydantic import TypeAdapter
 from dotenv import load_dotenv
 
+from .batch import get_active_collector
+from .clients import get_async_client, get_client
+from .documents import STORE_FILENAME, DocumentStore, prepare_document_store
+from .retry import RETRY_CONFIG, backoff_delay, classify_error, is_retryable
+from .scheduler import estimate_prompt_tokens, get_scheduler
+from .schema import parse_json_columns
+from .tracking import record_timing
+
 load_dotenv()
 
 
@@ -76,44 +87,412 @@ def openai_chat_completion(
     messages: Iterable[ChatCompletionMessageParam],
     seed: Optional[int] = NOT_GIVEN,
     json_response: bool = False,
+    base_url: Optional[str] = None,
+    api_key: Optional[str] = None,
+    stream: bool = False,
+    stop: Optional[List[str]] = None,
+    n: int = 1,
+    temperature: Optional[float] = NOT_GIVEN,
+    max_tokens: Optional[int] = NOT_GIVEN,
 ) -> Tuple[str, dict]:
     """OpenAI Chat Completion API Call
 
+    Transient errors (see `evaluation.retry`) are retried with jittered
+    exponential backoff.
+
+    Args:
+        model_name (str): The model name
+        messages (Iterable[ChatCompletionMessageParam]): The messages
+        seed (Optional[int], optional): The seed. Defaults to NOT_GIVEN.
+        json_response (bool, optional): The JSON response. Defaults to False.
+        base_url (Optional[str], optional): The API base URL of an OpenAI-compatible server. Defaults to None.
+        api_key (Optional[str], optional): The API key. Defaults to None.
+        stream (bool, optional): Stream the response to measure the time to first token. Defaults to False.
+        stop (Optional[List[str]], optional): Stop sequences, excluded from the output. Sent to the API,
+            or enforced by closing the stream when streaming. Defaults to None.
+        n (int, optional): The number of samples of one request. With more than one, the
+            output is the list of their contents and the response is never streamed. Defaults to 1.
+        temperature (Optional[float], optional): The sampling temperature. Defaults to NOT_GIVEN.
+        max_tokens (Optional[int], optional): The cap on the completion tokens. Defaults to NOT_GIVEN.
+    Returns:
+        Tuple[str, dict]: The output and the usage
+    """
+    max_retries = RETRY_CONFIG["max_retries"]
+    for attempt in range(max_retries + 1):
+        output, usage, error = _chat_completion_once(
+            model_name,
+            messages,
+            seed,
+            json_response,
+            base_url,
+            api_key,
+            stream and n == 1,
+            stop,
+            n,
+            temperature,
+            max_tokens,
+        )
+        if error is None or not is_retryable(error) or attempt == max_retries:
+            break
+        _log_api_error(error, attempt, max_retries)
+        time.sleep(backoff_delay(attempt, error))
+    if error is not None:
+        _log_api_error(error)
+    return output, usage, error
+
+
+async def openai_chat_completion_async(
+    model_name: str,
+    messages: Iterable[ChatCompletionMessageParam],
+    seed: Optional[int] = NOT_GIVEN,
+    json_response: bool = False,
+    base_url: Optional[str] = None,
+    api_key: Optional[str] = None,
+    stream: bool = False,
+    stop: Optional[List[str]] = None,
+    n: int = 1,
+    temperature: Optional[float] = NOT_GIVEN,
+    max_tokens: Optional[int] = NOT_GIVEN,
+) -> Tuple[str, dict]:
+    """Asynchronous OpenAI Chat Completion API Call
+
+    Inside a batch round (see `evaluation.batch.BatchCollector`) the request is
+    queued for the next batch job instead of being sent immediately.
+
     Args:
         model_name (str): The model name
         messages (Iterable[ChatCompletionMessageParam]): The messages
         seed (Optional[int], optional): The seed. Defaults to NOT_GIVEN.
         json_response (bool, optional): The JSON response. Defaults to False.
+        base_url (Optional[str], optional): The API base URL of an OpenAI-compatible server. Defaults to None.
+        api_key (Optional[str], optional): The API key. Defaults to None.
+        stream (bool, optional): Stream the response to measure the time to first token. Defaults to False.
+        stop (Optional[List[str]], optional): Stop sequences, excluded from the output. Sent to the API,
+            or enforced by closing the stream when streaming. Defaults to None.
+        n (int, optional): The number of samples of one request. With more than one, the
+            output is the list of their contents and the response is never streamed. Defaults to 1.
+        temperature (Optional[float], optional): The sampling temperature. Defaults to NOT_GIVEN.
+        max_tokens (Optional[int], optional): The cap on the completion tokens. Defaults to NOT_GIVEN.
     Returns:
         Tuple[str, dict]: The output and the usage
     """
+    if (collector := get_active_collector()) is not None:
+        return await collector.chat_completion(
+            model_name,
+            messages,
+            seed=seed,
+            json_response=json_response,
+            stop=stop,
+            n=n,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+
+    max_retries = RETRY_CONFIG["max_retries"]
+    for attempt in range(max_retries + 1):
+        output, usage, error = await _chat_completion_once_async(
+            model_name,
+            messages,
+            seed,
+            json_response,
+            base_url,
+            api_key,
+            stream and n == 1,
+            stop,
+            n,
+            temperature,
+            max_tokens,
+        )
+        if error is None or not is_retryable(error) or attempt == max_retries:
+            break
+        _log_api_error(error, attempt, max_retries)
+        await asyncio.sleep(backoff_delay(attempt, error))
+    if error is not None:
+        _log_api_error(error)
+    return output, usage, error
+
+
+def _log_api_error(
+    error: Exception, attempt: Optional[int] = None, max_retries: Optional[int] = None
+) -> None:
+    if attempt is None:
+        print(f"[!] API Call Error ({classify_error(error)}): {error}", file=sys.stderr)
+    else:
+        print(
+            f"[!] API Call Error ({classify_error(error)}), retry {attempt + 1}/{max_retries}: {error}",
+            file=sys.stderr,
+        )
+
+
+def _request_options(
+    seed: Optional[int],
+    json_response: bool,
+    stream: bool,
+    stop: Optional[List[str]],
+    n: int = 1,
+    temperature: Optional[float] = NOT_GIVEN,
+    max_tokens: Optional[int] = NOT_GIVEN,
+) -> dict:
+    options = {
+        "seed": seed,
+        "response_format": {"type": "json_object"} if json_response else NOT_GIVEN,
+        "n": n if n > 1 else NOT_GIVEN,
+        "temperature": temperature,
+        "max_completion_tokens": max_tokens,
+    }
+    if stream:
+        options.update(stream=True, stream_options={"include_usage": True})
+    elif stop:
+        options["stop"] = stop
+    return options
+
+
+class _StreamAccumulator:
+    """Collects the chunks of a streamed completion and detects stop sequences.
+
+    Args:
+        messages (Iterable[ChatCompletionMessageParam]): The request messages.
+        stop (Optional[List[str]]): The stop sequences.
+        start (float): The `time.monotonic()` at which the request was sent.
+    """
+
+    def __init__(
+        self,
+        messages: Iterable[ChatCompletionMessageParam],
+        stop: Optional[List[str]],
+        start: float,
+    ):
+        self.messages = messages
+        self.stop = stop or []
+        self.start = start
+        self.ttft: Optional[float] = None
+        self.text = ""
+        self.num_chunks = 0
+        self.usage = None
+        self.stopped = False
+
+    def add(self, chunk) -> bool:
+        """Add a chunk and return whether a stop sequence was reached."""
+        if chunk.usage is not None:
+            self.usage = chunk.usage
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            return False
+        delta = chunk.choices[0].delta.content
+        if self.ttft is None:
+            self.ttft = time.monotonic() - self.start
+        self.num_chunks += 1
+        # Only the tail can contain a stop sequence completed by this chunk
+        search_from = max(
+            0, len(self.text) - max((len(stop) for stop in self.stop), default=0)
+        )
+        self.text += delta
+        for stop in self.stop:
+            if (idx := self.text.find(stop, search_from)) != -1:
+                self.text = self.text[:idx]
+                self.stopped = True
+        return self.stopped
+
+    def result(self) -> Tuple[str, CompletionUsage]:
+        usage = self.usage
+        if usage is None:
+            # The usage chunk never arrives on a closed stream: estimate it,
+            # counting about one token per content chunk
+            prompt_tokens = estimate_prompt_tokens(self.messages)
+            usage = CompletionUsage(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=self.num_chunks,
+                total_tokens=prompt_tokens + self.num_chunks,
+            )
+        return self.text, usage
+
+
+def _chat_completion_once(
+    model_name: str,
+    messages: Iterable[ChatCompletionMessageParam],
+    seed: Optional[int],
+    json_response: bool,
+    base_url: Optional[str] = None,
+    api_key: Optional[str] = None,
+    stream: bool = False,
+    stop: Optional[List[str]] = None,
+    n: int = 1,
+    temperature: Optional[float] = NOT_GIVEN,
+    max_tokens: Optional[int] = NOT_GIVEN,
+) -> Tuple[str, dict, Optional[Exception]]:
+    scheduler = get_scheduler(model_name)
+    estimated_tokens = estimate_prompt_tokens(messages)
+    scheduler.acquire(estimated_tokens)
+    start = time.monotonic()
+    ttft = None
     try:
-        client = OpenAI()
-        response = client.chat.completions.create(
+        client = get_client(base_url, api_key)
+        raw_response = client.chat.completions.with_raw_response.create(
             model=model_name,
             messages=messages,
-            seed=seed,
-            response_format={"type": "json_object"} if json_response else NOT_GIVEN,
+            **_request_options(
+                seed, json_response, stream, stop, n, temperature, max_tokens
+            ),
         )
-        output = response.choices[0].message.content
-        usage = response.usage
-        return output, usage, None
+        response = raw_response.parse()
+        if stream:
+            accumulator = _StreamAccumulator(messages, stop, start)
+            with response:
+                for chunk in response:
+                    if accumulator.add(chunk):
+                        break
+            output, usage = accumulator.result()
+            ttft = accumulator.ttft
+        elif n > 1:
+            output = [choice.message.content for choice in response.choices]
+            usage = response.usage
+        else:
+            output = response.choices[0].message.content
+            usage = response.usage
     except Exception as e:
-        print(f"[!] API Call Error: {e}", file=sys.stderr)
+        scheduler.release(estimated_tokens, error=e)
         return None, None, e
+    scheduler.release(
+        estimated_tokens,
+        used_tokens=usage.total_tokens if usage else None,
+        headers=raw_response.headers,
+    )
+    record_timing(time.monotonic() - start, ttft)
+    return output, usage, None
+
+
+async def _chat_completion_once_async(
+    model_name: str,
+    messages: Iterable[ChatCompletionMessageParam],
+    seed: Optional[int],
+    json_response: bool,
+    base_url: Optional[str] = None,
+    api_key: Optional[str] = None,
+    stream: bool = False,
+    stop: Optional[List[str]] = None,
+    n: int = 1,
+    temperature: Optional[float] = NOT_GIVEN,
+    max_tokens: Optional[int] = NOT_GIVEN,
+) -> Tuple[str, dict, Optional[Exception]]:
+    scheduler = get_scheduler(model_name)
+    estimated_tokens = estimate_prompt_tokens(messages)
+    await scheduler.acquire_async(estimated_tokens)
+    start = time.monotonic()
+    ttft = None
+    try:
+        client = get_async_client(base_url, api_key)
+        raw_response = await client.chat.completions.with_raw_response.create(
+            model=model_name,
+            messages=messages,
+            **_request_options(
+                seed, json_response, stream, stop, n, temperature, max_tokens
+            ),
+        )
+        response = raw_response.parse()
+        if stream:
+            accumulator = _StreamAccumulator(messages, stop, start)
+            async with response:
+                async for chunk in response:
+                    if accumulator.add(chunk):
+                        break
+            output, usage = accumulator.result()
+            ttft = accumulator.ttft
+        elif n > 1:
+            output = [choice.message.content for choice in response.choices]
+            usage = response.usage
+        else:
+            output = response.choices[0].message.content
+            usage = response.usage
+    except asyncio.CancelledError as e:
+        scheduler.release(estimated_tokens, error=e)
+        raise
+    except Exception as e:
+        scheduler.release(estimated_tokens, error=e)
+        return None, None, e
+    scheduler.release(
+        estimated_tokens,
+        used_tokens=usage.total_tokens if usage else None,
+        headers=raw_response.headers,
+    )
+    record_timing(time.monotonic() - start, ttft)
+    return output, usage, None
+
+
+def load_crest_dataset(path: str) -> Tuple[DatasetDict, DocumentStore]:
+    """Load the benchmark from the Hub or a previously saved output directory
+
+    Args:
+        path (str): The dataset name or the output path written by `safe_save`
+    Returns:
+        Tuple[DatasetDict, DocumentStore]: The dataset and the store of its documents
+    """
+    if os.path.exists(os.path.join(path, "dataset_dict.json")):
+        dataset, store = prepare_document_store(
+            load_from_disk(path, keep_in_memory=True), path
+        )
+    else:
+        dataset, store = prepare_document_store(load_dataset(path))
+    return parse_json_columns(dataset), store
 
 
-def safe_save(dataset: Dataset, output_path: str) -> None:
+def safe_save(
+    dataset: Dataset, output_path: str, store: Optional[DocumentStore] = None
+) -> None:
     """Safely save the dataset to the output path
 
     Args:
         dataset (Dataset): The dataset to save
         output_path (str): The output path
+        store (Optional[DocumentStore]): The store of the interned documents
     """
-    if not os.path.exists(output_path):
-        dataset.save_to_disk(output_path)
-    else:
-        tmp_path = output_path.rstrip("/") + ".tmp"
-        dataset.save_to_disk(tmp_path)
+    save_path = output_path
+    if os.path.exists(output_path):
+        save_path = output_path.rstrip("/") + ".tmp"
+    dataset.save_to_disk(save_path)
+    if store is not None:
+        store.save(os.path.join(save_path, STORE_FILENAME))
+    if save_path != output_path:
         shutil.rmtree(output_path)
-        os.rename(tmp_path, output_path)
+        os.rename(save_path, output_path)
+
+
+def merge_by_id(dataset: Dataset, updates: Dataset) -> Dataset:
+    """Replace the rows of `dataset` with the rows of `updates` sharing the same `id`
+
+    Args:
+        dataset (Dataset): The dataset to update
+        updates (Dataset): The updated rows
+    Returns:
+        Dataset: The merged dataset
+    """
+    rows = {row["id"]: row for row in updates}
+    return dataset.map(
+        lambda x: rows.get(x["id"], x),
+        keep_in_memory=True,
+        desc="Merging updated rows",
+    )
+
+
+def merge_column_by_id(
+    dataset: Dataset, updates: Dataset, column: str, feature: Optional[dict] = None
+) -> Dataset:
+    """Replace one column of the rows of `dataset` sharing an `id` with `updates`
+
+    Unlike `merge_by_id` the other columns are kept as they are, so `updates`
+    may be a subset of the columns.
+
+    Args:
+        dataset (Dataset): The dataset to update
+        updates (Dataset): The updated rows
+        column (str): The replaced column
+        feature (Optional[dict]): The feature of the merged column. Defaults to the one of `updates`
+    Returns:
+        Dataset: The merged dataset
+    """
+    values = dict(zip(updates["id"], updates[column]))
+    merged = [
+        values.get(row_id, value)
+        for row_id, value in zip(dataset["id"], dataset[column])
+    ]
+    return dataset.remove_columns(column).add_column(
+        column, merged, feature=feature or updates.features[column]
+    )
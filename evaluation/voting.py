@@ -0,0 +1,45 @@
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from .scoring import CITATION_PATTERN
+from .utils import normalize_answer, remove_citation_from_answer
+
+# Vote key shared by every refusal, whatever explanation follows it
+REFUSAL_KEY = "unanswerable"
+
+
+def vote_key(answer: str) -> str:
+    """The normalized answer without its citations, the same for every refusal."""
+    normalized = normalize_answer(CITATION_PATTERN.sub(" ", answer))
+    return REFUSAL_KEY if REFUSAL_KEY in normalized else normalized
+
+
+def majority_vote(answers: List[Optional[str]]) -> Tuple[int, str, int]:
+    """Self-consistency vote over the parsed answers of several samples.
+
+    The answers are grouped by `vote_key`; ties go to the group sampled first.
+    The winning answer is the first of its group, with the citations of the
+    whole group appended in order of first appearance.
+
+    Args:
+        answers (List[Optional[str]]): The parsed answer of every sample, None for a failed one.
+    Returns:
+        Tuple[int, str, int]: The sample of the winning answer, the answer with the merged citations and its number of votes.
+    """
+    keys = [vote_key(answer) if answer is not None else None for answer in answers]
+    counts = Counter(key for key in keys if key is not None)
+    if not counts:
+        raise ValueError("No sample has an answer")
+    winner, votes = counts.most_common(1)[0]
+    group = [index for index, key in enumerate(keys) if key == winner]
+
+    citations: List[str] = []
+    for index in group:
+        for number in CITATION_PATTERN.findall(answers[index]):
+            if number not in citations:
+                citations.append(number)
+    text = remove_citation_from_answer(answers[group[0]]).rstrip()
+    missing = "".join(
+        f"[{number}]" for number in citations if f"[{number}]" not in text
+    )
+    return group[0], f"{text} {missing}" if missing else text, votes
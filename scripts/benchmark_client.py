@@ -0,0 +1,73 @@
+import argparse
+import statistics
+import time
+
+from openai import OpenAI
+
+from evaluation.clients import configure_clients, get_client
+
+parser = argparse.ArgumentParser("Per-call latency of fresh vs. shared API clients")
+parser.add_argument("--model", type=str, default="gpt-4o-mini", help="model name")
+parser.add_argument(
+    "--num-calls", type=int, default=20, help="Number of calls for each client mode"
+)
+parser.add_argument(
+    "--http2",
+    action=argparse.BooleanOptionalAction,
+    default=None,
+    help="Use HTTP/2 for the shared client (default: enabled when `h2` is installed)",
+)
+
+
+def _timed_call(client: OpenAI, model_name: str) -> float:
+    start = time.perf_counter()
+    client.chat.completions.create(
+        model=model_name,
+        messages=[{"role": "user", "content": "Reply with OK."}],
+        max_tokens=1,
+    )
+    return time.perf_counter() - start
+
+
+def _fresh_client_latencies(model_name: str, num_calls: int) -> list:
+    latencies = []
+    for _ in range(num_calls):
+        start = time.perf_counter()
+        with OpenAI() as client:
+            _timed_call(client, model_name)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def _shared_client_latencies(model_name: str, num_calls: int) -> list:
+    client = get_client()
+    # Warm up the pool so the one-off TLS handshake is not attributed to every call
+    _timed_call(client, model_name)
+    return [_timed_call(client, model_name) for _ in range(num_calls)]
+
+
+def _report(name: str, latencies: list) -> float:
+    mean = statistics.mean(latencies)
+    print(
+        f"[{name}] mean {mean * 1000:.1f}ms, median {statistics.median(latencies) * 1000:.1f}ms,"
+        f" min {min(latencies) * 1000:.1f}ms, max {max(latencies) * 1000:.1f}ms"
+    )
+    return mean
+
+
+def main(args: argparse.Namespace):
+    if args.http2 is not None:
+        configure_clients(http2=args.http2)
+    print(f"[+] Benchmarking {args.num_calls} calls per mode with {args.model}")
+    fresh = _report("fresh client", _fresh_client_latencies(args.model, args.num_calls))
+    shared = _report(
+        "shared client", _shared_client_latencies(args.model, args.num_calls)
+    )
+    print(
+        f"[+] Saved per call: {(fresh - shared) * 1000:.1f}ms ({(fresh - shared) / fresh:.1%})"
+    )
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,115 @@
+import argparse
+import os
+import time
+
+from datasets import Dataset
+from datasets.table import InMemoryTable
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from evaluation.crest import citation_evaluation, refusal_evaluation
+from evaluation.scoring import citation_evaluation_batched, refusal_evaluation_batched
+
+parser = argparse.ArgumentParser(
+    "Row-wise `datasets.map` vs. vectorized citation and refusal scoring"
+)
+parser.add_argument(
+    "--num-rows", type=int, default=1_000_000, help="Rows of the synthetic split"
+)
+parser.add_argument(
+    "--docs-per-example", type=int, default=10, help="Documents of every example"
+)
+parser.add_argument(
+    "--num-proc",
+    type=int,
+    default=os.cpu_count(),
+    help="Worker processes of the row-wise path, as `--num-parallels` in run_evaluation",
+)
+parser.add_argument(
+    "--seed", type=int, default=42, help="Random seed for reproducibility"
+)
+
+
+def synthetic_split(num_rows: int, docs_per_example: int, seed: int) -> Dataset:
+    """A predicted and judged split with random documents, citations and answers."""
+    rng = np.random.default_rng(seed)
+    docids = rng.integers(0, 50_000, size=(num_rows, docs_per_example))
+    num_citations = rng.integers(1, 4, size=num_rows)
+    answers = []
+    for row in range(num_rows):
+        if rng.random() < 0.2:
+            answers.append("I cannot answer because the question is unanswerable.")
+            continue
+        cited = rng.integers(1, docs_per_example + 3, size=rng.integers(0, 4))
+        answers.append("The answer is 42. " + "".join(f"[{n}]" for n in cited))
+
+    documents = pa.ListArray.from_arrays(
+        np.arange(0, num_rows * docs_per_example + 1, docs_per_example),
+        pa.StructArray.from_arrays([pa.array(docids.ravel())], names=["docid"]),
+    )
+    citation_ids = pa.ListArray.from_arrays(
+        np.concatenate([[0], np.cumsum(num_citations)]),
+        pa.array(
+            np.concatenate(
+                [docids[row, :count] for row, count in enumerate(num_citations)]
+            )
+        ),
+    )
+    table = pa.table(
+        {
+            "documents": documents,
+            "citation_ids": citation_ids,
+            "predicted_answer": pa.array(answers),
+            "predict_status": pa.array(
+                [{"status": "ok", "error_type": "", "error": ""}] * num_rows
+            ),
+            "evaluation_result": pa.array([{"score": 2.0}] * num_rows),
+        }
+    )
+    return Dataset(InMemoryTable(table))
+
+
+def _timed(name: str, function) -> Dataset:
+    start = time.perf_counter()
+    result = function()
+    print(f"[{name}] {time.perf_counter() - start:.2f}s")
+    return result
+
+
+def main(args: argparse.Namespace):
+    print(f"[+] Building a synthetic split of {args.num_rows:,} rows")
+    dataset = synthetic_split(args.num_rows, args.docs_per_example, args.seed)
+
+    for name, rowwise, batched in (
+        ("refusal", refusal_evaluation, refusal_evaluation_batched),
+        ("citation", citation_evaluation, citation_evaluation_batched),
+    ):
+        expected = _timed(
+            f"{name} map num_proc={args.num_proc}",
+            lambda: dataset.map(rowwise, num_proc=args.num_proc, keep_in_memory=True),
+        )
+        actual = _timed(f"{name} vectorized", lambda: batched(dataset))
+        fields = (
+            ["score"]
+            if name == "refusal"
+            else ["citation_precision", "citation_recall"]
+        )
+        mismatches = [
+            field
+            for field in fields
+            if not pc.struct_field(
+                expected.data.table.column("evaluation_result"), field
+            ).equals(
+                pc.struct_field(actual.data.table.column("evaluation_result"), field)
+            )
+        ]
+        if mismatches:
+            print(f"[!] {name} {', '.join(mismatches)} differ from the row-wise path")
+        else:
+            print(f"[+] {name} scores match the row-wise path")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,82 @@
+import argparse
+from collections import defaultdict
+import time
+
+from evaluation.documents import load_documents
+from evaluation.planner import TokenCounter
+from evaluation.serializers import DOCUMENT_FORMATS, DocumentSerializer
+from evaluation.utils import load_crest_dataset
+
+parser = argparse.ArgumentParser(
+    "Prompt tokens of the documents per serialization format"
+)
+parser.add_argument("--dataset", type=str, default="upstage/CReSt", help="Dataset path")
+parser.add_argument(
+    "--model",
+    type=str,
+    default="gpt-4o-mini",
+    help="model name whose tokenizer counts the tokens",
+)
+parser.add_argument(
+    "--num-samples", type=int, default=None, help="Number of samples per split"
+)
+parser.add_argument(
+    "--seed", type=int, default=42, help="Random seed for reproducibility"
+)
+
+
+def main(args: argparse.Namespace):
+    dataset, store = load_crest_dataset(args.dataset)
+    counter = TokenCounter(args.model)
+    print(f"[+] Counting document tokens with {counter.name}")
+
+    # (split, language) -> format -> tokens
+    tokens = defaultdict(lambda: defaultdict(int))
+    # (split, language) -> tokens of the HTML documents in raw format
+    html_tokens = defaultdict(int)
+    seconds = defaultdict(float)
+    for split in dataset:
+        examples = dataset[split]
+        if args.num_samples is not None:
+            examples = examples.shuffle(args.seed).select(range(args.num_samples))
+        for example in examples:
+            docs = load_documents(example, store)
+            group = (split, example["meta"]["language"])
+            html_tokens[group] += sum(
+                counter.count(f"{doc}") for doc in docs if doc.get("type") == "html"
+            )
+            for doc_format in DOCUMENT_FORMATS:
+                serializer = DocumentSerializer(doc_format)
+                start = time.perf_counter()
+                serialized = serializer.serialize(docs)
+                seconds[doc_format] += time.perf_counter() - start
+                tokens[group][doc_format] += counter.count(serialized)
+
+    print(
+        f"{'split':<12}{'lang':<6}{'HTML share':>11}"
+        + "".join(f"{doc_format:>18}" for doc_format in DOCUMENT_FORMATS)
+    )
+    totals = defaultdict(int)
+    for group in sorted(tokens):
+        raw = tokens[group]["raw"]
+        cells = []
+        for doc_format in DOCUMENT_FORMATS:
+            totals[doc_format] += tokens[group][doc_format]
+            saving = 1 - tokens[group][doc_format] / raw if raw else 0.0
+            cells.append(f"{tokens[group][doc_format]:>10,} ({saving:>5.1%})")
+        print(
+            f"{group[0]:<12}{group[1]:<6}{html_tokens[group] / max(raw, 1):>11.1%}"
+            + "".join(f"{cell:>18}" for cell in cells)
+        )
+    cells = [
+        f"{totals[doc_format]:>10,} ({1 - totals[doc_format] / max(totals['raw'], 1):>5.1%})"
+        for doc_format in DOCUMENT_FORMATS
+    ]
+    print(f"{'total':<29}" + "".join(f"{cell:>18}" for cell in cells))
+    for doc_format in DOCUMENT_FORMATS:
+        print(f"[+] {doc_format} serialization took {seconds[doc_format]:.2f}s")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
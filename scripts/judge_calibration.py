@@ -0,0 +1,113 @@
+import argparse
+from collections import Counter
+from functools import partial
+import time
+
+from evaluation.crest import non_refusal_evaluation_async, prediction_failed
+from evaluation.judge import non_refusal_evaluation_group_async
+from evaluation.judge_cache import configure_judge_cache
+from evaluation.runner import async_map
+from evaluation.utils import load_crest_dataset
+
+DECISIONS = {2.0: "Correct", 1.0: "Partial", 0.0: "Wrong", None: "Invalid"}
+
+parser = argparse.ArgumentParser(
+    "Agreement of the batched judge with the one-item judge on a predicted sample"
+)
+parser.add_argument(
+    "--dataset",
+    type=str,
+    required=True,
+    help="Output of run_evaluation with predicted answers",
+)
+parser.add_argument(
+    "--eval-model", type=str, default="gpt-4o", help="OpenAI model name of the judge"
+)
+parser.add_argument(
+    "--judge-batch-size",
+    type=int,
+    default=8,
+    help="Examples graded per call of the batched judge",
+)
+parser.add_argument(
+    "--num-samples", type=int, default=200, help="Number of non_refusal examples"
+)
+parser.add_argument(
+    "--max-concurrency", type=int, default=32, help="Maximum judge calls in flight"
+)
+parser.add_argument(
+    "--seed", type=int, default=42, help="Random seed for reproducibility"
+)
+
+
+def _judge(examples, function, args, group_size=None):
+    start = time.perf_counter()
+    judged = async_map(
+        examples,
+        partial(function, model_name=args.eval_model, seed=args.seed, prejudge=False),
+        max_concurrency=args.max_concurrency,
+        group_size=group_size,
+    )
+    seconds = time.perf_counter() - start
+    results = judged["evaluation_result"]
+    tokens = sum(
+        (result["usage"] or {}).get("prompt_tokens", 0)
+        + (result["usage"] or {}).get("completion_tokens", 0)
+        for result in results
+    )
+    return results, tokens, seconds
+
+
+def main(args: argparse.Namespace):
+    # Both judges must grade every answer themselves, not read back the
+    # verdicts of the other one
+    configure_judge_cache(enabled=False)
+    dataset, _ = load_crest_dataset(args.dataset)
+    examples = dataset["non_refusal"]
+    if "predicted_answer" not in examples.column_names:
+        raise ValueError(f"{args.dataset} has no predicted answers")
+    examples = examples.filter(lambda x: not prediction_failed(x), keep_in_memory=True)
+    examples = examples.shuffle(args.seed).select(
+        range(min(args.num_samples, len(examples)))
+    )
+    if "evaluation_result" in examples.column_names:
+        examples = examples.remove_columns("evaluation_result")
+    print(f"[+] Judging {len(examples)} examples with {args.eval_model}")
+
+    single, single_tokens, single_seconds = _judge(
+        examples, non_refusal_evaluation_async, args
+    )
+    batched, batched_tokens, batched_seconds = _judge(
+        examples, non_refusal_evaluation_group_async, args, args.judge_batch_size
+    )
+
+    pairs = Counter(
+        (DECISIONS[a["score"]], DECISIONS[b["score"]]) for a, b in zip(single, batched)
+    )
+    agreement = sum(count for (a, b), count in pairs.items() if a == b)
+    shared_errors = [
+        (a["error_type"], b["error_type"])
+        for a, b in zip(single, batched)
+        if a["score"] is not None and a["score"] < 2 and b["score"] == a["score"]
+    ]
+
+    labels = list(DECISIONS.values())
+    print(f"{'one-item / batched':<20}" + "".join(f"{label:>10}" for label in labels))
+    for a in labels:
+        print(f"{a:<20}" + "".join(f"{pairs[(a, b)]:>10}" for b in labels))
+    print(f"[+] Decision agreement: {agreement / max(len(examples), 1):.2%}")
+    if shared_errors:
+        same_type = sum(a == b for a, b in shared_errors)
+        print(
+            f"[+] ErrorType agreement on shared non-Correct decisions: {same_type / len(shared_errors):.2%}"
+        )
+    print(
+        f"[+] one-item judge: {single_tokens:,} tokens in {single_seconds:.1f}s,"
+        f" batched judge (x{args.judge_batch_size}): {batched_tokens:,} tokens in {batched_seconds:.1f}s"
+        f" ({single_tokens / max(batched_tokens, 1):.1f}x fewer tokens)"
+    )
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
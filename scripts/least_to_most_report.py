@@ -0,0 +1,97 @@
+import argparse
+from collections import defaultdict
+
+import numpy as np
+
+from evaluation.backends import get_backend
+from evaluation.crest import predict
+from evaluation.method import LeastToMostMethod
+from evaluation.method.baseline import PROMPT_LAYOUTS
+from evaluation.method.least_to_most import SOLVE_MODES
+from evaluation.serializers import DOCUMENT_FORMATS
+from evaluation.utils import load_crest_dataset
+
+parser = argparse.ArgumentParser(
+    "Tokens and latency of the least-to-most solve modes on the same examples"
+)
+parser.add_argument("--dataset", type=str, default="upstage/CReSt", help="Dataset path")
+parser.add_argument("--model", type=str, default="gpt-4o-mini", help="model name")
+parser.add_argument(
+    "--base-url",
+    type=str,
+    default=None,
+    help="Base URL of an OpenAI-compatible server for --model",
+)
+parser.add_argument(
+    "--api-key",
+    type=str,
+    default=None,
+    help="API key of --base-url (defaults to OPENAI_API_KEY)",
+)
+parser.add_argument(
+    "--split", type=str, default="non_refusal", help="Split to sample the examples from"
+)
+parser.add_argument(
+    "--num-samples", type=int, default=20, help="Number of examples per solve mode"
+)
+parser.add_argument(
+    "--prompt-layout", type=str, default="default", choices=PROMPT_LAYOUTS
+)
+parser.add_argument("--doc-format", type=str, default="raw", choices=DOCUMENT_FORMATS)
+parser.add_argument(
+    "--seed", type=int, default=42, help="Random seed for reproducibility"
+)
+
+
+def main(args: argparse.Namespace):
+    dataset, store = load_crest_dataset(args.dataset)
+    examples = dataset[args.split].shuffle(args.seed)
+    examples = examples.select(range(min(args.num_samples, len(examples))))
+    backend = get_backend("openai", base_url=args.base_url, api_key=args.api_key)
+
+    # solve mode -> usage field -> values of the successful examples
+    usage = defaultdict(lambda: defaultdict(list))
+    failed = defaultdict(int)
+    for solve_mode in SOLVE_MODES:
+        method = LeastToMostMethod(
+            args.model,
+            args.seed,
+            solve_mode=solve_mode,
+            backend=backend,
+            prompt_layout=args.prompt_layout,
+            doc_format=args.doc_format,
+        )
+        print(f"[+] Predicting {len(examples)} examples in {solve_mode} mode")
+        for example in examples:
+            result = predict(dict(example), method, store)
+            if result["predict_status"]["status"] != "ok":
+                failed[solve_mode] += 1
+                continue
+            for field in ("prompt_tokens", "completion_tokens", "num_calls", "latency"):
+                usage[solve_mode][field].append(result["predict_usage"][field])
+
+    print(
+        f"{'mode':<12}{'ok':>5}{'failed':>8}{'calls':>8}{'prompt tok':>12}"
+        f"{'compl. tok':>12}{'latency':>10}{'p90':>8}"
+    )
+    for solve_mode in SOLVE_MODES:
+        values = usage[solve_mode]
+        latency = np.array(values["latency"] or [np.nan])
+        print(
+            f"{solve_mode:<12}{len(values['latency']):>5}{failed[solve_mode]:>8}"
+            f"{np.mean(values['num_calls'] or [np.nan]):>8.1f}"
+            f"{np.mean(values['prompt_tokens'] or [np.nan]):>12,.0f}"
+            f"{np.mean(values['completion_tokens'] or [np.nan]):>12,.0f}"
+            f"{latency.mean():>9.2f}s{np.percentile(latency, 90):>7.2f}s"
+        )
+
+    sequential, graph = usage["sequential"], usage["graph"]
+    if sequential["latency"] and graph["latency"]:
+        for field, name in (("prompt_tokens", "prompt tokens"), ("latency", "latency")):
+            change = np.mean(graph[field]) / np.mean(sequential[field]) - 1
+            print(f"[+] graph vs sequential {name}: {change:+.1%} per example")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,58 @@
+import sys
+
+from evaluation.prejudge import prejudge
+
+# (golden answer, predicted answer, expected pre-judge path or None for the judge)
+CASES = [
+    # Decided locally
+    ("42", "42", "numeric"),
+    ("42", "42 [1]", "numeric"),
+    ("42명", "42", "numeric"),
+    ("1,234", "1234", "numeric"),
+    ("$1.5 million", "1,500,000 dollars", "numeric"),
+    ("35억 원", "35 억원", "numeric"),
+    ("-5%", "−5%", "numeric"),
+    ("Seoul", "seoul.", "exact"),
+    ("서울특별시", "서울 특별시", "exact"),
+    ("about 40", "about 40", "exact"),
+    ("C++", "c++", "exact"),
+    ("2023-05-01", "May 1, 2023", "date"),
+    ("42", "", "empty"),
+    ("42", "unanswerable", "refusal"),
+    # Signs, separators and symbols
+    ("5%", "-5%", None),
+    ("3", "-3", None),
+    ("35억 원", "3.5억 원", None),
+    ("1.234", "1,234", None),
+    ("AA+", "AA-", None),
+    ("C++", "C", None),
+    ("A+", "A", None),
+    # Units the golden answer does not have
+    ("42", "42 months", None),
+    ("3", "3 times", None),
+    ("3", "3rd", None),
+    # Negations and qualifiers
+    ("42", "not 42", None),
+    ("42", "about 42", None),
+    ("42", "42 or more", None),
+    ("2023-05-01", "not on May 1, 2023", None),
+]
+
+
+def main() -> int:
+    failures = 0
+    for golden, predicted, expected in CASES:
+        decision = prejudge(golden, predicted)
+        path = decision[2] if decision else None
+        if path != expected:
+            failures += 1
+            print(
+                f"[!] prejudge({golden!r}, {predicted!r}): {decision}, expected {expected}",
+                file=sys.stderr,
+            )
+    print(f"[+] {len(CASES) - failures}/{len(CASES)} pre-judge cases as expected")
+    return int(failures > 0)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
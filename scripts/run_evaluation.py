@@ -1,17 +1,29 @@
 import argparse
-import json
+import os
+import shutil
+import sys
+import time
+from collections import Counter
 from datetime import datetime
 from functools import partial
+from typing import List, Optional
 
-from datasets import Features, Value, load_dataset
+import numpy as np
+from datasets import Dataset, DatasetDict, Features, Value
+from openai import NOT_GIVEN
 from evaluation.crest import (
+    JUDGE_FORMATS,
+    REJUDGE_REASONS,
     aggregate_score,
     aggregate_citation_score,
+    default_predict_status,
     non_refusal_evaluation,
+    non_refusal_evaluation_async,
     predict,
-    refusal_evaluation,
-    citation_evaluation,
+    predict_async,
+    prediction_failed,
     calculate_unified_score,
+    rejudge_reason,
 )
 from evaluation.method import (
     BaselineMethod,
@@ -22,7 +34,45 @@ from evaluation.method import (
     LeastToMostMethod,
     PlanAndSolveMethod,
 )
-from evaluation.utils import safe_save
+from evaluation.backends import RESPONSE_CACHE_MODES, CachedBackend, get_backend
+from evaluation.backends.cached import default_response_cache_path
+from evaluation.method.baseline import PROMPT_LAYOUTS
+from evaluation.method.least_to_most import SOLVE_MODES
+from evaluation.planner import (
+    TokenCounter,
+    get_context_window,
+    plan_judge,
+    plan_predictions,
+    print_plan,
+)
+from evaluation.batch import BatchCollector, LocalBatchEndpoint, OpenAIBatchEndpoint
+from evaluation.clients import configure_clients
+from evaluation.documents import DocumentStore
+from evaluation.index import MetadataIndex
+from evaluation.judge import (
+    non_refusal_evaluation_batch,
+    non_refusal_evaluation_group_async,
+    non_refusal_evaluation_json,
+    non_refusal_evaluation_json_async,
+)
+from evaluation.judge_cache import PROMPT_VERSIONS, configure_judge_cache
+from evaluation.prejudge import PREJUDGE_PATHS
+from evaluation.retry import configure_retries
+from evaluation.serializers import DOCUMENT_FORMATS
+from evaluation.sqlite_cache import SQLiteCache
+from evaluation.runner import Stage, async_map, batch_map, pipeline_map
+from evaluation.scheduler import configure_scheduler
+from evaluation.scoring import (
+    citation_evaluation_batched,
+    prediction_failed_rows,
+    refusal_evaluation_batched,
+)
+from evaluation.utils import (
+    load_crest_dataset,
+    merge_by_id,
+    merge_column_by_id,
+    safe_save,
+)
 
 parser = argparse.ArgumentParser("Evaluation of CReSt")
 parser.add_argument(
@@ -59,22 +109,351 @@ parser.add_argument(
     ],
     help="Answer generation method",
 )
+parser.add_argument(
+    "--backend",
+    type=str,
+    default="openai",
+    choices=["openai", "transformers"],
+    help="Inference backend of --model: an OpenAI(-compatible) API or in-process transformers",
+)
+parser.add_argument(
+    "--base-url",
+    type=str,
+    default=None,
+    help="Base URL of an OpenAI-compatible server for --model, e.g. http://localhost:8000/v1 (vLLM, llama.cpp)",
+)
+parser.add_argument(
+    "--api-key",
+    type=str,
+    default=None,
+    help="API key of --base-url (defaults to OPENAI_API_KEY)",
+)
+parser.add_argument(
+    "--device",
+    type=str,
+    default="cpu",
+    help="Torch device of the transformers backend",
+)
+parser.add_argument(
+    "--local-batch-size",
+    type=int,
+    default=8,
+    help="Maximum number of prompts per generate call of the transformers backend",
+)
+parser.add_argument(
+    "--max-new-tokens",
+    type=int,
+    default=1024,
+    help="Maximum number of generated tokens of the transformers backend",
+)
+parser.add_argument(
+    "--prompt-layout",
+    type=str,
+    default="default",
+    choices=PROMPT_LAYOUTS,
+    help="`prefix_cache` puts the documents in a stable leading message so provider prefix caching can hit",
+)
+parser.add_argument(
+    "--doc-format",
+    type=str,
+    default="raw",
+    choices=DOCUMENT_FORMATS,
+    help="How documents are written into the prompts. `markdown`, `tsv` and `html` keep only the contents and compact the HTML tables",
+)
+parser.add_argument(
+    "--stream",
+    action="store_true",
+    help="Stream completions to record the time to first token of every call",
+)
+parser.add_argument(
+    "--response-cache",
+    type=str,
+    default="off",
+    choices=RESPONSE_CACHE_MODES,
+    help="Persistent cache of the --model responses, intermediate calls included: "
+    "read-only replays cached responses, write-through also stores new ones",
+)
+parser.add_argument(
+    "--response-cache-path",
+    type=str,
+    default=None,
+    help="SQLite file of the response cache (defaults to the datasets cache directory)",
+)
+parser.add_argument(
+    "--response-cache-ttl",
+    type=float,
+    default=None,
+    help="Seconds a cached response stays valid (defaults to no expiry)",
+)
+parser.add_argument(
+    "--response-cache-max-mb",
+    type=float,
+    default=2048,
+    help="Size of the response cache, least recently used responses evicted first",
+)
+parser.add_argument(
+    "--early-stop",
+    action="store_true",
+    help="Stop generating at </Answer>: closes the stream with --stream, otherwise sends a stop sequence",
+)
+parser.add_argument(
+    "--tot-batch-scoring",
+    action="store_true",
+    help="Score all candidates of a ToT node in one evaluation call instead of one call each",
+)
+parser.add_argument(
+    "--tot-stop-confidence",
+    type=float,
+    default=None,
+    help="Stop the ToT search once the best path scores at least this (1.0 = sure, 0.5 = maybe)",
+)
+parser.add_argument(
+    "--tot-prune-impossible",
+    action="store_true",
+    help="Drop the ToT candidates scored impossible instead of expanding them",
+)
+parser.add_argument(
+    "--tot-max-tokens",
+    type=int,
+    default=None,
+    help="Token budget of the ToT search of one example; the beam narrows and the search returns the best path so far",
+)
+parser.add_argument(
+    "--tot-max-calls",
+    type=int,
+    default=None,
+    help="Call budget of the ToT search of one example",
+)
+parser.add_argument(
+    "--tot-max-seconds",
+    type=float,
+    default=None,
+    help="Wall-clock budget in seconds of the ToT search of one example",
+)
+parser.add_argument(
+    "--ltm-solve-mode",
+    type=str,
+    default="sequential",
+    choices=SOLVE_MODES,
+    help="`graph` solves independent least-to-most sub-questions concurrently, passing each only the sub-answers it depends on",
+)
+parser.add_argument(
+    "--judge-batch-size",
+    type=int,
+    default=1,
+    help="Non-refusal examples graded per judge call. Unparsable items are judged alone. "
+    "Check the agreement with `python -m scripts.judge_calibration` first",
+)
+parser.add_argument(
+    "--judge-format",
+    type=str,
+    default="text",
+    choices=JUDGE_FORMATS,
+    help="Judge output: the free-text rubric, or a capped JSON verdict without (json) "
+    "or with (json_justified) a one-sentence justification. JSON verdicts that fail to "
+    "parse are retried alone",
+)
+parser.add_argument(
+    "--judge-max-tokens",
+    type=int,
+    default=None,
+    help="Completion token cap of the JSON judge formats (defaults to 48 for json, "
+    "160 for json_justified; raise it for reasoning models)",
+)
+parser.add_argument(
+    "--prejudge",
+    action=argparse.BooleanOptionalAction,
+    default=True,
+    help="Decide empty, refused, exactly matching, numeric and date answers locally "
+    "before calling the judge",
+)
+parser.add_argument(
+    "--judge-cache",
+    action=argparse.BooleanOptionalAction,
+    default=True,
+    help="Reuse judge verdicts of identical (question, golden answer, normalized prediction) "
+    "across runs. --overwrite-evaluate judges again and refreshes them",
+)
+parser.add_argument(
+    "--judge-cache-path",
+    type=str,
+    default=None,
+    help="SQLite file of the judge cache (defaults to the datasets cache directory)",
+)
+parser.add_argument(
+    "--judge-cache-size",
+    type=int,
+    default=100_000,
+    help="Verdicts kept in the judge cache, least recently used evicted first",
+)
+parser.add_argument(
+    "--dry-run",
+    action="store_true",
+    help="Build every prompt and report tokens, cost, context-window overflows and wall time without calling any API",
+)
+parser.add_argument(
+    "--plan-completion-tokens",
+    type=int,
+    default=512,
+    help="Completion tokens assumed per answer by --dry-run",
+)
+parser.add_argument(
+    "--context-window",
+    type=int,
+    default=None,
+    help="Context window of --model for --dry-run (known OpenAI models by default)",
+)
+parser.add_argument(
+    "--price-input",
+    type=float,
+    default=None,
+    help="USD per million prompt tokens of --model for --dry-run",
+)
+parser.add_argument(
+    "--price-output",
+    type=float,
+    default=None,
+    help="USD per million completion tokens of --model for --dry-run",
+)
 parser.add_argument(
     "--num-parallels", type=int, default=16, help="Number of parallel processes to use"
 )
+parser.add_argument(
+    "--execution",
+    type=str,
+    default="process",
+    choices=["process", "async", "batch"],
+    help="How to run API calls: forked processes, a single asyncio event loop, or batch jobs",
+)
+parser.add_argument(
+    "--batch-endpoint",
+    type=str,
+    default="openai",
+    choices=["openai", "local"],
+    help="Batch endpoint for `--execution batch`. `local` answers the batch files with regular API calls",
+)
+parser.add_argument(
+    "--batch-dir",
+    type=str,
+    default="outputs/batches",
+    help="Directory for the batch input and output files",
+)
+parser.add_argument(
+    "--batch-poll-interval",
+    type=float,
+    default=60.0,
+    help="Seconds between two batch status checks",
+)
+parser.add_argument(
+    "--pipeline",
+    action="store_true",
+    help="With `--execution async`, judge every non_refusal answer as soon as it is predicted"
+    " instead of after the whole split, checkpointing the finished rows",
+)
+parser.add_argument(
+    "--pipeline-queue-size",
+    type=int,
+    default=64,
+    help="Examples waiting between the prediction and the judge with `--pipeline`",
+)
+parser.add_argument(
+    "--max-concurrency",
+    type=int,
+    default=256,
+    help="Maximum number of examples in flight with `--execution async`",
+)
+parser.add_argument(
+    "--rpm",
+    type=float,
+    default=None,
+    help="Requests per minute quota of --model (learned from response headers if omitted)",
+)
+parser.add_argument(
+    "--tpm",
+    type=float,
+    default=None,
+    help="Tokens per minute quota of --model (learned from response headers if omitted)",
+)
+parser.add_argument(
+    "--eval-rpm",
+    type=float,
+    default=None,
+    help="Requests per minute quota of --eval-model",
+)
+parser.add_argument(
+    "--eval-tpm",
+    type=float,
+    default=None,
+    help="Tokens per minute quota of --eval-model",
+)
+parser.add_argument(
+    "--max-connections",
+    type=int,
+    default=256,
+    help="Maximum number of pooled connections per API client",
+)
+parser.add_argument(
+    "--max-keepalive-connections",
+    type=int,
+    default=64,
+    help="Maximum number of idle connections kept alive per API client",
+)
+parser.add_argument(
+    "--keepalive-expiry",
+    type=float,
+    default=60.0,
+    help="Seconds an idle pooled connection is kept alive",
+)
+parser.add_argument(
+    "--request-timeout", type=float, default=600.0, help="API request timeout in seconds"
+)
+parser.add_argument(
+    "--http2",
+    action=argparse.BooleanOptionalAction,
+    default=None,
+    help="Use HTTP/2 for API clients (default: enabled when `h2` is installed)",
+)
 parser.add_argument(
     "--seed", type=int, default=42, help="Random seed for reproducibility"
 )
 parser.add_argument("--output-path", type=str, help="Path to save the output")
-parser.add_argument("--n", type=int, default=1, help="Number of answers to generate")
 parser.add_argument(
-    "--temperature", type=float, default=0.0, help="Temperature for answer generation"
+    "--n",
+    type=int,
+    default=1,
+    help="Number of answers sampled in one request and voted by self-consistency",
+)
+parser.add_argument(
+    "--temperature",
+    type=float,
+    default=None,
+    help="Temperature for answer generation (defaults to the API default)",
+)
+parser.add_argument(
+    "--max-retries",
+    type=int,
+    default=5,
+    help="Retries with jittered exponential backoff for transient API errors",
+)
+parser.add_argument(
+    "--resume",
+    action="store_true",
+    help="Only predict the missing or failed rows of an already predicted dataset",
 )
 parser.add_argument(
     "--overwrite-evaluate",
     action="store_true",
     help="Overwrite the evaluation results",
 )
+parser.add_argument(
+    "--rejudge",
+    type=str,
+    default=["failed"],
+    choices=REJUDGE_REASONS,
+    nargs="*",
+    help="Judge again the evaluated non_refusal rows whose judge call failed,"
+    " or whose verdict comes from another judge model or prompt",
+)
 parser.add_argument(
     "--num-samples", type=int, default=None, help="Number of samples to evaluate"
 )
@@ -88,55 +467,458 @@ parser.add_argument(
 )
 
 
+def print_latency_summary(split: str, usage: List[dict]) -> None:
+    """Print the latency percentiles and the mean time to first token of a split."""
+    latencies = sorted(u["latency"] for u in usage if u.get("latency") is not None)
+    if not latencies:
+        return
+    p50 = latencies[len(latencies) // 2]
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    message = f"[+] {split} split latency per example: p50 {p50:.2f}s, p95 {p95:.2f}s"
+    ttfts = [u["ttft"] for u in usage if u.get("ttft") is not None]
+    if ttfts:
+        message += f", mean TTFT {sum(ttfts) / len(ttfts):.2f}s"
+    print(message)
+
+
+def answer_batch_request(model_name: str, backend, body: dict):
+    """Answer a local batch request, sending the requests of `model_name` to `backend`."""
+    if body["model"] != model_name:
+        return LocalBatchEndpoint._chat_completion(body)
+    if body.get("n", 1) > 1 or "temperature" in body:
+        return backend.sample_completions(
+            body["model"],
+            body["messages"],
+            n=body.get("n", 1),
+            temperature=body.get("temperature"),
+            seed=body.get("seed", NOT_GIVEN),
+            stop=body.get("stop"),
+        )
+    return backend.chat_completion(
+        body["model"],
+        body["messages"],
+        seed=body.get("seed", NOT_GIVEN),
+        json_response="response_format" in body,
+        stop=body.get("stop"),
+    )
+
+
+def run_dry_run(
+    dataset: DatasetDict,
+    method: BaselineMethod,
+    store: DocumentStore,
+    args: argparse.Namespace,
+) -> None:
+    """Count the tokens, cost and wall time of the run without calling any API."""
+    counter = TokenCounter(
+        args.model, args.model if args.backend == "transformers" else None
+    )
+    context_window = args.context_window or get_context_window(args.model)
+    pricing = (
+        (args.price_input, args.price_output)
+        if args.price_input is not None and args.price_output is not None
+        else None
+    )
+    print(f"[+] Dry run of {args.method} with {args.model}, counting with {counter.name}")
+    totals, over_context = plan_predictions(
+        dataset, method, counter, args.plan_completion_tokens, context_window, store
+    )
+    print_plan(
+        args.model, totals, over_context, context_window, pricing, args.rpm, args.tpm
+    )
+
+    eval_counter = TokenCounter(args.eval_model)
+    print(f"[+] Judge requests with {args.eval_model}")
+    judge_totals = plan_judge(
+        dataset,
+        eval_counter,
+        args.plan_completion_tokens,
+        args.judge_batch_size,
+        args.prejudge,
+        args.judge_format,
+        args.judge_max_tokens,
+    )
+    print_plan(
+        args.eval_model,
+        {("non_refusal", "all", "judge"): judge_totals},
+        [],
+        get_context_window(args.eval_model),
+        rpm=args.eval_rpm,
+        tpm=args.eval_tpm,
+    )
+
+
+def run_predictions(
+    dataset: Dataset,
+    method: BaselineMethod,
+    store: DocumentStore,
+    args: argparse.Namespace,
+    collector: Optional[BatchCollector] = None,
+) -> Dataset:
+    if args.execution == "batch":
+        return batch_map(
+            dataset, partial(predict_async, method=method, store=store), collector
+        )
+    if args.execution == "async":
+        return async_map(
+            dataset,
+            partial(predict_async, method=method, store=store),
+            max_concurrency=args.max_concurrency,
+            desc="Predicting answers with OpenAI API",
+        )
+    return dataset.map(
+        partial(predict, method=method, store=store),
+        num_proc=args.num_parallels,
+        keep_in_memory=True,
+        desc="Predicting answers with OpenAI API",
+    )
+
+
+NON_REFUSAL_EVALUATION_FEATURE = {
+    "meta": {
+        "model": Value("string"),
+        "seed": Value("int32"),
+        "error": Value("string"),
+        "judge_format": Value("string"),
+        "prompt_version": Value("string"),
+    },
+    "score": Value("float32"),
+    "error_type": Value("string"),
+    "usage": {
+        "prompt_tokens": Value("int32"),
+        "completion_tokens": Value("int32"),
+    },
+    "justification": Value("string"),
+    "judged_by": Value("string"),
+}
+
+
+def select_judge(args: argparse.Namespace):
+    """The judge function, its asyncio version and the examples graded per call."""
+    group_size = args.judge_batch_size if args.judge_batch_size > 1 else None
+    options = {
+        "model_name": args.eval_model,
+        "seed": args.seed,
+        "prejudge": args.prejudge,
+    }
+    if args.judge_format != "text":
+        evaluate = non_refusal_evaluation_json
+        evaluate_async = non_refusal_evaluation_json_async
+        options.update(
+            judge_format=args.judge_format, max_tokens=args.judge_max_tokens
+        )
+    elif group_size is None:
+        evaluate = non_refusal_evaluation
+        evaluate_async = non_refusal_evaluation_async
+    else:
+        evaluate = non_refusal_evaluation_batch
+        evaluate_async = non_refusal_evaluation_group_async
+    return partial(evaluate, **options), partial(evaluate_async, **options), group_size
+
+
+# Settings the predicted and judged rows depend on; a --pipeline checkpoint
+# written with other values is not resumed. --tot-* and --ltm-* count too.
+PIPELINE_FINGERPRINT_ARGS = [
+    "backend",
+    "base_url",
+    "model",
+    "max_new_tokens",
+    "method",
+    "seed",
+    "n",
+    "temperature",
+    "prompt_layout",
+    "doc_format",
+    "early_stop",
+    "eval_model",
+    "judge_format",
+    "judge_max_tokens",
+    "judge_batch_size",
+    "prejudge",
+]
+
+
+def run_pipeline(
+    dataset: DatasetDict,
+    method: BaselineMethod,
+    store: DocumentStore,
+    args: argparse.Namespace,
+) -> DatasetDict:
+    """Predict both splits and judge the non_refusal answers in one stream.
+
+    Finished rows are appended to `<output_path>.partial`, and a rerun with
+    the same output path and settings skips them. The refusal and citation scores are
+    vectorized over the whole split afterwards, as without `--pipeline`.
+    """
+    _, evaluate_async, group_size = select_judge(args)
+    stages = {
+        split: [
+            Stage(
+                "predict",
+                partial(predict_async, method=method, store=store),
+                args.max_concurrency,
+            )
+        ]
+        for split in ("refusal", "non_refusal")
+    }
+    stages["non_refusal"].append(
+        Stage("judge", evaluate_async, args.max_concurrency, group_size)
+    )
+    checkpoint_dir = args.output_path.rstrip("/") + ".partial"
+    if os.path.isdir(checkpoint_dir):
+        print(f"[+] Resuming the pipeline from {checkpoint_dir}")
+    fingerprint = {
+        name: value
+        for name, value in vars(args).items()
+        if name in PIPELINE_FINGERPRINT_ARGS or name.startswith(("tot_", "ltm_"))
+    }
+    fingerprint["judge_prompt_version"] = PROMPT_VERSIONS[args.judge_format]
+    start = time.perf_counter()
+    mapped = pipeline_map(
+        {split: dataset[split] for split in stages},
+        stages,
+        queue_size=args.pipeline_queue_size,
+        checkpoint_dir=checkpoint_dir,
+        fingerprint=fingerprint,
+        column_features={"evaluation_result": NON_REFUSAL_EVALUATION_FEATURE},
+    )
+    print(
+        f"[+] Pipeline finished in {time.perf_counter() - start:.1f}s, busy time "
+        + ", ".join(
+            f"{split} {stage.name} {stage.busy_seconds:.1f}s"
+            for split in stages
+            for stage in stages[split]
+        )
+    )
+    return DatasetDict({**dataset, **mapped})
+
+
+def run_non_refusal_evaluation(
+    dataset: Dataset,
+    args: argparse.Namespace,
+    collector: Optional[BatchCollector] = None,
+) -> Dataset:
+    features = Features(
+        {**dataset.features, "evaluation_result": NON_REFUSAL_EVALUATION_FEATURE}
+    )
+    evaluate, evaluate_async, group_size = select_judge(args)
+    if args.execution == "batch":
+        return batch_map(
+            dataset,
+            evaluate_async,
+            collector,
+            features=features,
+            group_size=group_size,
+        )
+    if args.execution == "async":
+        return async_map(
+            dataset,
+            evaluate_async,
+            max_concurrency=args.max_concurrency,
+            desc="Evaluating non_refusal split",
+            features=features,
+            group_size=group_size,
+        )
+    return dataset.map(
+        evaluate,
+        batched=group_size is not None,
+        batch_size=group_size or 1000,
+        num_proc=args.num_parallels,
+        keep_in_memory=True,
+        desc="Evaluating non_refusal split",
+        features=features,
+    )
+
+
+def select_rejudged(
+    dataset: Dataset, resumed_ids: set, args: argparse.Namespace
+) -> Dataset:
+    """The evaluated non-refusal rows to judge again, with the reason of each one counted."""
+    reasons = Counter()
+
+    def selected(example):
+        reason = "resumed" if example["id"] in resumed_ids else None
+        reason = reason or rejudge_reason(
+            example, args.rejudge, args.eval_model, args.judge_format
+        )
+        reasons[reason] += 1
+        return reason is not None
+
+    # Counted in this process, hence no num_proc
+    subset = dataset.filter(selected, keep_in_memory=True)
+    if len(subset):
+        print(
+            f"[+] Re-judging {len(subset)}/{len(dataset)} non_refusal examples: "
+            + ", ".join(
+                f"{reason}={count}"
+                for reason, count in reasons.items()
+                if reason is not None
+            )
+        )
+    return subset
+
+
 def main(args: argparse.Namespace):
+    if args.judge_format != "text" and args.judge_batch_size > 1:
+        raise ValueError(
+            "The JSON judge formats grade one answer per call. Drop --judge-batch-size"
+        )
+    if args.pipeline and args.execution != "async":
+        raise ValueError(
+            "--pipeline streams examples in one event loop. Use --execution async"
+        )
+    configure_clients(
+        max_connections=args.max_connections,
+        max_keepalive_connections=args.max_keepalive_connections,
+        keepalive_expiry=args.keepalive_expiry,
+        timeout=args.request_timeout,
+        **({"http2": args.http2} if args.http2 is not None else {}),
+    )
+    # Forked workers each hold their own pool, so split the quota between them.
+    # Async and batch execution run the model and the judge in one event loop.
+    num_workers = args.num_parallels if args.execution == "process" else 1
+    quotas = {}
+    for model_name, rpm, tpm in (
+        (args.eval_model, args.eval_rpm, args.eval_tpm),
+        (args.model, args.rpm, args.tpm),
+    ):
+        if model_name in quotas:
+            # The answers and the judge share the rate limits of the same model
+            print(
+                f"[+] {model_name} answers and judges: sharing the stricter of"
+                " --rpm/--eval-rpm and --tpm/--eval-tpm"
+            )
+            rpm = min(filter(None, (rpm, quotas[model_name][0])), default=None)
+            tpm = min(filter(None, (tpm, quotas[model_name][1])), default=None)
+        quotas[model_name] = (rpm, tpm)
+    for model_name, (rpm, tpm) in quotas.items():
+        configure_scheduler(
+            model_name,
+            rpm=rpm / num_workers if rpm else None,
+            tpm=tpm / num_workers if tpm else None,
+            max_concurrency=args.max_concurrency,
+        )
+    configure_retries(max_retries=args.max_retries)
+    configure_judge_cache(
+        enabled=args.judge_cache,
+        path=args.judge_cache_path,
+        max_entries=args.judge_cache_size,
+        read=not args.overwrite_evaluate,
+    )
     print(f"Loading dataset: {args.dataset}")
-    dataset = load_dataset(args.dataset)
+    dataset, store = load_crest_dataset(args.dataset)
     print(f"[+] Dataset loaded. Use language: {args.lang}")
-    dataset = dataset.filter(lambda x: json.loads(x["meta"])["language"] in args.lang)
+    # Row order is kept from here on, so the indexes stay valid for aggregation
+    indexes = {split: MetadataIndex(dataset[split]) for split in dataset}
+    for split in dataset:
+        rows = indexes[split].select_by(language=args.lang)
+        dataset[split] = dataset[split].select(rows)
+        indexes[split] = indexes[split].take(rows)
+
+    if args.backend == "transformers":
+        if args.execution == "batch":
+            raise ValueError("The transformers backend does not support batch jobs")
+        if args.execution == "process":
+            print(
+                "[!] Every worker process loads its own copy of the model. "
+                "Use `--execution async` to batch prompts into shared generate calls",
+                file=sys.stderr,
+            )
+        if args.n > 1:
+            print(
+                "[!] The transformers backend decodes greedily, so the --n samples are identical",
+                file=sys.stderr,
+            )
+        backend = get_backend(
+            "transformers",
+            model_name_or_path=args.model,
+            device=args.device,
+            max_new_tokens=args.max_new_tokens,
+            batch_size=args.local_batch_size,
+        )
+    else:
+        backend = get_backend(
+            "openai", base_url=args.base_url, api_key=args.api_key, stream=args.stream
+        )
+    method_backend = backend
+    if args.response_cache != "off":
+        cache = SQLiteCache(
+            args.response_cache_path or default_response_cache_path(),
+            max_bytes=int(args.response_cache_max_mb * 1024 * 1024),
+            ttl=args.response_cache_ttl,
+        )
+        method_backend = CachedBackend(backend, cache, mode=args.response_cache)
+        print(f"[+] Response cache ({args.response_cache}): {cache.path}")
+    method_kwargs = {
+        "backend": method_backend,
+        "prompt_layout": args.prompt_layout,
+        "early_stop": args.early_stop,
+        "doc_format": args.doc_format,
+        "n": args.n,
+        "temperature": args.temperature,
+    }
 
     if args.method == "direct":
-        method = BaselineMethod(args.model, args.seed)
+        method = BaselineMethod(args.model, args.seed, **method_kwargs)
     elif args.method == "cot_reasoning_model":
-        method = CoTMethod(args.model, args.seed, reasoning=True)
+        method = CoTMethod(args.model, args.seed, reasoning=True, **method_kwargs)
     elif args.method == "cot":
-        method = CoTMethod(args.model, args.seed)
+        method = CoTMethod(args.model, args.seed, **method_kwargs)
     elif args.method == "cod":
-        method = CoDMethod(args.model, args.seed)
+        method = CoDMethod(args.model, args.seed, **method_kwargs)
     elif args.method == "semi_structured":
-        method = SemiStructuredMethod(args.model, args.seed)
+        method = SemiStructuredMethod(args.model, args.seed, **method_kwargs)
     elif args.method == "tot":
-        method = TreeOfThoughtMethod(args.model, args.seed)
+        method = TreeOfThoughtMethod(
+            args.model,
+            args.seed,
+            batch_scoring=args.tot_batch_scoring,
+            stop_confidence=args.tot_stop_confidence,
+            prune_impossible=args.tot_prune_impossible,
+            max_tokens=args.tot_max_tokens,
+            max_calls=args.tot_max_calls,
+            max_seconds=args.tot_max_seconds,
+            **method_kwargs,
+        )
     elif args.method == "least_to_most":
-        method = LeastToMostMethod(args.model, args.seed)
+        method = LeastToMostMethod(
+            args.model, args.seed, solve_mode=args.ltm_solve_mode, **method_kwargs
+        )
     elif args.method == "plan_and_solve":
-        method = PlanAndSolveMethod(args.model, args.seed)
+        method = PlanAndSolveMethod(args.model, args.seed, **method_kwargs)
     else:
         raise ValueError(f"Invalid method: {args.method}")
 
-    cached = False
-    for split in ("refusal", "non_refusal"):
-        if args.num_samples is not None:
-            dataset[split] = (
-                dataset[split].shuffle(args.seed).select(range(args.num_samples))
+    collector = None
+    if args.execution == "batch":
+        if args.batch_endpoint == "local":
+            endpoint = LocalBatchEndpoint(
+                responder=partial(answer_batch_request, args.model, backend)
             )
-        if "predicted_answer" in dataset[split].column_names:
-            print(f"[+] {split} split is already predicted. Skipping...")
-            cached = True
-            continue
-        print(f"[+] Generating {len(dataset[split])} Answers for {split} split...")
-
-        dataset[split] = dataset[split].map(
-            partial(predict, method=method),
-            num_proc=args.num_parallels,
-            keep_in_memory=True,
-            desc="Predicting answers with OpenAI API",
-        )
-        # filter
-        dataset[split] = dataset[split].filter(
-            lambda x: x["predicted_answer"] != "", num_proc=args.num_parallels
+        elif args.base_url is not None:
+            raise ValueError("Use `--batch-endpoint local` with --base-url")
+        else:
+            endpoint = OpenAIBatchEndpoint()
+        collector = BatchCollector(
+            endpoint, args.batch_dir, poll_interval=args.batch_poll_interval
         )
-        print(f"[+] {split} split has {len(dataset[split])} answers")
 
+    if args.num_samples is not None:
+        for split in ("refusal", "non_refusal"):
+            # Same rows as `shuffle(args.seed).select(range(args.num_samples))`
+            rows = np.random.default_rng(args.seed).permutation(len(dataset[split]))
+            rows = rows[: args.num_samples]
+            dataset[split] = dataset[split].select(rows)
+            indexes[split] = indexes[split].take(rows)
+
+    if args.dry_run:
+        run_dry_run(dataset, method, store, args)
+        return
+
+    cached = any(
+        "predicted_answer" in dataset[split].column_names
+        for split in ("refusal", "non_refusal")
+    )
     if args.output_path is None:
         if cached:
             print(
@@ -149,77 +931,162 @@ def main(args: argparse.Namespace):
             timestamp = datetime.now().strftime("%y%m%d-%H%M%S")
             args.output_path = f"outputs/{model_base_name}_{args.method}_{eval_model}_{timestamp}"
             print(f"[+] Save path is not provided. Saving to {args.output_path}")
+            if args.pipeline:
+                print(
+                    "[!] The --pipeline checkpoint is only found again with the same"
+                    f" save path. Pass --output-path {args.output_path} to resume it",
+                    file=sys.stderr,
+                )
+
+    resumed = False
+    # Rows predicted again by --resume, judged again below
+    resumed_ids = {"refusal": set(), "non_refusal": set()}
+    pipelined = args.pipeline and not cached
+    if args.pipeline and cached:
+        print(
+            "[!] --pipeline is ignored: the dataset is already predicted,"
+            " so it is evaluated by phase",
+            file=sys.stderr,
+        )
+    if pipelined:
+        dataset = run_pipeline(dataset, method, store, args)
+    for split in ("refusal", "non_refusal"):
+        if pipelined:
+            pass
+        elif "predicted_answer" in dataset[split].column_names:
+            if not args.resume:
+                print(f"[+] {split} split is already predicted. Skipping...")
+                continue
+            if "predict_status" not in dataset[split].column_names:
+                dataset[split] = dataset[split].map(
+                    lambda x: {"predict_status": default_predict_status(x)},
+                    keep_in_memory=True,
+                )
+            failed = dataset[split].filter(prediction_failed, keep_in_memory=True)
+            if len(failed) == 0:
+                print(f"[+] {split} split has no missing or failed predictions.")
+                continue
+            print(f"[+] Resuming {len(failed)} failed predictions for {split} split...")
+            failed = run_predictions(failed, method, store, args, collector)
+            dataset[split] = merge_by_id(dataset[split], failed)
+            resumed_ids[split] = set(failed["id"])
+            resumed = True
+        else:
+            print(f"[+] Generating {len(dataset[split])} Answers for {split} split...")
+            dataset[split] = run_predictions(
+                dataset[split], method, store, args, collector
+            )
+
+        num_failed = sum(
+            status["status"] != "ok" for status in dataset[split]["predict_status"]
+        )
+        print(f"[+] {split} split has {len(dataset[split]) - num_failed} answers")
+        usage = dataset[split]["predict_usage"]
+        prompt_tokens = sum(u["prompt_tokens"] or 0 for u in usage)
+        cached_tokens = sum(u.get("cached_tokens") or 0 for u in usage)
+        print(
+            f"[+] {split} split used {prompt_tokens} prompt tokens,"
+            f" {cached_tokens / max(prompt_tokens, 1):.2%} served from the prefix cache"
+        )
+        if args.response_cache != "off":
+            num_calls = sum(u["num_calls"] or 0 for u in usage)
+            cache_hits = sum(u.get("cache_hits") or 0 for u in usage)
+            print(
+                f"[+] {split} split replayed {cache_hits}/{num_calls} calls"
+                " from the response cache"
+            )
+        print_latency_summary(split, usage)
+        if num_failed:
+            print(
+                f"[!] {num_failed} predictions failed in {split} split."
+                " Rerun with --resume to retry them.",
+                file=sys.stderr,
+            )
 
-    if not cached:
+    if not cached or resumed:
         print("[+] Saving model prediction results...")
-        safe_save(dataset, args.output_path)
+        safe_save(dataset, args.output_path, store)
 
     print("[+] Evaluating Answers...")
     eval_cached = True
     if (
         "evaluation_result" not in dataset["refusal"].column_names
         or args.overwrite_evaluate
+        or resumed_ids["refusal"]
     ):
-        dataset["refusal"] = dataset["refusal"].map(
-            refusal_evaluation,
-            num_proc=args.num_parallels,
-            keep_in_memory=True,
-            desc="Evaluating refusal split",
-        )
+        # Cheap enough to score the whole split again after a resume
+        dataset["refusal"] = refusal_evaluation_batched(dataset["refusal"])
         eval_cached = False
     else:
         print("[!] Refusal evaluation is already done. Skipping...")
 
-    if (
+    if pipelined:
+        # Judged while predicting
+        judged = dataset["non_refusal"]
+    elif (
         "evaluation_result" not in dataset["non_refusal"].column_names
         or args.overwrite_evaluate
     ):
-        dataset["non_refusal"] = dataset["non_refusal"].map(
-            partial(non_refusal_evaluation, model_name=args.eval_model, seed=args.seed),
-            num_proc=args.num_parallels,
-            keep_in_memory=True,
-            desc="Evaluating non_refusal split",
-            features=Features(
-                {
-                    **dataset["non_refusal"].features,
-                    "evaluation_result": {
-                        "meta": {
-                            "model": Value("string"),
-                            "seed": Value("int32"),
-                            "error": Value("string"),
-                        },
-                        "score": Value("float32"),
-                        "error_type": Value("string"),
-                        "usage": {
-                            "prompt_tokens": Value("int32"),
-                            "completion_tokens": Value("int32"),
-                        },
-                        "justification": Value("string"),
-                    },
-                }
-            ),
+        judged = dataset["non_refusal"] = run_non_refusal_evaluation(
+            dataset["non_refusal"], args, collector
         )
-        eval_cached = False
     else:
-        print("[!] non_refusal evaluation is already done. Skipping...")
+        judged = select_rejudged(
+            dataset["non_refusal"], resumed_ids["non_refusal"], args
+        )
+        if len(judged):
+            judged = run_non_refusal_evaluation(
+                judged.remove_columns("evaluation_result"), args, collector
+            )
+            dataset["non_refusal"] = merge_column_by_id(
+                dataset["non_refusal"], judged, "evaluation_result"
+            )
+        else:
+            print("[!] non_refusal evaluation is already done. Skipping...")
+    if len(judged):
+        eval_cached = False
+        judged_by = Counter(
+            result["judged_by"] for result in judged["evaluation_result"]
+        )
+        decided_locally = sum(
+            count for path, count in judged_by.items() if path in PREJUDGE_PATHS
+        )
+        print(
+            f"[+] Decided without the judge: {decided_locally}/{len(judged)}"
+            f" ({decided_locally / max(len(judged), 1):.1%}) "
+            + ", ".join(f"{path}={judged_by[path]}" for path in PREJUDGE_PATHS)
+        )
+        num_lookups = judged_by["cache"] + judged_by["llm"]
+        if args.judge_cache and num_lookups:
+            print(
+                f"[+] Judge cache: {judged_by['cache']} hits, {judged_by['llm']} misses"
+                f" ({judged_by['cache'] / num_lookups:.1%} hit rate)"
+            )
     # Citation
-    dataset["non_refusal"] = dataset["non_refusal"].map(
-        citation_evaluation,
-        num_proc=args.num_parallels,
-        keep_in_memory=True,
-        desc="Evaluating citation split",
-    )
+    dataset["non_refusal"] = citation_evaluation_batched(dataset["non_refusal"])
 
     if not eval_cached:
         print("[+] Saving Final Result...")
-        safe_save(dataset, args.output_path)
+        safe_save(dataset, args.output_path, store)
+    if pipelined:
+        shutil.rmtree(args.output_path.rstrip("/") + ".partial")
 
     print("[+] Aggregating Metrics...")
+    for split in ("refusal", "non_refusal"):
+        num_failed = int(prediction_failed_rows(dataset[split]).sum())
+        if num_failed:
+            print(
+                f"[!] {num_failed} failed predictions of {split} split"
+                " are excluded from the scores",
+                file=sys.stderr,
+            )
     for split in ("refusal", "non_refusal"):
         for language in ("en", "ko"):
             for difficulty_type in ("SimpleQA", "ComplexQA"):
                 correct_rate, partially_correct_rate, wrong_rate, num_invalid = (
-                    aggregate_score(dataset[split], language, [difficulty_type])
+                    aggregate_score(
+                        dataset[split], language, [difficulty_type], indexes[split]
+                    )
                 )
                 print(
                     f"[{split}] {language}/{difficulty_type} [Correct/Partial/Wrong]: {correct_rate:.2%}, {partially_correct_rate:.2%}, {wrong_rate:.2%}"
@@ -227,13 +1094,13 @@ def main(args: argparse.Namespace):
                 )
                 if split == "non_refusal":
                     citation_precision, citation_recall = aggregate_citation_score(
-                        dataset[split], language, difficulty_type
+                        dataset[split], language, difficulty_type, indexes[split]
                     )
                     print(
                         f"[citation] {language}/{difficulty_type} Precision/Recall: {citation_precision:.2%}, {citation_recall:.2%}"
                     )
             correct_rate, partially_correct_rate, wrong_rate, num_invalid = (
-                aggregate_score(dataset[split], language)
+                aggregate_score(dataset[split], language, index=indexes[split])
             )
             print(
                 f"[{split}] {language}/all [Correct/Partial/Wrong]: {correct_rate:.2%}, {partially_correct_rate:.2%}, {wrong_rate:.2%}"
@@ -243,10 +1110,12 @@ def main(args: argparse.Namespace):
     # Calculate Unified Score
     for language in ("en", "ko"):
         for difficulty_type in ("SimpleQA", "ComplexQA"):
-            unified_score = calculate_unified_score(dataset, language, [difficulty_type])
+            unified_score = calculate_unified_score(
+                dataset, language, [difficulty_type], indexes
+            )
             print(f"[{language}/{difficulty_type}] Unified Score: {unified_score:.2%}")
         unified_score = calculate_unified_score(
-            dataset, language, ["SimpleQA", "ComplexQA"]
+            dataset, language, ["SimpleQA", "ComplexQA"], indexes
         )
         print(f"[{language}/all] Unified Score: {unified_score:.2%}")
 